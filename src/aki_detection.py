@@ -0,0 +1,136 @@
+from collections import deque
+import numpy as np
+from time_codec import SECONDS_PER_DAY
+
+# KDIGO criteria: an increase of more than 0.3 mg/dL within 48 hours, or to more than 1.5 times of an earlier value
+# within 7 days. only measurements taken after admission are used as the earlier (baseline) value
+WINDOW_2_DAY = 2 * SECONDS_PER_DAY
+WINDOW_7_DAY = 7 * SECONDS_PER_DAY
+
+
+def detect_aki(creatinine_list, start_time):
+    # creatinine_list is a list of [value, test_time] sorted by test_time, measurements equal to 0 are ignored.
+    # for every measurement the minimum earlier value of the 48 hours window and the minimum positive (maximum
+    # negative) earlier value of the 7 days window are kept in monotone deques, so a visit takes linear time.
+    # since the rounded difference and ratio are monotone in the earlier value, comparing with the window extreme
+    # gives exactly the same result as comparing with every earlier value.
+    # return aki_2_day, aki_7_day, aki_time (days from admission to the first AKI measurement, -1 if no AKI)
+    aki_2_day, aki_7_day, aki_time = 0, 0, -1
+    min_2_day, min_positive_7_day, max_negative_7_day = deque(), deque(), deque()
+    for index in range(len(creatinine_list)):
+        value, test_time = creatinine_list[index]
+        while len(min_2_day) > 0 and test_time - creatinine_list[min_2_day[0]][1] >= WINDOW_2_DAY:
+            min_2_day.popleft()
+        while len(min_positive_7_day) > 0 and test_time - creatinine_list[min_positive_7_day[0]][1] >= WINDOW_7_DAY:
+            min_positive_7_day.popleft()
+        while len(max_negative_7_day) > 0 and test_time - creatinine_list[max_negative_7_day[0]][1] >= WINDOW_7_DAY:
+            max_negative_7_day.popleft()
+        if value == 0:
+            continue
+
+        triggered = False
+        if len(min_2_day) > 0 and value - creatinine_list[min_2_day[0]][0] > 0.3:
+            aki_2_day, triggered = 1, True
+        if len(min_positive_7_day) > 0 and value / creatinine_list[min_positive_7_day[0]][0] > 1.5:
+            aki_7_day, triggered = 1, True
+        if len(max_negative_7_day) > 0 and value / creatinine_list[max_negative_7_day[0]][0] > 1.5:
+            aki_7_day, triggered = 1, True
+        if triggered:
+            difference_from_start = (test_time - start_time) / SECONDS_PER_DAY
+            if aki_time == -1 or difference_from_start < aki_time:
+                aki_time = difference_from_start
+
+        if test_time < start_time:
+            continue
+        while len(min_2_day) > 0 and creatinine_list[min_2_day[-1]][0] >= value:
+            min_2_day.pop()
+        min_2_day.append(index)
+        if value > 0:
+            while len(min_positive_7_day) > 0 and creatinine_list[min_positive_7_day[-1]][0] >= value:
+                min_positive_7_day.pop()
+            min_positive_7_day.append(index)
+        else:
+            while len(max_negative_7_day) > 0 and creatinine_list[max_negative_7_day[-1]][0] <= value:
+                max_negative_7_day.pop()
+            max_negative_7_day.append(index)
+    return aki_2_day, aki_7_day, aki_time
+
+
+def detect_aki_batch(creatinine_list_list, start_time_list, batch_size=500000):
+    # vectorized detect_aki over many visits, returns one (aki_2_day, aki_7_day, aki_time) tuple per visit.
+    # visits are processed in batches of about batch_size measurements to bound the memory of the range tables
+    result_list = list()
+    batch_start = 0
+    while batch_start < len(creatinine_list_list):
+        batch_end, measurement_num = batch_start, 0
+        while batch_end < len(creatinine_list_list) and (batch_end == batch_start or
+                                                         measurement_num < batch_size):
+            measurement_num += len(creatinine_list_list[batch_end])
+            batch_end += 1
+        result_list.extend(_detect_aki_array(creatinine_list_list[batch_start: batch_end],
+                                             start_time_list[batch_start: batch_end]))
+        batch_start = batch_end
+    return result_list
+
+
+def _detect_aki_array(creatinine_list_list, start_time_list):
+    visit_num = len(creatinine_list_list)
+    length_array = np.array([len(creatinine_list) for creatinine_list in creatinine_list_list], dtype=np.int64)
+    if length_array.sum() == 0:
+        return [(0, 0, -1)] * visit_num
+    group = np.repeat(np.arange(visit_num, dtype=np.int64), length_array)
+    value = np.array([item[0] for creatinine_list in creatinine_list_list for item in creatinine_list],
+                     dtype=np.float64)
+    test_time = np.array([item[1] for creatinine_list in creatinine_list_list for item in creatinine_list],
+                         dtype=np.int64)
+    start_time = np.array(start_time_list, dtype=np.int64)[group]
+    position = np.arange(len(value), dtype=np.int64)
+
+    # a measurement can be the earlier value of a later measurement of the same visit if it is taken after admission
+    eligible = (value != 0) & (test_time >= start_time)
+    time_min = test_time.min()
+    span = int(test_time.max() - time_min) + WINDOW_7_DAY + 1
+    key = group * span + (test_time - time_min)
+
+    left_2_day = np.searchsorted(key, key - WINDOW_2_DAY + 1, side='left')
+    left_7_day = np.searchsorted(key, key - WINDOW_7_DAY + 1, side='left')
+    min_2_day = _range_query(np.where(eligible, value, np.inf), left_2_day, position, np.minimum, np.inf)
+    min_positive_7_day = _range_query(np.where(eligible & (value > 0), value, np.inf), left_7_day, position,
+                                      np.minimum, np.inf)
+    max_negative_7_day = _range_query(np.where(eligible & (value < 0), value, -np.inf), left_7_day, position,
+                                      np.maximum, -np.inf)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        trigger_2_day = (value != 0) & np.isfinite(min_2_day) & (value - min_2_day > 0.3)
+        trigger_7_day = (value != 0) & ((np.isfinite(min_positive_7_day) & (value / min_positive_7_day > 1.5)) |
+                                        (np.isfinite(max_negative_7_day) & (value / max_negative_7_day > 1.5)))
+    triggered = trigger_2_day | trigger_7_day
+
+    aki_2_day = np.zeros(visit_num, dtype=np.int64)
+    aki_7_day = np.zeros(visit_num, dtype=np.int64)
+    aki_time = np.full(visit_num, np.inf)
+    np.maximum.at(aki_2_day, group[trigger_2_day], 1)
+    np.maximum.at(aki_7_day, group[trigger_7_day], 1)
+    np.minimum.at(aki_time, group[triggered], (test_time[triggered] - start_time[triggered]) / SECONDS_PER_DAY)
+    return [(int(aki_2_day[index]), int(aki_7_day[index]),
+             float(aki_time[index]) if np.isfinite(aki_time[index]) else -1) for index in range(visit_num)]
+
+
+def _range_query(array, left, right, operation, empty_value):
+    # operation (np.minimum / np.maximum) over array[left[k]: right[k]] for every k, using a sparse table
+    length = right - left
+    result = np.full(len(left), empty_value)
+    table = array
+    level = 0
+    level_array = np.zeros(len(left), dtype=np.int64)
+    nonempty = length > 0
+    level_array[nonempty] = np.frexp(length[nonempty])[1] - 1
+    while True:
+        selected = nonempty & (level_array == level)
+        if selected.any():
+            result[selected] = operation(table[left[selected]], table[right[selected] - (1 << level)])
+        if (1 << (level + 1)) > len(array) or not (level_array > level).any():
+            break
+        table = operation(table[:len(table) - (1 << level)], table[(1 << level):])
+        level += 1
+    return result
@@ -0,0 +1,144 @@
+import csv
+import json
+import os
+import shutil
+import time
+import read_raw_mimic_data
+from read_raw_mimic_data import get_admissions, get_sex_age, get_diagnosis, get_procedure, scan_lab_test, get_event, \
+    get_vital_sign, get_medicine, get_lab_test, egfr_calculation, reconstruct, get_feature_dict
+from synthetic_mimic import generate_synthetic_mimic
+from table_scan import resolve_table_path
+
+
+def main():
+    benchmark_root = os.path.abspath('../resource/benchmark')
+    mapping_root = os.path.abspath('../resource/reproduce_mapping')
+    # patients of the 1x data set, every scale multiplies it (MIMIC-III contains 46,520 patients)
+    base_patient_num = 1000
+    scale_list = [1, 10, 100]
+    # every extractor is run repeat times, the fastest run is reported
+    repeat = 3
+    seed = 0
+    result_path = os.path.join(benchmark_root, 'benchmark_result.csv')
+
+    result_list = list()
+    for scale in scale_list:
+        resource_root = os.path.join(benchmark_root, 'scale_{}'.format(scale))
+        prepare_synthetic_resource(resource_root, mapping_root, base_patient_num * scale, seed)
+        print('scale {}x data prepared'.format(scale))
+        for function_name, second, input_byte in benchmark_extractor(resource_root, repeat):
+            result_list.append([scale, function_name, second, input_byte])
+            print_result(scale, function_name, second, input_byte)
+        for function_name, second, input_byte in benchmark_full_extraction(resource_root):
+            result_list.append([scale, function_name, second, input_byte])
+            print_result(scale, function_name, second, input_byte)
+
+    with open(result_path, 'w', encoding='utf-8', newline='') as file:
+        csv_writer = csv.writer(file)
+        csv_writer.writerow(['scale', 'function', 'second', 'input_mb', 'mb_per_second'])
+        for scale, function_name, second, input_byte in result_list:
+            csv_writer.writerow([scale, function_name, round(second, 4), round(input_byte / 1024 / 1024, 3),
+                                 round(input_byte / 1024 / 1024 / second, 3) if second > 0 else 0])
+
+
+def prepare_synthetic_resource(resource_root, mapping_root, patient_num, seed):
+    # a resource folder (raw_data, reproduce_mapping) with synthetic tables. generating the large scales takes a
+    # while, so existing tables are reused if they were generated with the same parameters
+    parameter_path = os.path.join(resource_root, 'synthetic_parameter.json')
+    parameter_dict = {'patient_num': patient_num, 'seed': seed}
+    if os.path.exists(parameter_path):
+        with open(parameter_path, 'r', encoding='utf-8') as file:
+            if json.load(file) == parameter_dict:
+                return
+    if os.path.exists(resource_root):
+        shutil.rmtree(resource_root)
+    generate_synthetic_mimic(os.path.join(resource_root, 'raw_data'), mapping_root, patient_num, seed)
+    shutil.copytree(mapping_root, os.path.join(resource_root, 'reproduce_mapping'))
+    with open(parameter_path, 'w', encoding='utf-8') as file:
+        json.dump(parameter_dict, file)
+
+
+def benchmark_extractor(resource_root, repeat=3):
+    # time every extractor of read_raw_mimic_data.py on its own (cache disabled, one process, no ITEMID index).
+    # return [function name, seconds of the fastest run, bytes of the tables it reads]
+    data_root = os.path.join(resource_root, 'raw_data')
+    mapping_root = os.path.join(resource_root, 'reproduce_mapping')
+    save_root = os.path.join(resource_root, 'benchmark_cache')
+    if os.path.exists(save_root):
+        shutil.rmtree(save_root)
+    os.makedirs(save_root)
+    path_dict = {table_name: resolve_table_path(data_root, table_name) for table_name in
+                 ['admissions', 'patients', 'diagnoses_icd', 'procedures_icd', 'labevents', 'chartevents',
+                  'prescriptions']}
+    lab_mapping_path = os.path.join(mapping_root, 'lab_test_list.csv')
+    diagnosis_mapping_path = os.path.join(mapping_root, 'disease_list.csv')
+    medicine_mapping_path = os.path.join(mapping_root, 'drug_list.csv')
+    operation_mapping_path = os.path.join(mapping_root, 'operation_list.csv')
+    cache_key = 'benchmark'
+
+    result_list = list()
+
+    def _measure(function_name, table_list, function, *args, **kwargs):
+        second_list = list()
+        result = None
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            result = function(*args, **kwargs)
+            second_list.append(time.perf_counter() - start_time)
+        result_list.append([function_name, min(second_list),
+                            sum(os.path.getsize(path_dict[table_name]) for table_name in table_list)])
+        return result
+
+    visit_dict, visit_index = _measure('get_admissions', ['admissions'], get_admissions, path_dict['admissions'],
+                                       save_root, read_from_cache=False, cache_key=cache_key)
+    age_sex_dict = _measure('get_sex_age', ['patients'], get_sex_age, visit_dict, save_root, path_dict['patients'],
+                            read_from_cache=False, cache_key=cache_key)
+    diagnosis_table = _measure('get_diagnosis', ['diagnoses_icd'], get_diagnosis, visit_index, save_root,
+                               path_dict['diagnoses_icd'], diagnosis_mapping_path, read_from_cache=False,
+                               cache_key=cache_key)
+    operation_table = _measure('get_procedure', ['procedures_icd'], get_procedure, visit_index, save_root,
+                               path_dict['procedures_icd'], operation_mapping_path, read_from_cache=False,
+                               cache_key=cache_key)
+    _measure('scan_lab_test', ['labevents'], scan_lab_test, visit_index, path_dict['labevents'], lab_mapping_path)
+    event_dict = _measure('get_event', ['labevents'], get_event, visit_dict, visit_index, save_root,
+                          path_dict['labevents'], read_from_cache=False, cache_key=cache_key)
+    vital_sign_table = _measure('get_vital_sign', ['chartevents'], get_vital_sign, visit_index, save_root,
+                                path_dict['chartevents'], read_from_cache=False, cache_key=cache_key)
+    medicine_table = _measure('get_medicine', ['prescriptions'], get_medicine, visit_dict, visit_index, save_root,
+                              path_dict['prescriptions'], medicine_mapping_path, read_from_cache=False,
+                              cache_key=cache_key)
+    lab_test_table = _measure('get_lab_test', ['labevents'], get_lab_test, visit_index, save_root,
+                              path_dict['labevents'], lab_mapping_path, read_from_cache=False, cache_key=cache_key)
+    egfr_dict = _measure('egfr_calculation', [], egfr_calculation, visit_dict, age_sex_dict, lab_test_table)
+    feature_dict = get_feature_dict(operation_mapping_path, medicine_mapping_path, lab_mapping_path,
+                                    diagnosis_mapping_path)
+    _measure('reconstruct', [], reconstruct, visit_dict, operation_table, event_dict, age_sex_dict, vital_sign_table,
+             medicine_table, lab_test_table, diagnosis_table, egfr_dict,
+             os.path.join(save_root, 'mimic_unpreprocessed.csv'), feature_dict)
+    shutil.rmtree(save_root)
+    return result_list
+
+
+def benchmark_full_extraction(resource_root):
+    # time read_raw_mimic_data.py with its settings, once without any cache (which also builds the ITEMID indexes
+    # and the caches) and once more with all caches valid
+    all_table_byte = sum(os.path.getsize(os.path.join(resource_root, 'raw_data', file_name))
+                         for file_name in os.listdir(os.path.join(resource_root, 'raw_data')))
+    cache_root = os.path.join(resource_root, 'reproduce_cache')
+    if os.path.exists(cache_root):
+        shutil.rmtree(cache_root)
+    result_list = list()
+    for function_name in ['full_extraction_cold', 'full_extraction_cached']:
+        start_time = time.perf_counter()
+        read_raw_mimic_data.main(resource_root)
+        result_list.append([function_name, time.perf_counter() - start_time, all_table_byte])
+    return result_list
+
+
+def print_result(scale, function_name, second, input_byte):
+    print('{}x {}: {:.3f} s, {:.1f} MB/s'.format(scale, function_name, second,
+                                                 input_byte / 1024 / 1024 / second if second > 0 else 0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+import hashlib
+import os
+import numpy as np
+from visit_table import VisitIndex, VisitTable
+
+# increase it whenever the content of the extractor outputs changes, so that all existing caches are rebuilt
+CACHE_VERSION = 3
+
+# kind of a cached value
+KIND_INT = 0
+KIND_FLOAT = 1
+KIND_TEXT = 2
+KIND_TIME = 3
+
+
+def get_cache_key(raw_path_list, mapping_path_list, parameter_list=()):
+    # raw tables are identified by their size and modification time (hashing tens of GB is too slow), mapping files
+    # are small and hashed by content
+    digest = hashlib.sha1()
+    digest.update('version:{}'.format(CACHE_VERSION).encode('utf-8'))
+    for path in raw_path_list:
+        digest.update('raw:{}:{}:{}'.format(os.path.basename(path), os.path.getsize(path),
+                                            os.path.getmtime(path)).encode('utf-8'))
+    for path in mapping_path_list:
+        with open(path, 'rb') as file:
+            digest.update(b'mapping:' + hashlib.sha1(file.read()).digest())
+    for parameter in parameter_list:
+        digest.update('parameter:{}'.format(parameter).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def get_visit_key_digest(visit_key_list):
+    # digest of a list of (patient_id, visit_id), used as a cache key parameter of the tables of these visits
+    digest = hashlib.sha1()
+    for patient_id, visit_id in visit_key_list:
+        digest.update('{},{};'.format(patient_id, visit_id).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def is_cache_valid(cache_path, cache_key):
+    if not os.path.exists(cache_path):
+        return False
+    with np.load(cache_path, allow_pickle=False) as data:
+        return str(data['cache_key']) == cache_key
+
+
+def save_nested_cache(cache_path, cache_key, nested_dict, time_feature_set=()):
+    # store a patient_id -> visit_id -> feature -> value dict in a typed columnar (npz) format. a value is an int,
+    # a float or a string, or a [value, time] pair. times are int epoch seconds in memory and datetime64 on disk, the
+    # features listed in time_feature_set are times as well. feature names and strings are dictionary encoded
+    patient_list, visit_list, feature_code_list, kind_list, value_list, text_code_list, time_list, paired_list = \
+        list(), list(), list(), list(), list(), list(), list(), list()
+    feature_code_dict, text_code_dict = dict(), dict()
+    for patient_id in nested_dict:
+        for visit_id in nested_dict[patient_id]:
+            for feature in nested_dict[patient_id][visit_id]:
+                value = nested_dict[patient_id][visit_id][feature]
+                time = None
+                paired = isinstance(value, (list, tuple))
+                if paired:
+                    value, time = value
+                if not feature_code_dict.__contains__(feature):
+                    feature_code_dict[feature] = len(feature_code_dict)
+                text_code = -1
+                if time_feature_set.__contains__(feature):
+                    kind, time, value = KIND_TIME, value, 0
+                elif isinstance(value, str):
+                    if not text_code_dict.__contains__(value):
+                        text_code_dict[value] = len(text_code_dict)
+                    kind, text_code, value = KIND_TEXT, text_code_dict[value], 0
+                elif isinstance(value, float):
+                    kind = KIND_FLOAT
+                else:
+                    kind = KIND_INT
+                patient_list.append(int(patient_id))
+                visit_list.append(int(visit_id))
+                feature_code_list.append(feature_code_dict[feature])
+                kind_list.append(kind)
+                value_list.append(value)
+                text_code_list.append(text_code)
+                time_list.append(time)
+                paired_list.append(paired)
+
+    temp_path = cache_path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        np.savez(file,
+                 cache_key=np.array(cache_key),
+                 patient_id=np.array(patient_list, dtype=np.int64),
+                 visit_id=np.array(visit_list, dtype=np.int64),
+                 feature_code=np.array(feature_code_list, dtype=np.int32),
+                 feature_name=np.array(list(feature_code_dict), dtype=np.str_),
+                 kind=np.array(kind_list, dtype=np.int8),
+                 value=np.array(value_list, dtype=np.float64),
+                 text_code=np.array(text_code_list, dtype=np.int32),
+                 text=np.array(list(text_code_dict), dtype=np.str_),
+                 time=np.array(time_list, dtype='datetime64[s]'),
+                 paired=np.array(paired_list, dtype=np.bool_))
+    os.replace(temp_path, cache_path)
+
+
+def load_nested_cache(cache_path, cache_key):
+    # return None if the cache does not exist or was built from other inputs
+    if not os.path.exists(cache_path):
+        return None
+    with np.load(cache_path, allow_pickle=False) as data:
+        if cache_key is not None and str(data['cache_key']) != cache_key:
+            return None
+        feature_name = data['feature_name'].tolist()
+        text = data['text'].tolist()
+        column_list = [data['patient_id'].tolist(), data['visit_id'].tolist(), data['feature_code'].tolist(),
+                       data['kind'].tolist(), data['value'].tolist(), data['text_code'].tolist(),
+                       data['time'].astype(np.int64).tolist(), data['paired'].tolist()]
+
+    nested_dict = dict()
+    for patient_id, visit_id, feature_code, kind, value, text_code, time, paired in zip(*column_list):
+        patient_id, visit_id = str(patient_id), str(visit_id)
+        if kind == KIND_INT:
+            value = int(value)
+        elif kind == KIND_TEXT:
+            value = text[text_code]
+        elif kind == KIND_TIME:
+            value = time
+        if paired:
+            value = [value, time]
+        if not nested_dict.__contains__(patient_id):
+            nested_dict[patient_id] = dict()
+        if not nested_dict[patient_id].__contains__(visit_id):
+            nested_dict[patient_id][visit_id] = dict()
+        nested_dict[patient_id][visit_id][feature_name[feature_code]] = value
+    return nested_dict
+
+
+def save_table_cache(cache_path, cache_key, table):
+    # store a VisitTable, the arrays are written as they are and the text overrides as (row, column, text) columns
+    text_key_list = list(table.text_dict)
+    visit_key_list = table.visit_index.visit_key_list
+    array_dict = {
+        'cache_key': np.array(cache_key),
+        'patient_id': np.array([int(patient_id) for patient_id, _ in visit_key_list], dtype=np.int64),
+        'visit_id': np.array([int(visit_id) for _, visit_id in visit_key_list], dtype=np.int64),
+        'feature_name': np.array(table.feature_list, dtype=np.str_),
+        'binary': np.array(table.binary),
+        'value': table.value,
+        'text_row': np.array([row for row, _ in text_key_list], dtype=np.int64),
+        'text_column': np.array([column for _, column in text_key_list], dtype=np.int64),
+        'text': np.array([table.text_dict[key] for key in text_key_list], dtype=np.str_)
+    }
+    if table.time is not None:
+        array_dict['time'] = table.time.astype('datetime64[s]')
+    temp_path = cache_path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        np.savez(file, **array_dict)
+    os.replace(temp_path, cache_path)
+
+
+def is_table_cache_valid(cache_path, cache_key, visit_index):
+    # is_cache_valid of a cached VisitTable whose rows must follow visit_index
+    if not os.path.exists(cache_path):
+        return False
+    with np.load(cache_path, allow_pickle=False) as data:
+        return str(data['cache_key']) == cache_key and is_same_visit(data, visit_index)
+
+
+def is_same_visit(data, visit_index):
+    # the stored rows of a table are the visits of visit_index in the same order. the cache key should already imply
+    # it, the ids are compared anyway so that a key missing an input of the visits leads to a rebuild instead of
+    # features laid over other visits
+    if len(data['visit_id']) != len(visit_index):
+        return False
+    visit_key_list = visit_index.visit_key_list
+    patient_id = np.fromiter((int(patient_id) for patient_id, _ in visit_key_list), np.int64, len(visit_key_list))
+    visit_id = np.fromiter((int(visit_id) for _, visit_id in visit_key_list), np.int64, len(visit_key_list))
+    return np.array_equal(data['patient_id'], patient_id) and np.array_equal(data['visit_id'], visit_id)
+
+
+def load_table_cache(cache_path, cache_key, visit_index=None):
+    # return None if the cache does not exist or was built from other inputs. if visit_index is given the rows must
+    # be its visits, otherwise the cache is not used either
+    if not os.path.exists(cache_path):
+        return None
+    with np.load(cache_path, allow_pickle=False) as data:
+        if cache_key is not None and str(data['cache_key']) != cache_key:
+            return None
+        if visit_index is not None and not is_same_visit(data, visit_index):
+            return None
+        if visit_index is None:
+            visit_index = VisitIndex([(str(patient_id), str(visit_id)) for patient_id, visit_id in
+                                      zip(data['patient_id'].tolist(), data['visit_id'].tolist())])
+        table = VisitTable(visit_index, data['feature_name'].tolist(), binary=bool(data['binary']),
+                           with_time=data.__contains__('time'))
+        table.value = data['value']
+        if table.time is not None:
+            table.time = data['time'].astype(np.int64)
+        for row, column, text in zip(data['text_row'].tolist(), data['text_column'].tolist(), data['text'].tolist()):
+            table.text_dict[(row, column)] = text
+    return table
+
+
+def save_measurement_cache(cache_path, cache_key, visit_index, measurement_dict):
+    # store repeated measurements, i.e. a dict mapping the row of a visit in visit_index to a list of [value, time]
+    patient_list, visit_list, value_list, time_list = list(), list(), list(), list()
+    for row in measurement_dict:
+        patient_id, visit_id = visit_index.visit_key_list[row]
+        for value, time in measurement_dict[row]:
+            patient_list.append(int(patient_id))
+            visit_list.append(int(visit_id))
+            value_list.append(value)
+            time_list.append(time)
+    temp_path = cache_path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        np.savez(file,
+                 cache_key=np.array(cache_key),
+                 patient_id=np.array(patient_list, dtype=np.int64),
+                 visit_id=np.array(visit_list, dtype=np.int64),
+                 value=np.array(value_list, dtype=np.float64),
+                 time=np.array(time_list, dtype='datetime64[s]'))
+    os.replace(temp_path, cache_path)
+
+
+def load_measurement_cache(cache_path, cache_key, visit_index):
+    # measurements of the visits in visit_index (keyed by row), in the stored order. None if there is no valid cache
+    if not os.path.exists(cache_path):
+        return None
+    with np.load(cache_path, allow_pickle=False) as data:
+        if cache_key is not None and str(data['cache_key']) != cache_key:
+            return None
+        column_list = [data['patient_id'].tolist(), data['visit_id'].tolist(), data['value'].tolist(),
+                       data['time'].astype(np.int64).tolist()]
+    measurement_dict = dict()
+    for patient_id, visit_id, value, time in zip(*column_list):
+        row = visit_index.get_row(str(patient_id), str(visit_id))
+        if row < 0:
+            continue
+        if not measurement_dict.__contains__(row):
+            measurement_dict[row] = list()
+        measurement_dict[row].append([value, time])
+    return measurement_dict
@@ -0,0 +1,68 @@
+import json
+import os
+from telemetry import measure, add_scan_count
+
+
+def load_item_index(file_path, index_path, item_column, block_size=8*1024*1024):
+    # the index is rebuilt once the raw table changes (size or modification time) or the index file is missing
+    file_size, modify_time = os.path.getsize(file_path), os.path.getmtime(file_path)
+    if os.path.exists(index_path):
+        with open(index_path, 'r', encoding='utf-8') as file:
+            item_index = json.load(file)
+        if item_index['file_size'] == file_size and item_index['modify_time'] == modify_time and \
+                item_index['item_column'] == item_column and item_index['block_size'] == block_size:
+            return item_index
+    item_index = build_item_index(file_path, item_column, block_size)
+    with open(index_path, 'w', encoding='utf-8') as file:
+        json.dump(item_index, file)
+    return item_index
+
+
+@measure('build_item_index')
+def build_item_index(file_path, item_column, block_size=8*1024*1024):
+    # split the table body into newline-aligned blocks of about block_size bytes and record, for every ITEMID,
+    # the blocks in which it appears. the leading columns of the MIMIC-III event tables (ROW_ID, SUBJECT_ID,
+    # HADM_ID, ...) are plain integers, so a row can be split by comma up to the ITEMID column without a csv parser
+    block_list = list()
+    item_dict = dict()
+    row_num = 0
+    with open(file_path, 'rb') as file:
+        position = len(file.readline())
+        block_start = position
+        for line in file:
+            if position - block_start >= block_size:
+                block_list.append([block_start, position])
+                block_start = position
+            position += len(line)
+            row_num += 1
+            column_list = line.split(b',', item_column + 1)
+            if len(column_list) <= item_column:
+                continue
+            item_id = column_list[item_column].strip(b'"').decode('utf-8')
+            block_id_list = item_dict.get(item_id)
+            if block_id_list is None:
+                item_dict[item_id] = [len(block_list)]
+            elif block_id_list[-1] != len(block_list):
+                block_id_list.append(len(block_list))
+        if position > block_start:
+            block_list.append([block_start, position])
+    add_scan_count(row_num, 0, position)
+    return {'file_size': os.path.getsize(file_path), 'modify_time': os.path.getmtime(file_path),
+            'item_column': item_column, 'block_size': block_size, 'block_list': block_list, 'item_dict': item_dict}
+
+
+def select_item_range(item_index, item_id_set, merge=True):
+    # byte ranges, in file order, which contain every row of the given ITEMIDs. adjacent blocks are merged into
+    # one range unless the caller wants to distribute single blocks (e.g. to a process pool)
+    block_id_set = set()
+    for item_id in item_id_set:
+        if item_index['item_dict'].__contains__(item_id):
+            block_id_set.update(item_index['item_dict'][item_id])
+    range_list = list()
+    for block_id in sorted(block_id_set):
+        start, end = item_index['block_list'][block_id]
+        if merge and len(range_list) > 0 and range_list[-1][1] == start:
+            range_list[-1] = range_list[-1][0], end
+        else:
+            range_list.append((start, end))
+    return range_list
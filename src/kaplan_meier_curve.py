@@ -5,6 +5,7 @@ from itertools import islice
 import pandas as pd
 import matplotlib.pyplot as plt
 from lifelines.statistics import multivariate_logrank_test
+from table_scan import read_projected_table
 
 
 def read_group_id(group_id_path):
@@ -19,36 +20,34 @@ def read_group_id(group_id_path):
     return group_id_dict
 
 
-def read_event(file_path, aki_index, death_index, aki_time_index, death_time_index, threshold=30):
+def read_event(file_path, threshold=30):
     event_dict = dict()
-    with open(file_path, 'r', encoding='utf-8-sig', newline='') as file:
-        csv_reader = csv.reader(file)
-        for line in islice(csv_reader, 2, None):
-            patient_id, visit_id, aki, aki_time, death, death_time = \
-                line[0], line[1], line[aki_index], float(line[aki_time_index]), line[death_index], \
-                float(line[death_time_index])
-            if float(line[death_index]) > 0.5:
-                death = 1
-            else:
-                death = 0
-            if float(line[aki_index]) > 0.5:
-                aki = 1
-            else:
-                aki = 0
-
-            if not event_dict.__contains__(patient_id):
-                event_dict[patient_id] = dict()
-
-            if aki == 0:
-                aki_time = threshold
-            if aki == 1 and aki_time > threshold:
-                aki_time = threshold
-            if death == 0:
-                death_time = threshold
-            if death == 1 and death_time > threshold:
-                death_time = threshold
-            event_dict[patient_id][visit_id] = {'aki_event': aki, 'aki_time': aki_time, 'death_event': death,
-                                                'death_time': death_time}
+    column_list = ['patient_id', 'visit_id', 'aki', 'aki_time', 'death', 'death_time']
+    for line in read_projected_table(file_path, column_list, encoding='utf-8-sig'):
+        patient_id, visit_id, aki, aki_time, death, death_time = \
+            line[0], line[1], line[2], float(line[3]), line[4], float(line[5])
+        if float(death) > 0.5:
+            death = 1
+        else:
+            death = 0
+        if float(aki) > 0.5:
+            aki = 1
+        else:
+            aki = 0
+
+        if not event_dict.__contains__(patient_id):
+            event_dict[patient_id] = dict()
+
+        if aki == 0:
+            aki_time = threshold
+        if aki == 1 and aki_time > threshold:
+            aki_time = threshold
+        if death == 0:
+            death_time = threshold
+        if death == 1 and death_time > threshold:
+            death_time = threshold
+        event_dict[patient_id][visit_id] = {'aki_event': aki, 'aki_time': aki_time, 'death_event': death,
+                                            'death_time': death_time}
 
     return event_dict
 
@@ -96,8 +95,7 @@ def main():
     mimic_group_id_path = os.path.abspath('../resource/phenogroup_assignment.csv')
     mimic_event_file_path = os.path.abspath('../resource/mimic_unpreprocessed.csv')
 
-    mimic_event_dict = read_event(mimic_event_file_path, aki_index=9, death_index=13, aki_time_index=10,
-                                  death_time_index=14, threshold=30)
+    mimic_event_dict = read_event(mimic_event_file_path, threshold=30)
     mimic_group_id_dict = read_group_id(mimic_group_id_path)
 
     m_aki_dict, m_aki_time_dict, m_death_dict, m_death_time_dict = data_fusion(mimic_event_dict, mimic_group_id_dict)
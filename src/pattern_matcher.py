@@ -0,0 +1,76 @@
+from collections import deque
+
+
+def build_automaton(pattern_list):
+    # Aho-Corasick automaton of the patterns. a state is an index, goto_list[state] maps a character to the next
+    # state, and output_list[state] holds the patterns which end at this state (including those of its fail chain)
+    goto_list, fail_list, output_list = [dict()], [0], [list()]
+    for pattern in pattern_list:
+        state = 0
+        for character in pattern:
+            if not goto_list[state].__contains__(character):
+                goto_list.append(dict())
+                fail_list.append(0)
+                output_list.append(list())
+                goto_list[state][character] = len(goto_list) - 1
+            state = goto_list[state][character]
+        if pattern not in output_list[state]:
+            output_list[state].append(pattern)
+
+    queue = deque(goto_list[0].values())
+    while len(queue) > 0:
+        state = queue.popleft()
+        for character, next_state in goto_list[state].items():
+            queue.append(next_state)
+            fail_state = fail_list[state]
+            while fail_state > 0 and not goto_list[fail_state].__contains__(character):
+                fail_state = fail_list[fail_state]
+            fail_state = goto_list[fail_state].get(character, 0)
+            fail_list[next_state] = fail_state
+            output_list[next_state] = output_list[next_state] + \
+                [pattern for pattern in output_list[fail_list[next_state]] if pattern not in output_list[next_state]]
+    return goto_list, fail_list, [tuple(output) for output in output_list]
+
+
+def find_pattern(automaton, text):
+    # the set of patterns which are substrings of text (same as {p for p in pattern_list if text.__contains__(p)}),
+    # found in one pass over text
+    goto_list, fail_list, output_list = automaton
+    matched_set = set(output_list[0])
+    state = 0
+    for character in text:
+        while state > 0 and not goto_list[state].__contains__(character):
+            state = fail_list[state]
+        state = goto_list[state].get(character, 0)
+        if len(output_list[state]) > 0:
+            matched_set.update(output_list[state])
+    return matched_set
+
+
+def build_prefix_trie(pattern_list):
+    # goto_list[state] maps a character to the next state, end_list[state] holds the patterns ending at the state
+    goto_list, end_list = [dict()], [list()]
+    for pattern in pattern_list:
+        state = 0
+        for character in pattern:
+            if not goto_list[state].__contains__(character):
+                goto_list.append(dict())
+                end_list.append(list())
+                goto_list[state][character] = len(goto_list) - 1
+            state = goto_list[state][character]
+        if pattern not in end_list[state]:
+            end_list[state].append(pattern)
+    return goto_list, end_list
+
+
+def find_prefix(trie, text):
+    # the set of patterns which are prefixes of text, in time proportional to the length of text
+    goto_list, end_list = trie
+    matched_set = set(end_list[0])
+    state = 0
+    for character in text:
+        state = goto_list[state].get(character)
+        if state is None:
+            break
+        matched_set.update(end_list[state])
+    return matched_set
@@ -0,0 +1,253 @@
+import hashlib
+import json
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from table_scan import resolve_table_path
+from telemetry import configure_telemetry, get_telemetry_environment, is_telemetry_enabled, start_stage, \
+    finish_stage
+
+SOURCE_ROOT = os.path.dirname(os.path.abspath(__file__))
+RESOURCE_ROOT = os.path.join(os.path.dirname(SOURCE_ROOT), 'resource')
+
+# the stages of the study. a stage runs the main function of its module with the parameters it names, 'input' and
+# 'output' are paths relative to the resource folder. a stage depends on the stages which write its inputs
+STAGE_LIST = [
+    {'name': 'read_raw_mimic_data',
+     'code': ['read_raw_mimic_data.py', 'table_scan.py', 'item_index.py', 'extractor_cache.py', 'watermark.py',
+              'visit_table.py', 'pattern_matcher.py', 'aki_detection.py', 'time_codec.py', 'window_aggregation.py',
+              'telemetry.py', 'visit_and_feature_filter.py'],
+     'raw_table': ['admissions', 'patients', 'diagnoses_icd', 'procedures_icd', 'labevents', 'chartevents',
+                   'prescriptions'],
+     'input': ['reproduce_mapping/disease_list.csv', 'reproduce_mapping/drug_list.csv',
+               'reproduce_mapping/lab_test_list.csv', 'reproduce_mapping/operation_list.csv'],
+     'output': ['mimic_unpreprocessed.csv', 'mimic_unpreprocessed_long.csv', 'mimic_unpreprocessed_default.csv',
+                'mimic_aggregate.csv'],
+     'parameter': ['long_format']},
+    {'name': 'visit_and_feature_filter',
+     'code': ['visit_and_feature_filter.py', 'table_scan.py', 'telemetry.py'],
+     'raw_table': [],
+     'input': ['mimic_unpreprocessed.csv', 'mimic_unpreprocessed_long.csv', 'mimic_unpreprocessed_default.csv',
+               'reproduce_mapping/unit_conversion_list.csv'],
+     'output': ['filtered.csv', 'filter_attrition.csv'],
+     'parameter': ['patient_delete_missing_rate', 'egfr_threshold', 'long_format']},
+    {'name': 'value_convert',
+     'code': ['value_convert.py'],
+     'raw_table': [],
+     'input': ['filtered.csv', 'reproduce_mapping/value_trans_rule.csv', 'reproduce_mapping/centroid.csv'],
+     'output': ['preprocessed_data.csv'],
+     'parameter': []},
+    {'name': 'phenogroup_assignment',
+     'code': ['phenogroup_assignment.py'],
+     'raw_table': [],
+     'input': ['preprocessed_data.csv', 'reproduce_mapping/centroid.csv'],
+     'output': ['phenogroup_assignment.csv'],
+     'parameter': []},
+    {'name': 'kaplan_meier_curve',
+     'code': ['kaplan_meier_curve.py', 'table_scan.py', 'telemetry.py'],
+     'raw_table': [],
+     'input': ['phenogroup_assignment.csv', 'mimic_unpreprocessed.csv'],
+     'output': ['kaplan_meier_curve.png'],
+     'parameter': []},
+    {'name': 'value_recover_with_phenogroup',
+     'code': ['value_recover_with_phenogroup.py'],
+     'raw_table': [],
+     'input': ['phenogroup_assignment.csv', 'preprocessed_data.csv', 'reproduce_mapping/value_trans_rule.csv'],
+     'output': ['recovered_data_with_group.csv'],
+     'parameter': []},
+    {'name': 'transfer_test',
+     'code': ['transfer_test.py', 'table_scan.py', 'telemetry.py'],
+     'raw_table': [],
+     'input': ['mimic_unpreprocessed.csv', 'recovered_data_with_group.csv'] +
+              ['reproduce_model/{}.joblib'.format(model) for model in
+               ['aki_only_group', 'aki_10', 'aki_10_group', 'aki_39', 'aki_39_group', 'death_only_group', 'death_10',
+                'death_10_group', 'death_39', 'death_39_group']],
+     'output': [],
+     'parameter': []},
+]
+
+
+def main():
+    # stages without dependencies between them (e.g. the survival curve and the value recovery) run concurrently
+    worker_num = 2
+    # long_format extracts and filters every admission of a patient instead of the last one (see
+    # read_raw_mimic_data.py), the survival curve and the transfer test still read mimic_unpreprocessed.csv
+    parameter_dict = {'patient_delete_missing_rate': 0.3, 'egfr_threshold': 60, 'long_format': False}
+    # names of stages which are run even if their inputs are unchanged
+    force_set = set()
+    # every stage and every extractor of read_raw_mimic_data appends its wall and CPU time, rows, bytes and peak
+    # memory to telemetry_path as a JSON line (None disables it). extractors named in profile_stage_set are profiled
+    # with cProfile, trace_memory records their peak Python memory with tracemalloc
+    telemetry_path = os.path.join(RESOURCE_ROOT, 'reproduce_cache', 'telemetry.jsonl')
+    profile_stage_set = set()
+    trace_memory = False
+    configure_telemetry(telemetry_path, profile_stage_set, trace_memory)
+    run_pipeline(parameter_dict, worker_num, force_set)
+
+
+def run_pipeline(parameter_dict, worker_num=2, force_set=()):
+    # a stage is skipped if the hash of its code, parameters and inputs equals the one of its last successful run
+    # and its outputs are unchanged since then. inputs written by other stages are hashed by content, so a stage
+    # which rewrites an identical file does not invalidate the stages after it
+    state_root = os.path.join(RESOURCE_ROOT, 'reproduce_cache', 'pipeline')
+    os.makedirs(state_root, exist_ok=True)
+    state_path = os.path.join(state_root, 'pipeline_state.json')
+    state_dict = load_state_dict(state_path)
+    dependency_dict = get_dependency_dict(STAGE_LIST)
+    file_hash_dict = dict()
+
+    done_set, failed_set, running_dict = set(), set(), dict()
+    with ThreadPoolExecutor(max_workers=worker_num) as executor:
+        while True:
+            # submit every stage whose dependencies are done, skipped stages may make further stages ready
+            progress = True
+            while progress:
+                progress = False
+                for stage in STAGE_LIST:
+                    name = stage['name']
+                    running_set = {running_stage['name'] for running_stage, _ in running_dict.values()}
+                    if done_set.__contains__(name) or failed_set.__contains__(name) or running_set.__contains__(name):
+                        continue
+                    if len(dependency_dict[name] & failed_set) > 0:
+                        print('stage {} blocked by failed stage'.format(name))
+                        failed_set.add(name)
+                        progress = True
+                        continue
+                    if not dependency_dict[name].issubset(done_set):
+                        continue
+                    stage_key = get_stage_key(stage, parameter_dict, file_hash_dict)
+                    if not force_set.__contains__(name) and \
+                            is_stage_valid(stage, stage_key, state_dict, file_hash_dict):
+                        print('stage {} skipped, inputs unchanged'.format(name))
+                        done_set.add(name)
+                        progress = True
+                        continue
+                    print('stage {} started'.format(name))
+                    log_path = os.path.join(state_root, name + '.log')
+                    future = executor.submit(run_stage, stage, parameter_dict, log_path)
+                    running_dict[future] = stage, stage_key
+
+            if len(running_dict) == 0:
+                break
+            finished_set, _ = wait(list(running_dict), return_when=FIRST_COMPLETED)
+            for future in finished_set:
+                stage, stage_key = running_dict.pop(future)
+                name = stage['name']
+                return_code = future.result()
+                if return_code != 0:
+                    print('stage {} failed, see {}'.format(name, os.path.join(state_root, name + '.log')))
+                    state_dict.pop(name, None)
+                    failed_set.add(name)
+                else:
+                    print('stage {} finished'.format(name))
+                    state_dict[name] = {'stage_key': stage_key,
+                                        'output': {path: get_file_hash(path, file_hash_dict)
+                                                   for path in stage['output']}}
+                    done_set.add(name)
+                save_state_dict(state_path, state_dict)
+
+    if len(failed_set) > 0:
+        raise RuntimeError('failed stages: {}'.format(', '.join(sorted(failed_set))))
+
+
+def get_dependency_dict(stage_list):
+    producer_dict = dict()
+    for stage in stage_list:
+        for path in stage['output']:
+            producer_dict[path] = stage['name']
+    dependency_dict = dict()
+    for stage in stage_list:
+        dependency_dict[stage['name']] = {producer_dict[path] for path in stage['input']
+                                          if producer_dict.__contains__(path)}
+    return dependency_dict
+
+
+def get_stage_key(stage, parameter_dict, file_hash_dict):
+    digest = hashlib.sha1()
+    digest.update('stage:{}'.format(stage['name']).encode('utf-8'))
+    for file_name in stage['code']:
+        with open(os.path.join(SOURCE_ROOT, file_name), 'rb') as file:
+            digest.update(b'code:' + hashlib.sha1(file.read()).digest())
+    for parameter in stage['parameter']:
+        digest.update('parameter:{}:{}'.format(parameter, json.dumps(parameter_dict[parameter])).encode('utf-8'))
+    # raw tables are identified by their size and modification time, like the extractor caches
+    data_root = os.path.join(RESOURCE_ROOT, 'raw_data')
+    for table_name in stage['raw_table']:
+        table_path = resolve_table_path(data_root, table_name)
+        digest.update('raw:{}:{}:{}'.format(os.path.basename(table_path), os.path.getsize(table_path),
+                                            os.path.getmtime(table_path)).encode('utf-8'))
+    for path in stage['input']:
+        digest.update('input:{}:{}'.format(path, get_file_hash(path, file_hash_dict)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def get_file_hash(path, file_hash_dict):
+    # content hash of a file in the resource folder, None if it does not exist. hashes are memoized by size and
+    # modification time within a run, since an intermediate file is an input of several stages
+    file_path = os.path.join(RESOURCE_ROOT, path)
+    if not os.path.exists(file_path):
+        return None
+    stat = os.stat(file_path)
+    memo_key = file_path, stat.st_size, stat.st_mtime_ns
+    if not file_hash_dict.__contains__(memo_key):
+        digest = hashlib.sha1()
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+        file_hash_dict[memo_key] = digest.hexdigest()
+    return file_hash_dict[memo_key]
+
+
+def is_stage_valid(stage, stage_key, state_dict, file_hash_dict):
+    if not state_dict.__contains__(stage['name']) or state_dict[stage['name']]['stage_key'] != stage_key:
+        return False
+    # an output which the stage did not write with its parameters (None) must still be missing
+    for path, file_hash in state_dict[stage['name']]['output'].items():
+        if get_file_hash(path, file_hash_dict) != file_hash:
+            return False
+    return True
+
+
+def run_stage(stage, parameter_dict, log_path):
+    # every stage runs in its own process from the src folder (the scripts use paths relative to it), so a stage
+    # whose packages are missing only fails itself and the stages after it. the output is written to log_path
+    stage_parameter_dict = {parameter: parameter_dict[parameter] for parameter in stage['parameter']}
+    command = 'import json, sys, {0}; {0}.main(**json.loads(sys.argv[1]))'.format(stage['name'])
+    environment = dict(os.environ)
+    environment.update(get_telemetry_environment())
+    # plots are saved to files, they must not block in plt.show()
+    environment['MPLBACKEND'] = 'Agg'
+    record = start_stage('pipeline.' + stage['name']) if is_telemetry_enabled() else None
+    with open(log_path, 'w', encoding='utf-8') as log_file:
+        process = subprocess.Popen([sys.executable, '-c', command, json.dumps(stage_parameter_dict)],
+                                   cwd=SOURCE_ROOT, stdout=log_file, stderr=subprocess.STDOUT, env=environment)
+        usage = None
+        if hasattr(os, 'wait4'):
+            # wait4 gives the CPU time and peak memory of the stage process itself
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+        else:
+            process.wait()
+    if record is not None:
+        record['return_code'] = process.returncode
+        finish_stage(record, usage)
+    return process.returncode
+
+
+def load_state_dict(state_path):
+    if not os.path.exists(state_path):
+        return dict()
+    with open(state_path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_state_dict(state_path, state_dict):
+    temp_path = state_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(state_dict, file, indent=1)
+    os.replace(temp_path, state_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,54 +1,345 @@
 import csv
 import os
 from itertools import islice
-import datetime
 import re
+import multiprocessing
+from functools import lru_cache
+from table_scan import scan_table, split_byte_range, scan_byte_range, resolve_table_path, is_compressed, open_table, \
+    limit_scan, clip_range_list
+from item_index import load_item_index, select_item_range
+from extractor_cache import get_cache_key, is_cache_valid, load_nested_cache, save_nested_cache, load_table_cache, \
+    save_table_cache, load_measurement_cache, save_measurement_cache, is_table_cache_valid, get_visit_key_digest
+from watermark import load_watermark_dict, save_watermark_dict, get_watermark, scan_table_delta
+from visit_table import VisitIndex, VisitTable, get_visit_key_list
+from pattern_matcher import build_automaton, find_pattern, build_prefix_trie, find_prefix
+from aki_detection import detect_aki, detect_aki_batch
+from time_codec import parse_time, parse_time_column, SECONDS_PER_DAY, SECONDS_PER_HOUR
+from window_aggregation import WindowAggregateTable
+from telemetry import configure_telemetry, measure, add_scan_count, register_counter
+from visit_and_feature_filter import MIN_AGE, MAX_AGE, ADMISSION_REASON_FEATURE, KIDNEY_DISEASE_FEATURE
 
+# ITEMIDs of the vital signs in chartevents.csv
+SBP_ITEM_SET = {'51', '455', '220179', '220050'}
+DBP_ITEM_SET = {'8368', '8441', '220180', '220051'}
+HEIGHT_ITEM_SET = {'216', '1394', '226707', '226730', '920'}
+WEIGHT_ITEM_SET = {'3580', '3581', '3582', '224639', '763', '226512', '226531', '762'}
+VITAL_SIGN_ITEM_SET = SBP_ITEM_SET | DBP_ITEM_SET | HEIGHT_ITEM_SET | WEIGHT_ITEM_SET
+CREATININE_ITEM_ID = '50912'
+# features of the extractors which do not depend on a mapping file, in the order of their templates
+EVENT_FEATURE_LIST = ['aki', 'aki_time', 'aki_2_day', 'aki_7_day', 'death', 'death_time']
+EVENT_FLAG_SET = {'aki', 'aki_2_day', 'aki_7_day', 'death'}
+SEX_AGE_FEATURE_LIST = ['age', 'sex']
+VITAL_SIGN_FEATURE_LIST = ['DBP', 'SBP', 'height', 'weight', 'BMI']
+# vital signs which are recorded in chartevents.csv (BMI is derived)
+VITAL_SIGN_RECORD_FEATURE_LIST = ['DBP', 'SBP', 'height', 'weight']
+NUMBER_PATTERN = re.compile(r'[-+]?[\d]+(?:,\d\d\d)*[.]?\d*(?:[eE][-+]?\d+)?')
+# distinct lab result texts whose parsed numbers are memoized
+LAB_TEXT_CACHE_SIZE = 1 << 16
+# lab results taken from VALUENUM (hits) or parsed from the VALUE text (misses), see parse_lab_value
+_lab_value_count_dict = {'valuenum_hits': 0, 'valuenum_misses': 0}
 
-def main():
-    data_root = os.path.abspath('../resource/raw_data/')
-    mapping_root = os.path.abspath('../resource/reproduce_mapping/')
-    save_root = os.path.abspath('../resource/reproduce_cache')
+
+def main(resource_root='../resource/', long_format=False):
+    # resource_root holds the raw_data and reproduce_mapping folders, the output and the reproduce_cache folder.
+    # with long_format every admission (instead of the last one of a patient) is written in a sparse long format
+    # (patient_id, visit_id, feature, value) to mimic_unpreprocessed_long.csv, holding the values which differ from
+    # the defaults in mimic_unpreprocessed_default.csv only
+    data_root = os.path.join(os.path.abspath(resource_root), 'raw_data')
+    mapping_root = os.path.join(os.path.abspath(resource_root), 'reproduce_mapping')
+    save_root = os.path.join(os.path.abspath(resource_root), 'reproduce_cache')
+    # number of processes used to scan chartevents.csv, 1 means a serial scan
+    vital_sign_worker_num = os.cpu_count()
+    # build (once) and use ITEMID block indexes of chartevents.csv and labevents.csv, so that only the blocks holding
+    # the required ITEMIDs are parsed
+    use_item_index = True
+    # reuse the cached extractor outputs whenever their inputs are unchanged
+    read_from_cache = True
+    # prescriptions started later than medicine_off_set hours after admission are ignored
+    medicine_off_set = 48
+    # a code in disease_list.csv matches an ICD-9 code containing it (False) or starting with it (True)
+    diagnosis_strict_prefix = False
+    # detect AKI of all visits with numpy in batches (True) or visit by visit (False), both give the same events
+    aki_vectorized = False
+    # evaluate the cheap cohort criteria of visit_and_feature_filter.py (age, HF and CKD diagnoses, last visit) first
+    # and extract the other features of the candidate visits only. only these visits are written
+    cohort_first = False
+    # record the watermark of every large table after a run. later runs only read the rows appended since then,
+    # merge them into the cached extractor outputs and re-emit the affected patients (requires cohort_first = False)
+    incremental = False
+    # aggregates of the numeric lab test results and vital signs within windows relative to the admission time, e.g.
+    # [('day_1', 0, 24), ('stay', None, None)] for the first 24 hours and the whole stay (hours, None is unbounded).
+    # they are computed in the scans of labevents.csv and chartevents.csv and written to mimic_aggregate.csv, an
+    # empty list disables them
+    aggregate_window_list = []
+    aggregate_list = ['first', 'last', 'min', 'max', 'mean', 'count']
+    # append the wall and CPU time, rows, bytes and peak memory of every extractor as JSON lines to telemetry_path
+    # (None keeps the setting of the environment, see telemetry.py). extractors named in profile_stage_set are
+    # profiled with cProfile, trace_memory records their peak Python memory with tracemalloc
+    telemetry_path = None
+    profile_stage_set = set()
+    trace_memory = False
+    if telemetry_path is not None:
+        configure_telemetry(telemetry_path, profile_stage_set, trace_memory)
     if not os.path.exists(save_root):
         os.makedirs(save_root)
 
-    diagnosis_path = os.path.join(data_root, 'diagnoses_icd.csv')
-    admission_path = os.path.join(data_root, 'admissions.csv')
-    lab_test_path = os.path.join(data_root, 'labevents.csv')
-    medicine_path = os.path.join(data_root, 'prescriptions.csv')
-    vital_sign_path = os.path.join(data_root, 'chartevents.csv')
-    patient_path = os.path.join(data_root, 'patients.csv')
-    operation_path = os.path.join(data_root, 'procedures_icd.csv')
+    # a table is either uncompressed (.csv) or the original compressed file (.csv.gz), names are case-insensitive
+    diagnosis_path = resolve_table_path(data_root, 'diagnoses_icd')
+    admission_path = resolve_table_path(data_root, 'admissions')
+    lab_test_path = resolve_table_path(data_root, 'labevents')
+    medicine_path = resolve_table_path(data_root, 'prescriptions')
+    vital_sign_path = resolve_table_path(data_root, 'chartevents')
+    patient_path = resolve_table_path(data_root, 'patients')
+    operation_path = resolve_table_path(data_root, 'procedures_icd')
     lab_mapping_path = os.path.join(mapping_root, 'lab_test_list.csv')
     diagnosis_mapping_path = os.path.join(mapping_root, 'disease_list.csv')
     medicine_mapping_path = os.path.join(mapping_root, 'drug_list.csv')
     operation_mapping_path = os.path.join(mapping_root, 'operation_list.csv')
+    save_path = os.path.join(os.path.abspath(resource_root), 'mimic_unpreprocessed.csv')
+    default_path = None
+    if long_format:
+        save_path = os.path.join(os.path.abspath(resource_root), 'mimic_unpreprocessed_long.csv')
+        default_path = os.path.join(os.path.abspath(resource_root), 'mimic_unpreprocessed_default.csv')
+    aggregate_path = os.path.join(os.path.abspath(resource_root), 'mimic_aggregate.csv')
+    feature_dict = get_feature_dict(operation_mapping_path, medicine_mapping_path, lab_mapping_path,
+                                    diagnosis_mapping_path)
+
+    # every extractor output is cached in the reproduce_cache folder, a cache is only used if it was built from
+    # raw tables and mapping files identical to the current ones, otherwise it is rebuilt. the extractors after the
+    # cohort selection depend on whether all visits or the candidate visits only are extracted, in the latter case
+    # their keys also hold the candidate visits (see below)
+    cache_key_dict = {
+        'admission': get_cache_key([admission_path], []),
+        'visit_info': get_cache_key([admission_path, patient_path], []),
+        'diagnosis': get_cache_key([admission_path, diagnosis_path], [diagnosis_mapping_path],
+                                   [diagnosis_strict_prefix]),
+        'procedure': get_cache_key([admission_path, operation_path], [operation_mapping_path], [cohort_first]),
+        'event': get_cache_key([admission_path, lab_test_path], [], [cohort_first]),
+        'lab_test': get_cache_key([admission_path, lab_test_path], [lab_mapping_path], [cohort_first]),
+        'vital_sign': get_cache_key([admission_path, vital_sign_path], [], [cohort_first]),
+        'medicine': get_cache_key([admission_path, medicine_path], [medicine_mapping_path],
+                                  [medicine_off_set, cohort_first]),
+        'lab_test_aggregate': get_cache_key([admission_path, lab_test_path], [lab_mapping_path],
+                                            [cohort_first, aggregate_window_list, aggregate_list]),
+        'vital_sign_aggregate': get_cache_key([admission_path, vital_sign_path], [],
+                                              [cohort_first, aggregate_window_list, aggregate_list])
+    }
+    # the large tables whose appended rows are ingested by an incremental run
+    delta_path_dict = {'procedures_icd': operation_path, 'diagnoses_icd': diagnosis_path, 'labevents': lab_test_path,
+                       'chartevents': vital_sign_path, 'prescriptions': medicine_path}
+    watermark_path = os.path.join(save_root, 'watermark.json')
+    # the cached outputs can only be extended if they were built with the same mapping files and parameters
+    state_key = get_cache_key([], [lab_mapping_path, diagnosis_mapping_path, medicine_mapping_path,
+                                   operation_mapping_path], [medicine_off_set, diagnosis_strict_prefix, long_format])
+    if incremental and cohort_first:
+        raise ValueError('incremental mode requires cohort_first = False')
+    if incremental and len(aggregate_window_list) > 0:
+        raise ValueError('incremental mode requires an empty aggregate_window_list')
+    limit_scan([])
+    if incremental:
+        watermark_dict = load_watermark_dict(watermark_path)
+        if watermark_dict is not None and watermark_dict['state_key'] == state_key and \
+                update_incrementally(admission_path, patient_path, delta_path_dict, watermark_dict, watermark_path,
+                                     lab_mapping_path, diagnosis_mapping_path, medicine_mapping_path,
+                                     operation_mapping_path, save_root, save_path, cache_key_dict, feature_dict,
+                                     medicine_off_set, diagnosis_strict_prefix, aki_vectorized, default_path):
+            return
+        print('no incremental state found, run on the whole tables')
+        # the scans read the rows which are complete now only, rows appended during the run are left for the next
+        # one (see get_watermark)
+        limit_scan(list(delta_path_dict.values()))
 
-    visit_dict = get_admissions(admission_path, save_root, read_from_cache=False)
+    visit_dict, visit_index = get_admissions(admission_path, save_root, read_from_cache=read_from_cache,
+                                             cache_key=cache_key_dict['admission'])
     print('visit dict loaded')
-    operation_dict = get_procedure(visit_dict, save_root, operation_path, operation_mapping_path, read_from_cache=False)
-    print('operation dict loaded')
-    event_dict = get_event(visit_dict, save_root, lab_test_path, read_from_cache=False)
-    print('event dict loaded')
-    age_sex_dict = get_sex_age(visit_dict, save_root, patient_path, read_from_cache=False)
+    age_sex_dict = get_sex_age(visit_dict, save_root, patient_path, read_from_cache=read_from_cache,
+                               cache_key=cache_key_dict['visit_info'])
     print('age sex dict loaded')
-    vital_sign_dict = get_vital_sign(visit_dict, save_root, vital_sign_path, read_from_cache=False)
-    print('vital sign dict loaded')
-    medicine_dict = get_medicine(visit_dict, save_root, medicine_path, medicine_mapping_path, read_from_cache=False)
-    print('medicine dict loaded')
-    lab_test_dict = get_lab_test(visit_dict, save_root, lab_test_path, lab_mapping_path, read_from_cache=False)
-    print('lab test dict loaded')
-    diagnosis_dict = get_diagnosis(visit_dict, save_root, diagnosis_path, diagnosis_mapping_path, read_from_cache=False)
-    print('diagnosis dict loaded')
-    egfr_dict = egfr_calculation(visit_dict, age_sex_dict, lab_test_dict)
+    diagnosis_table = get_diagnosis(visit_index, save_root, diagnosis_path, diagnosis_mapping_path,
+                                    read_from_cache=read_from_cache, cache_key=cache_key_dict['diagnosis'],
+                                    strict_prefix=diagnosis_strict_prefix)
+    print('diagnosis table loaded')
+    if cohort_first:
+        visit_dict = select_candidate_visit(visit_dict, age_sex_dict, diagnosis_table, MIN_AGE, MAX_AGE,
+                                            ADMISSION_REASON_FEATURE, KIDNEY_DISEASE_FEATURE, one_visit=not long_format)
+        visit_index = VisitIndex(get_visit_key_list(visit_dict))
+        print('candidate visit selected, size: {}'.format(len(visit_index)))
+        # the candidates depend on patients.csv, diagnoses_icd.csv, disease_list.csv and diagnosis_strict_prefix,
+        # which the keys of the later extractors do not hold, so the candidate visits themselves are added
+        candidate_digest = get_visit_key_digest(visit_index.visit_key_list)
+        for name in ['procedure', 'event', 'lab_test', 'vital_sign', 'medicine', 'lab_test_aggregate',
+                     'vital_sign_aggregate']:
+            cache_key_dict[name] = get_cache_key([], [], [cache_key_dict[name], candidate_digest])
+
+    operation_table = get_procedure(visit_index, save_root, operation_path, operation_mapping_path,
+                                    read_from_cache=read_from_cache, cache_key=cache_key_dict['procedure'])
+    print('operation table loaded')
+    # the aggregates whose cache is not valid are computed in the scans below
+    lab_aggregate_table, vital_sign_aggregate_table = None, None
+    if len(aggregate_window_list) > 0:
+        admit_time_list = [visit_dict[patient_id][visit_id]['admit_time'] for patient_id, visit_id in
+                           visit_index.visit_key_list]
+        if not (read_from_cache and is_table_cache_valid(os.path.join(save_root, 'lab_test_aggregate.npz'),
+                                                         cache_key_dict['lab_test_aggregate'], visit_index)):
+            lab_aggregate_table = WindowAggregateTable(visit_index, feature_dict['lab_test'], aggregate_window_list,
+                                                       admit_time_list, aggregate_list)
+        if not (read_from_cache and is_table_cache_valid(os.path.join(save_root, 'vital_sign_aggregate.npz'),
+                                                         cache_key_dict['vital_sign_aggregate'], visit_index)):
+            vital_sign_aggregate_table = WindowAggregateTable(visit_index, VITAL_SIGN_RECORD_FEATURE_LIST,
+                                                              aggregate_window_list, admit_time_list, aggregate_list)
+    creatinine_dict, lab_test_table = None, None
+    if lab_aggregate_table is not None or not (
+            read_from_cache and is_cache_valid(os.path.join(save_root, 'event.npz'), cache_key_dict['event']) and
+            is_table_cache_valid(os.path.join(save_root, 'lab_test.npz'), cache_key_dict['lab_test'], visit_index)):
+        lab_test_index = None
+        if use_item_index and not is_compressed(lab_test_path):
+            lab_test_index = load_item_index(lab_test_path, os.path.join(save_root, 'labevents_item_index.json'),
+                                             item_column=3)
+        creatinine_dict, lab_test_table = scan_lab_test(visit_index, lab_test_path, lab_mapping_path, lab_test_index,
+                                                        lab_aggregate_table)
+        print('lab test table scanned')
+    event_dict = get_event(visit_dict, visit_index, save_root, lab_test_path, read_from_cache=read_from_cache,
+                           cache_key=cache_key_dict['event'], creatinine_dict=creatinine_dict,
+                           vectorized=aki_vectorized)
+    print('event dict loaded')
+    vital_sign_index = None
+    if use_item_index and not is_compressed(vital_sign_path) and (vital_sign_aggregate_table is not None or not (
+            read_from_cache and is_table_cache_valid(os.path.join(save_root, 'vital_sign.npz'),
+                                                     cache_key_dict['vital_sign'], visit_index))):
+        vital_sign_index = load_item_index(vital_sign_path, os.path.join(save_root, 'chartevents_item_index.json'),
+                                           item_column=4)
+    vital_sign_table = get_vital_sign(visit_index, save_root, vital_sign_path,
+                                      read_from_cache=read_from_cache and vital_sign_aggregate_table is None,
+                                      cache_key=cache_key_dict['vital_sign'], worker_num=vital_sign_worker_num,
+                                      item_index=vital_sign_index, aggregate_table=vital_sign_aggregate_table)
+    print('vital sign table loaded')
+    medicine_table = get_medicine(visit_dict, visit_index, save_root, medicine_path, medicine_mapping_path,
+                                  read_from_cache=read_from_cache, cache_key=cache_key_dict['medicine'],
+                                  off_set=medicine_off_set)
+    print('medicine table loaded')
+    lab_test_table = get_lab_test(visit_index, save_root, lab_test_path, lab_mapping_path,
+                                  read_from_cache=read_from_cache, cache_key=cache_key_dict['lab_test'],
+                                  lab_test_table=lab_test_table)
+    print('lab test table loaded')
+    egfr_dict = egfr_calculation(visit_dict, age_sex_dict, lab_test_table)
     print('egfr dict loaded')
+    if len(aggregate_window_list) > 0:
+        write_aggregate(aggregate_path, [
+            get_aggregate(lab_aggregate_table, os.path.join(save_root, 'lab_test_aggregate.npz'),
+                          cache_key_dict['lab_test_aggregate'], visit_index),
+            get_aggregate(vital_sign_aggregate_table, os.path.join(save_root, 'vital_sign_aggregate.npz'),
+                          cache_key_dict['vital_sign_aggregate'], visit_index)])
+        print('aggregates written')
+
+    reconstruct(visit_dict, operation_table, event_dict, age_sex_dict, vital_sign_table, medicine_table,
+                lab_test_table, diagnosis_table, egfr_dict, save_path, feature_dict, one_visit=not long_format,
+                default_path=default_path)
+    if incremental:
+        save_watermark_dict(watermark_path, {'state_key': state_key, 'table': {
+            name: get_watermark(delta_path_dict[name]) for name in delta_path_dict}})
+        limit_scan([])
+        print('watermark saved')
+
+
+@measure('update_incrementally')
+def update_incrementally(admission_path, patient_path, delta_path_dict, watermark_dict, watermark_path,
+                         lab_mapping_path, diagnosis_mapping_path, medicine_mapping_path, operation_mapping_path,
+                         save_root, save_path, cache_key_dict, feature_dict, medicine_off_set=48,
+                         diagnosis_strict_prefix=False, aki_vectorized=False, default_path=None):
+    # merge the rows appended to the large tables after their watermarks into the cached extractor outputs of the
+    # last run, and rewrite only the rows of the affected patients. the admission and patient tables are small and
+    # reloaded as a whole. return False (nothing is changed) if the state of the last run is incomplete
+    previous_visit_dict = load_nested_cache(os.path.join(save_root, 'admission.npz'), None)
+    previous_age_sex_dict = load_nested_cache(os.path.join(save_root, 'visit_info.npz'), None)
+    previous_table_dict = dict()
+    for name in ['procedure', 'diagnosis', 'lab_test', 'vital_sign', 'medicine']:
+        previous_table_dict[name] = load_table_cache(os.path.join(save_root, name + '.npz'), None)
+    if previous_visit_dict is None or previous_age_sex_dict is None or None in previous_table_dict.values() or \
+            not os.path.exists(os.path.join(save_root, 'creatinine.npz')) or not os.path.exists(save_path) or \
+            set(watermark_dict['table']) != set(delta_path_dict):
+        return False
+
+    visit_dict, visit_index = get_admissions(admission_path, save_root, cache_key=cache_key_dict['admission'])
+    age_sex_dict = get_sex_age(visit_dict, save_root, patient_path, cache_key=cache_key_dict['visit_info'])
+    # patients with new or changed admissions or ages, and patients of appended rows
+    affected_patient_set = set()
+    for patient_id in visit_dict:
+        for visit_id in visit_dict[patient_id]:
+            if not (previous_visit_dict.__contains__(patient_id) and
+                    previous_visit_dict[patient_id].get(visit_id) == visit_dict[patient_id][visit_id] and
+                    previous_age_sex_dict[patient_id].get(visit_id) == age_sex_dict[patient_id][visit_id]):
+                affected_patient_set.add(patient_id)
 
-    save_path = os.path.join(os.path.abspath('../resource/'), 'mimic_unpreprocessed.csv')
-    reconstruct(visit_dict, operation_dict, event_dict, age_sex_dict, vital_sign_dict, medicine_dict, lab_test_dict,
-                diagnosis_dict, egfr_dict, save_path)
+    def _track_patient(line):
+        if visit_index.get_row(line[1], line[2]) >= 0:
+            affected_patient_set.add(line[1])
 
+    table_dict = {name: previous_table_dict[name].reindex(visit_index) for name in previous_table_dict}
+    creatinine_dict = load_measurement_cache(os.path.join(save_root, 'creatinine.npz'), None, visit_index)
+    consumer_list_dict = {
+        'procedures_icd': [get_procedure_consumer(visit_index, operation_mapping_path, table_dict['procedure'])[0]],
+        'diagnoses_icd': [get_diagnosis_consumer(visit_index, diagnosis_mapping_path, diagnosis_strict_prefix,
+                                                 table_dict['diagnosis'])[0]],
+        'labevents': [get_creatinine_consumer(visit_index, creatinine_dict)[0],
+                      get_lab_test_consumer(visit_index, read_lab_mapping(lab_mapping_path),
+                                            table_dict['lab_test'])[0]],
+        'chartevents': [get_vital_sign_consumer(visit_index, table_dict['vital_sign'])[0]],
+        'prescriptions': [get_medicine_consumer(visit_dict, visit_index, medicine_mapping_path, medicine_off_set,
+                                                table_dict['medicine'])[0]]
+    }
+    new_watermark_dict = {'state_key': watermark_dict['state_key'], 'table': dict()}
+    for name in delta_path_dict:
+        new_watermark_dict['table'][name] = scan_table_delta(delta_path_dict[name],
+                                                             consumer_list_dict[name] + [_track_patient],
+                                                             watermark_dict['table'][name])
+        print('{} appended rows ingested'.format(name))
+    update_bmi(table_dict['vital_sign'])
 
-def egfr_calculation(visit_dict, sex_age_dict, lab_test_dict):
+    # the caches are saved with the keys of the current tables, so that a later run reuses them
+    for name in table_dict:
+        save_table_cache(os.path.join(save_root, name + '.npz'), cache_key_dict[name], table_dict[name])
+    event_dict = get_event(visit_dict, visit_index, save_root, delta_path_dict['labevents'], read_from_cache=False,
+                           cache_key=cache_key_dict['event'], creatinine_dict=creatinine_dict,
+                           vectorized=aki_vectorized)
+    egfr_dict = egfr_calculation(visit_dict, age_sex_dict, table_dict['lab_test'])
+    reconstruct(visit_dict, table_dict['procedure'], event_dict, age_sex_dict, table_dict['vital_sign'],
+                table_dict['medicine'], table_dict['lab_test'], table_dict['diagnosis'], egfr_dict, save_path,
+                feature_dict, one_visit=default_path is None, affected_patient_set=affected_patient_set,
+                default_path=default_path)
+    save_watermark_dict(watermark_path, new_watermark_dict)
+    print('incremental update finished, {} patients re-emitted'.format(len(affected_patient_set)))
+    return True
+
+
+@measure('select_candidate_visit')
+def select_candidate_visit(visit_dict, age_sex_dict, diagnosis_table, min_age, max_age, admission_reason,
+                           kidney_disease, one_visit=True):
+    # visits which can pass the age, admission reason and kidney disease criteria of visit_and_feature_filter.py,
+    # i.e. aged min_age to max_age, diagnosed with admission_reason and not with kidney_disease. with one_visit only
+    # the last visit of a patient is written, so the earlier ones are not candidates
+    admission_reason_column = diagnosis_table.column_dict[admission_reason]
+    kidney_disease_column = diagnosis_table.column_dict[kidney_disease]
+    candidate_dict = dict()
+    for patient_id in visit_dict:
+        visit_list = sorted(visit_dict[patient_id], key=int)
+        if one_visit:
+            visit_list = visit_list[-1:]
+        for visit_id in visit_list:
+            age = age_sex_dict[patient_id][visit_id]['age']
+            if age < min_age or age > max_age:
+                continue
+            row = diagnosis_table.get_row(patient_id, visit_id)
+            if diagnosis_table.value[row, admission_reason_column] != 1 or \
+                    diagnosis_table.value[row, kidney_disease_column] == 1:
+                continue
+            if not candidate_dict.__contains__(patient_id):
+                candidate_dict[patient_id] = dict()
+            candidate_dict[patient_id][visit_id] = visit_dict[patient_id][visit_id]
+    return candidate_dict
+
+
+@measure('egfr_calculation')
+def egfr_calculation(visit_dict, sex_age_dict, lab_test_table):
     # based on the creatinine version of CKD-EPI equation
     egfr_dict = dict()
     for patient_id in visit_dict:
@@ -56,11 +347,13 @@ def egfr_calculation(visit_dict, sex_age_dict, lab_test_dict):
         for visit_id in visit_dict[patient_id]:
             egfr_dict[patient_id][visit_id] = -1
 
+    creatinine_column = lab_test_table.column_dict['SCr']
     for patient_id in egfr_dict:
         for visit_id in egfr_dict[patient_id]:
             ethnic_group = visit_dict[patient_id][visit_id]['ethnicity'].lower()
             try:
-                creatinine = float(lab_test_dict[patient_id][visit_id]['SCr'][0])
+                creatinine = float(lab_test_table.get_value(lab_test_table.get_row(patient_id, visit_id),
+                                                            creatinine_column))
             except ValueError:
                 continue
             sex = float(sex_age_dict[patient_id][visit_id]['sex'])
@@ -85,133 +378,312 @@ def egfr_calculation(visit_dict, sex_age_dict, lab_test_dict):
     return egfr_dict
 
 
-def reconstruct(visit_dict, operation_dict, event_dict, age_sex_dict, vital_sign_dict, medicine_dict, lab_test_dict,
-                diagnosis_dict, egfr_dict, save_path, one_visit=True):
-    data_dict = dict()
-    feature_list = ['egfr']
-    for patient_id in visit_dict:
-        data_dict[patient_id] = dict()
-        visit_list = list()
-        for visit_id in visit_dict[patient_id]:
-            visit_list.append(int(visit_id))
-        visit_list = sorted(visit_list)
-        if one_visit:
-            visit_list = [str(visit_list[-1])]
-        else:
-            visit_list = [str(item) for item in visit_list]
+def get_feature_dict(operation_mapping_file, medicine_mapping_file, lab_mapping_file, diagnosis_mapping_file):
+    # features of every extractor in column order, derived from the mapping files only
+    lab_mapping_dict = read_lab_mapping(lab_mapping_file)
+    operation_mapping_dict = read_procedure_mapping(operation_mapping_file)
+    name_cate_dict = read_medicine_mapping(medicine_mapping_file)
+    feature_dict = {
+        'operation': list(dict.fromkeys(operation_mapping_dict[code] for code in operation_mapping_dict)),
+        'event': EVENT_FEATURE_LIST,
+        'sex_age': SEX_AGE_FEATURE_LIST,
+        'vital_sign': VITAL_SIGN_FEATURE_LIST,
+        'medicine': list(dict.fromkeys(item for key in name_cate_dict for item in name_cate_dict[key])),
+        'lab_test': list(dict.fromkeys(lab_mapping_dict[code][1] for code in lab_mapping_dict)),
+        'diagnosis': list(dict.fromkeys(name for name, _ in read_diagnosis_mapping(diagnosis_mapping_file)))
+    }
+    return feature_dict
 
-        for visit_id in visit_list:
-            data_dict[patient_id][visit_id] = dict()
-            data_dict[patient_id][visit_id]['egfr'] = egfr_dict[patient_id][visit_id]
-            for operation in operation_dict[patient_id][visit_id]:
-                data_dict[patient_id][visit_id][operation] = operation_dict[patient_id][visit_id][operation]
-            for event in event_dict[patient_id][visit_id]:
-                data_dict[patient_id][visit_id][event] = event_dict[patient_id][visit_id][event]
-            for feature in age_sex_dict[patient_id][visit_id]:
-                data_dict[patient_id][visit_id][feature] = age_sex_dict[patient_id][visit_id][feature]
-            for vital_sign in vital_sign_dict[patient_id][visit_id]:
-                data_dict[patient_id][visit_id][vital_sign] = vital_sign_dict[patient_id][visit_id][vital_sign]
-            for medicine in medicine_dict[patient_id][visit_id]:
-                data_dict[patient_id][visit_id][medicine] = medicine_dict[patient_id][visit_id][medicine]
-            for lab_test in lab_test_dict[patient_id][visit_id]:
-                data_dict[patient_id][visit_id][lab_test] = lab_test_dict[patient_id][visit_id][lab_test][0]
-            for diagnosis in diagnosis_dict[patient_id][visit_id]:
-                data_dict[patient_id][visit_id][diagnosis] = diagnosis_dict[patient_id][visit_id][diagnosis]
 
-    for patient_id in visit_dict:
-        for visit_id in visit_dict[patient_id]:
-            for operation in operation_dict[patient_id][visit_id]:
-                feature_list.append(operation)
-            for event in event_dict[patient_id][visit_id]:
-                feature_list.append(event)
-            for feature in age_sex_dict[patient_id][visit_id]:
-                feature_list.append(feature)
-            for vital_sign in vital_sign_dict[patient_id][visit_id]:
-                feature_list.append(vital_sign)
-            for medicine in medicine_dict[patient_id][visit_id]:
-                feature_list.append(medicine)
-            for lab_test in lab_test_dict[patient_id][visit_id]:
-                feature_list.append(lab_test)
-            for diagnosis in diagnosis_dict[patient_id][visit_id]:
-                feature_list.append(diagnosis)
-            break
-        break
-    data_to_write = []
-    head = ['patient_id', 'visit_id']
-    for item in feature_list:
-        head.append(item)
-    data_to_write.append(head)
-    for patient_id in data_dict:
-        for visit_id in data_dict[patient_id]:
-            line = [patient_id, visit_id]
-            for index in range(2, len(head)):
-                line.append(data_dict[patient_id][visit_id][head[index]])
-            data_to_write.append(line)
+@measure('reconstruct')
+def reconstruct(visit_dict, operation_table, event_dict, age_sex_dict, vital_sign_table, medicine_table,
+                lab_test_table, diagnosis_table, egfr_dict, save_path, feature_dict, one_visit=True,
+                affected_patient_set=None, default_path=None):
+    # the row of a visit is assembled from the extractor outputs and written at once, so no copy of the whole
+    # dataset is built. the header comes from feature_dict (see get_feature_dict). if affected_patient_set is given,
+    # the rows of the other patients are copied from the existing file at save_path. if default_path is given, the
+    # visits are written in long format, i.e. a (patient_id, visit_id, feature, value) row for every value which
+    # differs from the default of its feature, and the features with their defaults are written to default_path
+    source_list = [[operation_table, feature_dict['operation']], [event_dict, feature_dict['event']],
+                   [age_sex_dict, feature_dict['sex_age']], [vital_sign_table, feature_dict['vital_sign']],
+                   [medicine_table, feature_dict['medicine']], [lab_test_table, feature_dict['lab_test']],
+                   [diagnosis_table, feature_dict['diagnosis']]]
+    head = ['patient_id', 'visit_id', 'egfr']
+    for _, feature_list in source_list:
+        head.extend(feature_list)
+    # columns of the features in a VisitTable, None for a nested dict source
+    column_list_list = [[source.column_dict[feature] for feature in feature_list]
+                        if isinstance(source, VisitTable) else None for source, feature_list in source_list]
+    long_head = ['patient_id', 'visit_id', 'feature', 'value']
+    default_list = None
+    if default_path is not None:
+        default_list = get_default_list(source_list)
+        with open(default_path, 'w', encoding='utf-8-sig', newline='') as file:
+            csv_writer = csv.writer(file)
+            csv_writer.writerow(['feature', 'default'])
+            csv_writer.writerows(zip(head[2:], default_list))
+    previous_line_dict = dict()
+    if affected_patient_set is not None:
+        with open(save_path, 'r', encoding='utf-8-sig', newline='') as file:
+            csv_reader = csv.reader(file)
+            # nothing is copied from a file with other columns
+            if next(csv_reader, None) != (long_head if default_list is not None else head):
+                csv_reader = []
+            for line in csv_reader:
+                if affected_patient_set.__contains__(line[0]):
+                    continue
+                if not previous_line_dict.__contains__(line[0]):
+                    previous_line_dict[line[0]] = list()
+                previous_line_dict[line[0]].append(line)
+
+    with open(save_path, 'w', encoding='utf-8-sig', newline='') as file:
+        csv_writer = csv.writer(file)
+        csv_writer.writerow(long_head if default_list is not None else head)
+        for patient_id in visit_dict:
+            if previous_line_dict.__contains__(patient_id):
+                csv_writer.writerows(previous_line_dict[patient_id])
+                continue
+            visit_list = sorted([int(visit_id) for visit_id in visit_dict[patient_id]])
+            if one_visit:
+                visit_list = visit_list[-1:]
+            for visit_id in visit_list:
+                visit_id = str(visit_id)
+                line = [patient_id, visit_id, egfr_dict[patient_id][visit_id]]
+                for (source, feature_list), column_list in zip(source_list, column_list_list):
+                    if column_list is None:
+                        visit_feature_dict = source[patient_id][visit_id]
+                        line.extend([visit_feature_dict[feature] for feature in feature_list])
+                    else:
+                        line.extend(source.get_value_list(source.get_row(patient_id, visit_id), column_list))
+                if default_list is None:
+                    csv_writer.writerow(line)
+                    continue
+                # a value is compared as written to the wide file, so that both formats hold the same text. a visit
+                # whose values are all defaults is kept as a single row without feature
+                long_line_list = [[patient_id, visit_id, feature, value] for feature, value, default in
+                                  zip(head[2:], line[2:], default_list) if str(value) != default]
+                csv_writer.writerows(long_line_list if len(long_line_list) > 0 else [[patient_id, visit_id, '', '']])
+
+
+def get_aggregate(aggregate_table, cache_path, cache_key, visit_index):
+    # the aggregates as a VisitTable, from the cache if aggregate_table is None (it was not computed by this run)
+    if aggregate_table is None:
+        return load_table_cache(cache_path, cache_key, visit_index)
+    table = aggregate_table.to_visit_table()
+    save_table_cache(cache_path, cache_key, table)
+    return table
+
+
+def write_aggregate(save_path, table_list):
+    # one row per visit of the tables (which share their VisitIndex)
+    column_list_list = [list(range(len(table.feature_list))) for table in table_list]
     with open(save_path, 'w', encoding='utf-8-sig', newline='') as file:
-        csv.writer(file).writerows(data_to_write)
+        csv_writer = csv.writer(file)
+        csv_writer.writerow(['patient_id', 'visit_id'] + [feature for table in table_list
+                                                          for feature in table.feature_list])
+        for row, (patient_id, visit_id) in enumerate(table_list[0].visit_index.visit_key_list):
+            line = [patient_id, visit_id]
+            for table, column_list in zip(table_list, column_list_list):
+                line.extend(table.get_value_list(row, column_list))
+            csv_writer.writerow(line)
+
 
+def get_default_list(source_list):
+    # default of every feature in column order (egfr first): 0 for the flags of binary tables and of the events,
+    # -1 (missing) otherwise
+    default_list = ['-1']
+    for source, feature_list in source_list:
+        for feature in feature_list:
+            if (isinstance(source, VisitTable) and source.binary) or EVENT_FLAG_SET.__contains__(feature):
+                default_list.append('0')
+            else:
+                default_list.append('-1')
+    return default_list
 
-def get_procedure(visit_dict, save_root, procedure_path, mapping_file, read_from_cache=True, file_name='procedure.csv'):
+
+@measure('get_procedure')
+def get_procedure(visit_index, save_root, procedure_path, mapping_file, read_from_cache=True, file_name='procedure.npz',
+                  cache_key=None):
     if read_from_cache:
-        procedure_dict = dict()
-        with open(os.path.join(save_root, file_name), 'r', encoding='utf-8-sig', newline='') as file:
-            csv_reader = csv.reader(file)
-            for line in islice(csv_reader, 1, None):
-                patient_id, visit_id, feature, value = line
-                if not procedure_dict.__contains__(patient_id):
-                    procedure_dict[patient_id] = dict()
-                if not procedure_dict[patient_id].__contains__(visit_id):
-                    procedure_dict[patient_id][visit_id] = dict()
-                procedure_dict[patient_id][visit_id][feature] = int(value)
-        return procedure_dict
-    procedure_dict = dict()
+        procedure_table = load_table_cache(os.path.join(save_root, file_name), cache_key, visit_index)
+        if procedure_table is not None:
+            return procedure_table
+    procedure_consumer, procedure_table = get_procedure_consumer(visit_index, mapping_file)
+    scan_table(procedure_path, [procedure_consumer])
+
+    save_table_cache(os.path.join(save_root, file_name), cache_key, procedure_table)
+    return procedure_table
+
+
+def get_procedure_consumer(visit_index, mapping_file, procedure_table=None):
+    # rows are merged into procedure_table if it is given
+    mapping_dict = read_procedure_mapping(mapping_file)
+    if procedure_table is None:
+        procedure_table = VisitTable(visit_index, dict.fromkeys(mapping_dict.values()), binary=True)
+    code_column_dict = {code: procedure_table.column_dict[mapping_dict[code]] for code in mapping_dict}
+
+    def _consume(line):
+        patient_id, visit_id, icd_9 = line[1], line[2], line[4]
+        row = procedure_table.get_row(patient_id, visit_id)
+        if row < 0 or not code_column_dict.__contains__(icd_9):
+            return
+        procedure_table.value[row, code_column_dict[icd_9]] = 1
+        return True
+    return _consume, procedure_table
+
+
+def read_procedure_mapping(mapping_file):
     mapping_dict = dict()
     with open(mapping_file, 'r', encoding='utf-8-sig', newline='') as file:
         csv_reader = csv.reader(file)
         for line in islice(csv_reader, 1, None):
             name, code, _ = line
             mapping_dict[code] = name
-    for patient_id in visit_dict:
-        procedure_dict[patient_id] = dict()
-        for visit_id in visit_dict[patient_id]:
-            procedure_dict[patient_id][visit_id] = dict()
-            for code in mapping_dict:
-                procedure_dict[patient_id][visit_id][mapping_dict[code]] = 0
+    return mapping_dict
+
+
+@measure('scan_lab_test')
+def scan_lab_test(visit_index, lab_test_path, mapping_file, item_index=None, aggregate_table=None):
+    # labevents.csv is read only once, each row is dispatched to both the creatinine collector (AKI detection) and
+    # the first value reducer of mapped lab tests, and to the window aggregation of aggregate_table if it is given.
+    # with an ITEMID index only the blocks holding these codes are read
+    mapping_dict = read_lab_mapping(mapping_file)
+    creatinine_consumer, creatinine_dict = get_creatinine_consumer(visit_index)
+    lab_test_consumer, lab_test_table = get_lab_test_consumer(visit_index, mapping_dict)
+    consumer_list = [creatinine_consumer, lab_test_consumer]
+    if aggregate_table is not None:
+        consumer_list.append(get_lab_aggregate_consumer(visit_index, mapping_dict, aggregate_table))
+    range_list = None
+    if item_index is not None:
+        range_list = select_item_range(item_index, set(mapping_dict) | {CREATININE_ITEM_ID})
+    scan_table(lab_test_path, consumer_list, range_list)
+    return creatinine_dict, lab_test_table
+
 
-    with open(procedure_path, 'r', newline='') as file:
+def get_creatinine_consumer(visit_index, creatinine_dict=None):
+    # creatinine measurements of every visit, keyed by the row of the visit in visit_index. rows are merged into
+    # creatinine_dict if it is given
+    if creatinine_dict is None:
+        creatinine_dict = dict()
+
+    def _consume(line):
+        patient_id, visit_id, lab_code, test_time, result, result_num = line[1: 7]
+        # code of creatinine
+        if lab_code != CREATININE_ITEM_ID or len(test_time) < 10 or len(result) < 1:
+            return
+        row = visit_index.get_row(patient_id, visit_id)
+        if row < 0:
+            return
+        if not creatinine_dict.__contains__(row):
+            creatinine_dict[row] = list()
+        test_time = parse_time(test_time)
+
+        result = parse_lab_value(result, result_num)
+        if result is None:
+            return
+        creatinine_dict[row].append([result, test_time])
+        return True
+    return _consume, creatinine_dict
+
+
+def read_lab_mapping(mapping_file):
+    # 读取mapping_file
+    mapping_dict = dict()
+    with open(mapping_file, 'r', encoding='utf-8-sig', newline='') as file:
         csv_reader = csv.reader(file)
         for line in islice(csv_reader, 1, None):
-            patient_id, visit_id, icd_9 = line[1], line[2], line[4]
-            if not (procedure_dict.__contains__(patient_id) and procedure_dict[patient_id].__contains__(visit_id)
-                    and mapping_dict.__contains__(icd_9)):
-                continue
-            procedure_dict[patient_id][visit_id][mapping_dict[icd_9]] = 1
+            lab_label, lab_chinese_name, lab_code = line[0: 3]
+            mapping_dict[lab_code] = lab_label, lab_chinese_name
+    return mapping_dict
+
 
-    data_to_write = [['patient_id', 'visit_id', 'operation', 'positive']]
-    for patient_id in procedure_dict:
-        for visit_id in procedure_dict[patient_id]:
-            for feature in procedure_dict[patient_id][visit_id]:
-                value = procedure_dict[patient_id][visit_id][feature]
-                data_to_write.append([patient_id, visit_id, feature, value])
-    with open(os.path.join(save_root, file_name), 'w', encoding='utf-8-sig', newline='') as file:
-        csv.writer(file).writerows(data_to_write)
-    return procedure_dict
+def get_lab_test_consumer(visit_index, mapping_dict, lab_test_table=None):
+    # the first result of every mapped lab test of a visit, rows are merged into lab_test_table if it is given
+    if lab_test_table is None:
+        lab_test_table = VisitTable(visit_index, dict.fromkeys(mapping_dict[code][1] for code in mapping_dict),
+                                    with_time=True)
+    code_column_dict = {code: lab_test_table.column_dict[mapping_dict[code][1]] for code in mapping_dict}
 
+    def _consume(line):
+        patient_id, visit_id, lab_code, test_time, result, result_num = line[1: 7]
+        if (not code_column_dict.__contains__(lab_code)) or len(test_time) < 10:
+            return
+        row = lab_test_table.get_row(patient_id, visit_id)
+        if row < 0:
+            return
+        column = code_column_dict[lab_code]
+        test_time = parse_time(test_time)
 
-def get_event(visit_dict, save_root, lab_test_path, read_from_cache=True, file_name='event.csv'):
+        if test_time < lab_test_table.time[row, column]:
+            value = parse_lab_value(result, result_num)
+            lab_test_table.set_value(row, column, result if value is None else value, test_time)
+        return True
+    return _consume, lab_test_table
+
+
+def get_lab_aggregate_consumer(visit_index, mapping_dict, aggregate_table):
+    # adds the numeric results of the mapped lab tests to aggregate_table (a WindowAggregateTable)
+    code_column_dict = {code: aggregate_table.column_dict[mapping_dict[code][1]] for code in mapping_dict}
+
+    def _consume(line):
+        patient_id, visit_id, lab_code, test_time, result, result_num = line[1: 7]
+        if (not code_column_dict.__contains__(lab_code)) or len(test_time) < 10:
+            return
+        row = visit_index.get_row(patient_id, visit_id)
+        if row < 0:
+            return
+        value = parse_lab_value(result, result_num)
+        if value is None:
+            return
+        aggregate_table.update(row, code_column_dict[lab_code], value, parse_time(test_time))
+        return True
+    return _consume
+
+
+def parse_lab_value(result, result_num):
+    # the number of a lab result, i.e. VALUENUM if labevents.csv has it, otherwise the first number in the VALUE
+    # text. None if there is none
+    if len(result_num) > 0:
+        try:
+            value = float(result_num)
+            _lab_value_count_dict['valuenum_hits'] += 1
+            return value
+        except ValueError:
+            pass
+    _lab_value_count_dict['valuenum_misses'] += 1
+    return parse_numeric_result(result)
+
+
+@lru_cache(maxsize=LAB_TEXT_CACHE_SIZE)
+def parse_numeric_result(result):
+    # the first number in a result (e.g. '1,200' in '>1,200'), None if there is none. the result texts repeat
+    # heavily, so they are memoized
+    result_list = NUMBER_PATTERN.findall(result)
+    if len(result_list) == 0:
+        return None
+    return float(result_list[0].replace(',', ''))
+
+
+def get_lab_value_count_dict():
+    # the VALUENUM hits and misses of parse_lab_value, and the hits and misses of the text memo, reported to telemetry
+    info = parse_numeric_result.cache_info()
+    return {'valuenum_hits': _lab_value_count_dict['valuenum_hits'],
+            'valuenum_misses': _lab_value_count_dict['valuenum_misses'],
+            'text_memo_hits': info.hits, 'text_memo_misses': info.misses}
+
+
+register_counter(get_lab_value_count_dict)
+
+
+@measure('get_event')
+def get_event(visit_dict, visit_index, save_root, lab_test_path, read_from_cache=True, file_name='event.npz',
+              cache_key=None, creatinine_dict=None, vectorized=False, creatinine_file_name='creatinine.npz'):
+    # the creatinine measurements are kept in creatinine_file_name as well, so that an incremental run can merge
+    # newly appended measurements
     if read_from_cache:
-        event_dict = dict()
-        with open(os.path.join(save_root, file_name), 'r', encoding='utf-8-sig', newline='') as file:
-            csv_reader = csv.reader(file)
-            for line in islice(csv_reader, 1, None):
-                patient_id, visit_id, death, death_time, aki, aki_2_day, aki_7_day, aki_time = line
-                if not event_dict.__contains__(patient_id):
-                    event_dict[patient_id] = dict()
-                event_dict[patient_id][visit_id] = {
-                    'aki': int(aki), 'aki_time': float(aki_time), 'aki_2_day': int(aki_2_day),
-                    'aki_7_day': int(aki_7_day), 'death': int(death), 'death_time': float(death_time)
-                }
-        return event_dict
+        event_dict = load_nested_cache(os.path.join(save_root, file_name), cache_key)
+        if event_dict is not None:
+            return event_dict
     event_dict = dict()
     for patient_id in visit_dict:
         event_dict[patient_id] = dict()
@@ -231,117 +703,59 @@ def get_event(visit_dict, save_root, lab_test_path, read_from_cache=True, file_n
             if death_time < admit_time:
                 continue
             else:
-                time_diff = death_time-admit_time
-                time_diff = (time_diff.days*24*3600 + time_diff.seconds)/24/3600
+                time_diff = (death_time-admit_time)/24/3600
                 event_dict[patient_id][visit_id]['death'] = 1
                 event_dict[patient_id][visit_id]['death_time'] = time_diff
 
     # creatinine evaluation
-    creatinine_dict = dict()
-    with open(lab_test_path, 'r', newline='') as file:
-        csv_reader = csv.reader(file)
-        for line in islice(csv_reader, 1, None):
-            patient_id, visit_id, lab_code, test_time, result = line[1: 6]
-            if not (event_dict.__contains__(patient_id) and event_dict[patient_id].__contains__(visit_id)):
-                continue
-            # code of creatinine
-            if lab_code != '50912' or len(test_time) < 10 or len(result) < 1:
-                continue
-            if not creatinine_dict.__contains__(patient_id):
-                creatinine_dict[patient_id] = dict()
-            if not creatinine_dict[patient_id].__contains__(visit_id):
-                creatinine_dict[patient_id][visit_id] = list()
-            test_time = datetime.datetime.strptime(test_time, '%Y-%m-%d %H:%M:%S')
-
-            result_list = re.findall('[-+]?[\d]+(?:,\d\d\d)*[.]?\d*(?:[eE][-+]?\d+)?', result)
-            if len(result_list) > 0:
-                if result_list[0].__contains__(','):
-                    result_list[0] = result_list[0].replace(',', '')
-                result = float(result_list[0])
-            else:
-                continue
-            creatinine_dict[patient_id][visit_id].append([float(result), test_time])
-    for patient_id in creatinine_dict:
-        for visit_id in creatinine_dict[patient_id]:
-            creatinine_dict[patient_id][visit_id] = sorted(creatinine_dict[patient_id][visit_id], key=lambda x: x[1])
-
-    for patient_id in creatinine_dict:
-        for visit_id in creatinine_dict[patient_id]:
-            creatinine_list = creatinine_dict[patient_id][visit_id]
-            start_time = visit_dict[patient_id][visit_id]['admit_time']
-            for index in range(len(creatinine_list)-1):
-                value_1, test_time_1 = creatinine_list[index]
-                if test_time_1 < start_time:
-                    continue
-                for index_ in range(index, len(creatinine_list)):
-                    value_2, test_time_2 = creatinine_list[index_]
-                    if value_2 == 0 or value_1 == 0:
-                        continue
-                    time_difference = (test_time_2 - test_time_1).days
-                    if time_difference < 2:
-                        if value_2 - value_1 > 0.3:
-                            event_dict[patient_id][visit_id]['aki'] = 1
-                            event_dict[patient_id][visit_id]['aki_2_day'] = 1
-                            difference_from_start = ((test_time_2 - start_time).days * 3600 * 24 +
-                                                     (test_time_2 - start_time).seconds) / (3600 * 24)
-                            if event_dict[patient_id][visit_id]['aki_time'] == -1:
-                                event_dict[patient_id][visit_id]['aki_time'] = difference_from_start
-                            else:
-                                if difference_from_start < event_dict[patient_id][visit_id]['aki_time']:
-                                    event_dict[patient_id][visit_id]['aki_time'] = difference_from_start
-                    if time_difference < 7:
-                        if value_2/value_1 > 1.5:
-                            event_dict[patient_id][visit_id]['aki'] = 1
-                            event_dict[patient_id][visit_id]['aki_7_day'] = 1
-                            difference_from_start = ((test_time_2 - start_time).days * 3600 * 24 +
-                                                     (test_time_2 - start_time).seconds) / (3600 * 24)
-                            if event_dict[patient_id][visit_id]['aki_time'] == -1:
-                                event_dict[patient_id][visit_id]['aki_time'] = difference_from_start
-                            else:
-                                if difference_from_start < event_dict[patient_id][visit_id]['aki_time']:
-                                    event_dict[patient_id][visit_id]['aki_time'] = difference_from_start
-
-    data_to_write = [['patient_id', 'visit_id', 'death', 'death_time', 'aki', 'aki_2_day', 'aki_7_day', 'aki_time']]
-    for patient_id in event_dict:
-        for visit_id in event_dict[patient_id]:
-            aki = event_dict[patient_id][visit_id]['aki']
-            aki_time = event_dict[patient_id][visit_id]['aki_time']
-            aki_2_day = event_dict[patient_id][visit_id]['aki_2_day']
-            aki_7_day = event_dict[patient_id][visit_id]['aki_7_day']
-            death = event_dict[patient_id][visit_id]['death']
-            death_time = event_dict[patient_id][visit_id]['death_time']
-            data_to_write.append([patient_id, visit_id, death, death_time, aki, aki_2_day, aki_7_day, aki_time])
-    with open(os.path.join(save_root, file_name), 'w', encoding='utf-8-sig', newline='') as file:
-        csv.writer(file).writerows(data_to_write)
+    if creatinine_dict is None:
+        creatinine_consumer, creatinine_dict = get_creatinine_consumer(visit_index)
+        scan_table(lab_test_path, [creatinine_consumer])
+
+    key_list = [visit_index.visit_key_list[row] for row in creatinine_dict]
+    creatinine_list_list = [sorted(creatinine_dict[row], key=lambda x: x[1]) for row in creatinine_dict]
+    start_time_list = [visit_dict[patient_id][visit_id]['admit_time'] for patient_id, visit_id in key_list]
+    if vectorized:
+        aki_list = detect_aki_batch(creatinine_list_list, start_time_list)
+    else:
+        aki_list = [detect_aki(creatinine_list, start_time)
+                    for creatinine_list, start_time in zip(creatinine_list_list, start_time_list)]
+    for (patient_id, visit_id), (aki_2_day, aki_7_day, aki_time) in zip(key_list, aki_list):
+        if aki_2_day == 1 or aki_7_day == 1:
+            event_dict[patient_id][visit_id]['aki'] = 1
+            event_dict[patient_id][visit_id]['aki_2_day'] = aki_2_day
+            event_dict[patient_id][visit_id]['aki_7_day'] = aki_7_day
+            event_dict[patient_id][visit_id]['aki_time'] = aki_time
+
+    save_measurement_cache(os.path.join(save_root, creatinine_file_name), cache_key, visit_index, creatinine_dict)
+    save_nested_cache(os.path.join(save_root, file_name), cache_key, event_dict)
     return event_dict
 
 
-def get_sex_age(visit_dict, save_root, patient_path, read_from_cache=True, file_name='visit_info.csv'):
+@measure('get_sex_age')
+def get_sex_age(visit_dict, save_root, patient_path, read_from_cache=True, file_name='visit_info.npz', cache_key=None):
     if read_from_cache:
-        sex_age_dict = dict()
-        with open(os.path.join(save_root, file_name), 'r', newline='', encoding='utf-8-sig') as file:
-            csv_reader = csv.reader(file)
-            for line in islice(csv_reader, 1, None):
-                patient_id, visit_id, sex, age = line
-                if not sex_age_dict.__contains__(patient_id):
-                    sex_age_dict[patient_id] = dict()
-                sex_age_dict[patient_id][visit_id] = {'age': float(age), 'sex': int(sex)}
-        return sex_age_dict
+        sex_age_dict = load_nested_cache(os.path.join(save_root, file_name), cache_key)
+        if sex_age_dict is not None:
+            return sex_age_dict
     sex_age_dict = dict()
     for patient_id in visit_dict:
         sex_age_dict[patient_id] = dict()
         for visit_id in visit_dict[patient_id]:
             sex_age_dict[patient_id][visit_id] = {'age': -1, 'sex': -1}
 
-    with open(patient_path, 'r', newline='') as file:
+    row_num, kept_num = 0, 0
+    with open_table(patient_path) as file:
         csv_reader = csv.reader(file)
         for line in islice(csv_reader, 1, None):
+            row_num += 1
             patient_id, sex, birthday = line[1: 4]
             if not sex_age_dict.__contains__(patient_id):
                 continue
             if len(sex) < 1 or len(birthday) < 10:
                 continue
-            birthday = datetime.datetime.strptime(birthday, '%Y-%m-%d %H:%M:%S')
+            kept_num += 1
+            birthday = parse_time(birthday)
 
             if sex == 'F':
                 sex = 0
@@ -351,137 +765,223 @@ def get_sex_age(visit_dict, save_root, patient_path, read_from_cache=True, file_
                 raise ValueError('')
             for visit_id in visit_dict[patient_id]:
                 admission_time = visit_dict[patient_id][visit_id]['admit_time']
-                age = (admission_time-birthday).days / 365
+                age = ((admission_time-birthday) // SECONDS_PER_DAY) / 365
                 sex_age_dict[patient_id][visit_id] = {'age': age, 'sex': sex}
+    add_scan_count(row_num, kept_num, os.path.getsize(patient_path))
 
-    data_to_write = [['patient_id', 'visit_id', 'age', 'sex']]
-    with open(os.path.join(save_root, file_name), 'w', encoding='utf-8-sig', newline='') as file:
-        for patient_id in sex_age_dict:
-            for visit_id in sex_age_dict[patient_id]:
-                data_to_write.append([patient_id, visit_id, sex_age_dict[patient_id][visit_id]['sex'],
-                                      sex_age_dict[patient_id][visit_id]['age']])
-        csv.writer(file).writerows(data_to_write)
+    save_nested_cache(os.path.join(save_root, file_name), cache_key, sex_age_dict)
     return sex_age_dict
 
 
-def get_vital_sign(visit_dict, save_root, vital_sign_path, read_from_cache=True, file_name='vital_sign.csv'):
+@measure('get_vital_sign')
+def get_vital_sign(visit_index, save_root, vital_sign_path, read_from_cache=True, file_name='vital_sign.npz',
+                   cache_key=None, worker_num=1, item_index=None, aggregate_table=None):
+    # the vital signs are added to the window aggregation of aggregate_table as well if it is given
     if read_from_cache:
-        vital_sign_dict = dict()
-        with open(os.path.join(save_root, file_name), 'r', encoding='utf-8-sig', newline='') as file:
-            csv_reader = csv.reader(file)
-            for line in islice(csv_reader, 1, None):
-                patient_id, visit_id, feature, value = line
-                if not vital_sign_dict.__contains__(patient_id):
-                    vital_sign_dict[patient_id] = dict()
-                if not vital_sign_dict[patient_id].__contains__(visit_id):
-                    vital_sign_dict[patient_id][visit_id] = dict()
-                vital_sign_dict[patient_id][visit_id][feature] = float(value)
-        return vital_sign_dict
-
-    vital_sign_dict = dict()
-    for patient_id in visit_dict:
-        vital_sign_dict[patient_id] = dict()
-        for visit_id in visit_dict[patient_id]:
-            vital_sign_dict[patient_id][visit_id] = {
-                'DBP': [-1, datetime.datetime(2500, 1, 1, 0, 0, 0, 0)],
-                'SBP': [-1, datetime.datetime(2500, 1, 1, 0, 0, 0, 0)],
-                'height': [-1, datetime.datetime(2500, 1, 1, 0, 0, 0, 0)],
-                'weight': [-1, datetime.datetime(2500, 1, 1, 0, 0, 0, 0)],
-            }
-
-    with open(vital_sign_path, 'r', newline='', buffering=-1) as file:
-        csv_reader = csv.reader(file)
-        for line in islice(csv_reader, 1, None):
-            patient_id, visit_id, item_id, chart_time, value, unit = \
-                line[1], line[2], line[4], line[5], line[9], line[10]
-            if not (vital_sign_dict.__contains__(patient_id) and vital_sign_dict[patient_id].__contains__(visit_id)):
-                continue
-            if len(chart_time) < 10 or len(value) < 1:
-                continue
-            value = float(value)
-            unit = unit.lower()
-            chart_time = datetime.datetime.strptime(chart_time, '%Y-%m-%d %H:%M:%S')
-            # 1 lbs = 0.453592 kg
-            # 1 inches = 2.54 cm
-            # 1 feet = 30.48 cm
-            # 1 oz = 0.0283495 kg
-            # SBP
-            if item_id == '51' or item_id == '455' or item_id == '220179' or item_id == '220050':
-                if unit != 'mmhg':
-                    continue
-                if vital_sign_dict[patient_id][visit_id]['SBP'][1] > chart_time:
-                    vital_sign_dict[patient_id][visit_id]['SBP'] = value, chart_time
-            # dbp
-            if item_id == '8368' or item_id == '8441' or item_id == '220180' or item_id == '220051':
-                if unit != 'mmhg':
-                    continue
-                if vital_sign_dict[patient_id][visit_id]['DBP'][1] > chart_time:
-                    vital_sign_dict[patient_id][visit_id]['DBP'] = value, chart_time
-            # height
-            if item_id == '216' or item_id == '1394' or item_id == '226707' or item_id == '226730' or item_id == '920':
-                if unit == 'cm':
-                    value = value
-                elif unit == 'inch' or unit == 'inches':
-                    value = value * 2.54
-                elif unit == 'feet' or unit == 'feets':
-                    value = value * 30.48
-                else:
-                    continue
-                if vital_sign_dict[patient_id][visit_id]['height'][1] > chart_time and 250 > value > 50:
-                    vital_sign_dict[patient_id][visit_id]['height'] = value, chart_time
-            # weight
-            if item_id == '3580' or item_id == '3581' or item_id == '3582' or item_id == '224639' or item_id == '763' \
-                    or item_id == '226512' or item_id == '226531' or item_id == '762':
-                if unit == 'kg':
-                    value = value
-                elif unit == 'lbs' or item_id == '226531':
-                    value = value * 0.453592
-                elif unit == 'oz':
-                    value = value * 0.0283495
-                else:
-                    continue
-                if vital_sign_dict[patient_id][visit_id]['weight'][1] > chart_time and 300 > value > 20:
-                    vital_sign_dict[patient_id][visit_id]['weight'] = value, chart_time
-
-    for patient_id in vital_sign_dict:
-        for visit_id in vital_sign_dict[patient_id]:
-            weight = vital_sign_dict[patient_id][visit_id]['weight'][0]
-            height = vital_sign_dict[patient_id][visit_id]['height'][0]
-            if weight == -1 or height == -1:
-                bmi = -1
-            else:
-                bmi = weight * 10000 / height / height
-            vital_sign_dict[patient_id][visit_id]['BMI'] = bmi, -1
-            for feature in vital_sign_dict[patient_id][visit_id]:
-                vital_sign_dict[patient_id][visit_id][feature] = vital_sign_dict[patient_id][visit_id][feature][0]
-
-    data_to_write = [['patient_id', 'visit_id', 'feature', 'value']]
-    with open(os.path.join(save_root, file_name), 'w', encoding='utf-8-sig', newline='') as file:
-        for patient_id in vital_sign_dict:
-            for visit_id in vital_sign_dict[patient_id]:
-                for feature in vital_sign_dict[patient_id][visit_id]:
-                    value = vital_sign_dict[patient_id][visit_id][feature]
-                    data_to_write.append([patient_id, visit_id, feature, value])
-        csv.writer(file).writerows(data_to_write)
-    return vital_sign_dict
-
-
-def get_medicine(visit_dict, save_root, medicine_path, mapping_file, read_from_cache=True, file_name='medicine.csv',
-                 off_set=48):
+        vital_sign_table = load_table_cache(os.path.join(save_root, file_name), cache_key, visit_index)
+        if vital_sign_table is not None:
+            return vital_sign_table
+
+    vital_sign_table = VisitTable(visit_index, VITAL_SIGN_FEATURE_LIST, with_time=True)
+    column_dict = vital_sign_table.column_dict
+    if worker_num > 1 and not is_compressed(vital_sign_path):
+        # every worker reduces its own byte range of chartevents.csv, the partial results are merged in file order
+        # and only a strictly earlier chart time replaces the kept value, so the result equals the serial scan
+        if item_index is not None:
+            range_list = select_item_range(item_index, VITAL_SIGN_ITEM_SET, merge=False)
+        else:
+            range_list = split_byte_range(vital_sign_path, worker_num * 4)
+        range_list = clip_range_list(vital_sign_path, range_list)
+        with multiprocessing.Pool(worker_num, initializer=_init_vital_sign_worker,
+                                  initargs=(vital_sign_path, visit_index, aggregate_table)) as pool:
+            for byte_range, (partial_dict, row_num, kept_num, accumulator_dict) in \
+                    zip(range_list, pool.imap(_reduce_vital_sign_range, range_list)):
+                add_scan_count(row_num, kept_num, byte_range[1] - byte_range[0])
+                if aggregate_table is not None:
+                    aggregate_table.merge(accumulator_dict)
+                for row, feature in partial_dict:
+                    value, chart_time = partial_dict[(row, feature)]
+                    column = column_dict[feature]
+                    if vital_sign_table.time[row, column] > chart_time:
+                        vital_sign_table.set_value(row, column, value, chart_time)
+    else:
+        vital_sign_consumer, _ = get_vital_sign_consumer(visit_index, vital_sign_table, aggregate_table)
+        range_list = None
+        if item_index is not None:
+            range_list = select_item_range(item_index, VITAL_SIGN_ITEM_SET)
+        scan_table(vital_sign_path, [vital_sign_consumer], range_list)
+    update_bmi(vital_sign_table)
+
+    save_table_cache(os.path.join(save_root, file_name), cache_key, vital_sign_table)
+    return vital_sign_table
+
+
+def get_vital_sign_consumer(visit_index, vital_sign_table=None, aggregate_table=None):
+    # the first value of every vital sign of a visit, rows are merged into vital_sign_table if it is given. every
+    # record is added to aggregate_table (a WindowAggregateTable) as well if it is given
+    if vital_sign_table is None:
+        vital_sign_table = VisitTable(visit_index, VITAL_SIGN_FEATURE_LIST, with_time=True)
+    column_dict = vital_sign_table.column_dict
+
+    def _consume(line):
+        record = parse_vital_sign(line, visit_index)
+        if record is None:
+            return
+        row, feature, value, chart_time = record
+        column = column_dict[feature]
+        if vital_sign_table.time[row, column] > chart_time:
+            vital_sign_table.set_value(row, column, value, chart_time)
+        if aggregate_table is not None:
+            aggregate_table.update(row, aggregate_table.column_dict[feature], value, chart_time)
+        return True
+    return _consume, vital_sign_table
+
+
+def update_bmi(vital_sign_table):
+    # a missing weight or height (nan) gives a missing BMI
+    column_dict = vital_sign_table.column_dict
+    weight = vital_sign_table.value[:, column_dict['weight']]
+    height = vital_sign_table.value[:, column_dict['height']]
+    vital_sign_table.value[:, column_dict['BMI']] = weight * 10000 / height / height
+
+
+def parse_vital_sign(line, visit_index):
+    # return (row, feature, value, chart_time) if the chartevents row is a usable vital sign record, row is the row
+    # of the visit in visit_index
+    patient_id, visit_id, item_id, chart_time, value, unit = \
+        line[1], line[2], line[4], line[5], line[9], line[10]
+    row = visit_index.get_row(patient_id, visit_id)
+    if row < 0:
+        return None
+    if len(chart_time) < 10 or len(value) < 1:
+        return None
+    value = float(value)
+    unit = unit.lower()
+    chart_time = parse_time(chart_time)
+    # 1 lbs = 0.453592 kg
+    # 1 inches = 2.54 cm
+    # 1 feet = 30.48 cm
+    # 1 oz = 0.0283495 kg
+    # SBP
+    if SBP_ITEM_SET.__contains__(item_id):
+        if unit != 'mmhg':
+            return None
+        return row, 'SBP', value, chart_time
+    # dbp
+    if DBP_ITEM_SET.__contains__(item_id):
+        if unit != 'mmhg':
+            return None
+        return row, 'DBP', value, chart_time
+    # height
+    if HEIGHT_ITEM_SET.__contains__(item_id):
+        if unit == 'cm':
+            value = value
+        elif unit == 'inch' or unit == 'inches':
+            value = value * 2.54
+        elif unit == 'feet' or unit == 'feets':
+            value = value * 30.48
+        else:
+            return None
+        if not 250 > value > 50:
+            return None
+        return row, 'height', value, chart_time
+    # weight
+    if WEIGHT_ITEM_SET.__contains__(item_id):
+        if unit == 'kg':
+            value = value
+        elif unit == 'lbs' or item_id == '226531':
+            value = value * 0.453592
+        elif unit == 'oz':
+            value = value * 0.0283495
+        else:
+            return None
+        if not 300 > value > 20:
+            return None
+        return row, 'weight', value, chart_time
+    return None
+
+
+_vital_sign_worker_state = dict()
+
+
+def _init_vital_sign_worker(vital_sign_path, visit_index, aggregate_table=None):
+    _vital_sign_worker_state['path'] = vital_sign_path
+    _vital_sign_worker_state['visit'] = visit_index
+    _vital_sign_worker_state['aggregate'] = aggregate_table
+
+
+def _reduce_vital_sign_range(byte_range):
+    # earliest value of every (visit row, feature) within one byte range of chartevents.csv, the number of rows read
+    # and used, and the window aggregate accumulators of the range (None without aggregation)
+    partial_dict = dict()
+    visit_index = _vital_sign_worker_state['visit']
+    aggregate_table = _vital_sign_worker_state['aggregate']
+    accumulator_dict = None if aggregate_table is None else dict()
+    row_num, kept_num = 0, 0
+    for line in scan_byte_range(_vital_sign_worker_state['path'], byte_range[0], byte_range[1]):
+        row_num += 1
+        record = parse_vital_sign(line, visit_index)
+        if record is None:
+            continue
+        kept_num += 1
+        row, feature, value, chart_time = record
+        key = row, feature
+        if not partial_dict.__contains__(key) or partial_dict[key][1] > chart_time:
+            partial_dict[key] = value, chart_time
+        if aggregate_table is not None:
+            aggregate_table.update(row, aggregate_table.column_dict[feature], value, chart_time, accumulator_dict)
+    return partial_dict, row_num, kept_num, accumulator_dict
+
+
+@measure('get_medicine')
+def get_medicine(visit_dict, visit_index, save_root, medicine_path, mapping_file, read_from_cache=True,
+                 file_name='medicine.npz', cache_key=None, off_set=48):
     if read_from_cache:
-        medicine_dict = dict()
-        with open(os.path.join(save_root, file_name), 'r', encoding='utf-8-sig', newline='') as file:
-            csv_reader = csv.reader(file)
-            for line in islice(csv_reader, 1, None):
-                patient_id, visit_id, drug, usage = line
-                if not medicine_dict.__contains__(patient_id):
-                    medicine_dict[patient_id] = dict()
-                if not medicine_dict[patient_id].__contains__(visit_id):
-                    medicine_dict[patient_id][visit_id] = dict()
-                medicine_dict[patient_id][visit_id][drug] = int(usage)
-        return medicine_dict
-
-    medicine_dict = dict()
+        medicine_table = load_table_cache(os.path.join(save_root, file_name), cache_key, visit_index)
+        if medicine_table is not None:
+            return medicine_table
+    medicine_consumer, medicine_table = get_medicine_consumer(visit_dict, visit_index, mapping_file, off_set)
+    scan_table(medicine_path, [medicine_consumer], encoding='utf-8-sig')
+
+    save_table_cache(os.path.join(save_root, file_name), cache_key, medicine_table)
+    return medicine_table
+
+
+def get_medicine_consumer(visit_dict, visit_index, mapping_file, off_set=48, medicine_table=None):
+    # rows are merged into medicine_table if it is given
+    name_cate_dict = read_medicine_mapping(mapping_file)
+    if medicine_table is None:
+        medicine_table = VisitTable(visit_index,
+                                    dict.fromkeys(item for key in name_cate_dict for item in name_cate_dict[key]),
+                                    binary=True)
+    name_column_dict = {key: [medicine_table.column_dict[item] for item in name_cate_dict[key]]
+                        for key in name_cate_dict}
+    # all drug names are matched in one pass over the concatenated name of a prescription
+    drug_automaton = build_automaton(list(name_cate_dict))
+    admit_time_list = [visit_dict[patient_id][visit_id]['admit_time'] for patient_id, visit_id in
+                       visit_index.visit_key_list]
+
+    def _consume(line):
+        patient_id, visit_id, start_date = line[1], line[2], line[4]
+        if len(start_date) < 10:
+            return
+        row = medicine_table.get_row(patient_id, visit_id)
+        if row < 0:
+            return
+        time_difference = parse_time(start_date) - admit_time_list[row]
+        if time_difference/SECONDS_PER_HOUR > off_set:
+            return
+
+        drug_name = (line[7]+"_"+line[8]+'_'+line[9]).lower()
+        key_set = find_pattern(drug_automaton, drug_name)
+        for key in key_set:
+            medicine_table.value[row, name_column_dict[key]] = 1
+        return len(key_set) > 0
+    return _consume, medicine_table
+
+
+def read_medicine_mapping(mapping_file):
+    # drug name (lower case) -> categories, drug_list.csv has no header
     name_cate_dict = dict()
     with open(mapping_file, 'r', encoding='utf-8-sig', newline='') as file:
         csv_reader = csv.reader(file)
@@ -491,204 +991,114 @@ def get_medicine(visit_dict, save_root, medicine_path, mapping_file, read_from_c
                 name_cate_dict[english_name.lower()].append(category)
             else:
                 name_cate_dict[english_name.lower()] = [category]
-    for patient_id in visit_dict:
-        medicine_dict[patient_id] = dict()
-        for visit_id in visit_dict[patient_id]:
-            medicine_dict[patient_id][visit_id] = dict()
-            for key in name_cate_dict:
-                for item in name_cate_dict[key]:
-                    medicine_dict[patient_id][visit_id][item] = 0
+    return name_cate_dict
 
-    with open(medicine_path, 'r', encoding='utf-8-sig', newline='') as file:
-        csv_reader = csv.reader(file)
-        for line in islice(csv_reader, 1, None):
-            patient_id, visit_id, start_date = line[1], line[2], line[4]
-            if len(start_date) < 10:
-                continue
-            if not (visit_dict.__contains__(patient_id) and visit_dict[patient_id].__contains__(visit_id)):
-                continue
-            start_date = datetime.datetime.strptime(start_date, '%Y-%m-%d %H:%M:%S')
-            time_difference = (start_date - visit_dict[patient_id][visit_id]['admit_time'])
-            if (time_difference.seconds+time_difference.days*24*3600)/3600 > off_set:
-                continue
-
-            drug_name = (line[7]+"_"+line[8]+'_'+line[9]).lower()
-            for key in name_cate_dict:
-                if drug_name.__contains__(key):
-                    for item in name_cate_dict[key]:
-                        medicine_dict[patient_id][visit_id][item] = 1
 
-    data_to_write = [['patient_id', 'visit_id', 'medicine', 'usage']]
-    for patient_id in medicine_dict:
-        for visit_id in medicine_dict[patient_id]:
-            for drug in medicine_dict[patient_id][visit_id]:
-                data_to_write.append([patient_id, visit_id, drug, medicine_dict[patient_id][visit_id][drug]])
-    with open(os.path.join(save_root, file_name), 'w', encoding='utf-8-sig', newline='') as file:
-        csv.writer(file).writerows(data_to_write)
-    return medicine_dict
+@measure('get_lab_test')
+def get_lab_test(visit_index, save_root, lab_test_path, mapping_file, read_from_cache=True, file_name='lab_test.npz',
+                 cache_key=None, lab_test_table=None):
+    if read_from_cache:
+        cached_table = load_table_cache(os.path.join(save_root, file_name), cache_key, visit_index)
+        if cached_table is not None:
+            return cached_table
 
+    if lab_test_table is None:
+        lab_test_consumer, lab_test_table = get_lab_test_consumer(visit_index, read_lab_mapping(mapping_file))
+        scan_table(lab_test_path, [lab_test_consumer])
 
-def get_lab_test(visit_dict, save_root, lab_test_path, mapping_file, read_from_cache=True, file_name='lab_test.csv'):
-    if read_from_cache:
-        lab_test_dict = dict()
-        with open(os.path.join(save_root, file_name), 'r', encoding='utf-8-sig', newline='') as file:
-            csv_reader = csv.reader(file)
-            for line in islice(csv_reader, 1, None):
-                patient_id, visit_id, feature, value, record_time = line
-                record_time = datetime.datetime.strptime(record_time, '%Y-%m-%d %H:%M:%S')
-                result_list = re.findall('[-+]?[\d]+(?:,\d\d\d)*[.]?\d*(?:[eE][-+]?\d+)?', value)
-                if len(result_list) > 0:
-                    value = float(result_list[0])
-                if not lab_test_dict.__contains__(patient_id):
-                    lab_test_dict[patient_id] = dict()
-                if not lab_test_dict[patient_id].__contains__(visit_id):
-                    lab_test_dict[patient_id][visit_id] = dict()
-                lab_test_dict[patient_id][visit_id][feature] = [value, record_time]
-        return lab_test_dict
+    save_table_cache(os.path.join(save_root, file_name), cache_key, lab_test_table)
+    return lab_test_table
 
-    # 读取mapping_file
-    mapping_dict = dict()
-    with open(mapping_file, 'r', encoding='utf-8-sig', newline='') as file:
-        csv_reader = csv.reader(file)
-        for line in islice(csv_reader, 1, None):
-            lab_label, lab_chinese_name, lab_code = line[0: 3]
-            mapping_dict[lab_code] = lab_label, lab_chinese_name
-    # 构建模板
-    lab_test_dict = dict()
-    for patient_id in visit_dict:
-        lab_test_dict[patient_id] = dict()
-        for visit_id in visit_dict[patient_id]:
-            lab_test_dict[patient_id][visit_id] = dict()
-            for code in mapping_dict:
-                lab_test_dict[patient_id][visit_id][mapping_dict[code][1]] = \
-                    [-1, datetime.datetime(2500, 1, 1, 0, 0, 0, 0)]
 
-    with open(lab_test_path, 'r', newline='') as file:
-        csv_reader = csv.reader(file)
-        for line in islice(csv_reader, 1, None):
-            patient_id, visit_id, lab_code, test_time, result = line[1: 6]
-            if not (lab_test_dict.__contains__(patient_id) and lab_test_dict[patient_id].__contains__(visit_id)):
-                continue
-            if (not mapping_dict.__contains__(lab_code)) or len(test_time) < 10:
-                continue
-            test_time = datetime.datetime.strptime(test_time, '%Y-%m-%d %H:%M:%S')
-
-            if test_time < lab_test_dict[patient_id][visit_id][mapping_dict[lab_code][1]][1]:
-                result_list = re.findall('[-+]?[\d]+(?:,\d\d\d)*[.]?\d*(?:[eE][-+]?\d+)?', result)
-                if len(result_list) > 0:
-                    if result_list[0].__contains__(','):
-                        result_list[0] = result_list[0].replace(',', '')
-                    result = float(result_list[0])
-                lab_test_dict[patient_id][visit_id][mapping_dict[lab_code][1]] = [result, test_time]
-
-    data_to_write = [['patient_id', 'visit_id', 'feature', 'value', 'record_time']]
-    for patient_id in lab_test_dict:
-        for visit_id in lab_test_dict[patient_id]:
-            for feature in lab_test_dict[patient_id][visit_id]:
-                value, record_time = lab_test_dict[patient_id][visit_id][feature]
-                data_to_write.append([patient_id, visit_id, feature, value, record_time])
-    with open(os.path.join(save_root, file_name), 'w', encoding='utf-8-sig', newline='') as file:
-        csv.writer(file).writerows(data_to_write)
-    return lab_test_dict
-
-
-def get_admissions(admission_path, save_root, read_from_cache=True, file_name='admission.csv'):
+@measure('get_admissions')
+def get_admissions(admission_path, save_root, read_from_cache=True, file_name='admission.npz', cache_key=None):
+    # return the visits (patient_id -> visit_id -> admission info) and their VisitIndex
     if read_from_cache:
-        visit_dict = dict()
-        with open(os.path.join(save_root, file_name), 'r', newline='', encoding='utf-8-sig') as file:
-            csv_reader = csv.reader(file)
-            for line in islice(csv_reader, 1, None):
-                patient_id, visit_id, admit_time, discharge_time, death_time, ethnicity = line
-                admit_time = datetime.datetime.strptime(admit_time, '%Y-%m-%d %H:%M:%S')
-                discharge_time = datetime.datetime.strptime(discharge_time, '%Y-%m-%d %H:%M:%S')
-                death_time = datetime.datetime.strptime(death_time, '%Y-%m-%d %H:%M:%S')
-                if not visit_dict.__contains__(patient_id):
-                    visit_dict[patient_id] = dict()
-                visit_dict[patient_id][visit_id] = {'admit_time': admit_time, 'discharge_time': discharge_time,
-                                                    'death_time': death_time, 'ethnicity': ethnicity}
-        return visit_dict
+        visit_dict = load_nested_cache(os.path.join(save_root, file_name), cache_key)
+        if visit_dict is not None:
+            return visit_dict, VisitIndex(get_visit_key_list(visit_dict))
     visit_dict = dict()
-    with open(admission_path, 'r', newline='') as file:
+    with open_table(admission_path) as file:
         csv_reader = csv.reader(file)
-        for line in islice(csv_reader, 1, None):
-            patient_id, visit_id, admit_time, discharge_time, death_time = line[1: 6]
-            ethnicity = line[13]
+        line_list = [line for line in islice(csv_reader, 1, None)]
+    add_scan_count(len(line_list), len(line_list), os.path.getsize(admission_path))
+    # the time columns of the (small) admission table are parsed as a whole
+    admit_time_list = parse_time_column([line[3] for line in line_list]).tolist()
+    discharge_time_list = parse_time_column([line[4] for line in line_list]).tolist()
+    death_time_list = parse_time_column([line[5] if len(line[5]) > 0 else '1900-01-01 00:00:00'
+                                         for line in line_list]).tolist()
+    for line, admit_time, discharge_time, death_time in \
+            zip(line_list, admit_time_list, discharge_time_list, death_time_list):
+        patient_id, visit_id = line[1: 3]
+        ethnicity = line[13]
+        if not visit_dict.__contains__(patient_id):
+            visit_dict[patient_id] = dict()
+        visit_dict[patient_id][visit_id] = {'admit_time': admit_time, 'discharge_time': discharge_time,
+                                            "death_time": death_time, "ethnicity": ethnicity}
 
-            admit_time = datetime.datetime.strptime(admit_time, '%Y-%m-%d %H:%M:%S')
-            discharge_time = datetime.datetime.strptime(discharge_time, '%Y-%m-%d %H:%M:%S')
-            if len(death_time) > 0:
-                death_time = datetime.datetime.strptime(death_time, '%Y-%m-%d %H:%M:%S')
-            else:
-                death_time = datetime.datetime.strptime('1900-01-01 00:00:00', '%Y-%m-%d %H:%M:%S')
-            if not visit_dict.__contains__(patient_id):
-                visit_dict[patient_id] = dict()
-            visit_dict[patient_id][visit_id] = {'admit_time': admit_time, 'discharge_time': discharge_time,
-                                                "death_time": death_time, "ethnicity": ethnicity}
-
-    with open(os.path.join(save_root, file_name), 'w', newline='', encoding='utf-8-sig') as file:
-        data_to_write = [['patient_id', 'visit_id', 'admit_time', 'discharge_time', 'death_time', 'ethnicity']]
-        for patient_id in visit_dict:
-            for visit_id in visit_dict[patient_id]:
-                admit_time = visit_dict[patient_id][visit_id]['admit_time']
-                discharge_time = visit_dict[patient_id][visit_id]['discharge_time']
-                death_time = visit_dict[patient_id][visit_id]['death_time']
-                ethnicity = visit_dict[patient_id][visit_id]['ethnicity']
-                data_to_write.append([patient_id, visit_id, admit_time, discharge_time, death_time, ethnicity])
-        csv.writer(file).writerows(data_to_write)
+    save_nested_cache(os.path.join(save_root, file_name), cache_key, visit_dict,
+                      {'admit_time', 'discharge_time', 'death_time'})
 
-    return visit_dict
+    return visit_dict, VisitIndex(get_visit_key_list(visit_dict))
 
 
-def get_diagnosis(visit_dict, save_root, diagnosis_path, mapping_file, read_from_cache=True, file_name='diagnosis.csv'):
-    if read_from_cache:
-        diagnosis_dict = dict()
-        with open(os.path.join(save_root, file_name), 'r', encoding='utf-8-sig', newline='') as file:
-            csv_reader = csv.reader(file)
-            for line in islice(csv_reader, 1, None):
-                patient_id, visit_id, disease, positive = line
-                if not diagnosis_dict.__contains__(patient_id):
-                    diagnosis_dict[patient_id] = dict()
-                if not diagnosis_dict[patient_id].__contains__(visit_id):
-                    diagnosis_dict[patient_id][visit_id] = dict()
-                diagnosis_dict[patient_id][visit_id][disease] = int(positive)
-        return diagnosis_dict
-
-    diagnosis_dict = dict()
+def read_diagnosis_mapping(mapping_file):
+    # [disease name, code] pairs in file order
     diagnosis_map_list = list()
-    diagnosis_set = set()
     with open(mapping_file, 'r', encoding='utf-8-sig', newline='') as file:
         csv_reader = csv.reader(file)
         for line in islice(csv_reader, 1, None):
             diagnosis_map_list.append([line[1], line[4]])
-            diagnosis_set.add(line[1])
+    return diagnosis_map_list
 
-    # 构建基本映射
-    for patient_id in visit_dict:
-        diagnosis_dict[patient_id] = dict()
-        for visit_id in visit_dict[patient_id]:
-            diagnosis_dict[patient_id][visit_id] = dict()
-            for item in diagnosis_set:
-                diagnosis_dict[patient_id][visit_id][item] = 0
 
-    with open(diagnosis_path, 'r', newline='') as file:
-        csv_reader = csv.reader(file)
-        for line in islice(csv_reader, 1, None):
-            _, patient_id, visit_id, _, icd_code = line
-            if not (diagnosis_dict.__contains__(patient_id) and diagnosis_dict[patient_id].__contains__(visit_id)):
-                continue
-            for item in diagnosis_map_list:
-                name, code = item
-                if icd_code.__contains__(code):
-                    diagnosis_dict[patient_id][visit_id][name] = 1
-
-    data_to_write = [['patient_id', 'visit_id', 'disease', 'positive']]
-    for patient_id in diagnosis_dict:
-        for visit_id in diagnosis_dict[patient_id]:
-            for disease in diagnosis_dict[patient_id][visit_id]:
-                data_to_write.append([patient_id, visit_id, disease, diagnosis_dict[patient_id][visit_id][disease]])
-    with open(os.path.join(save_root, file_name), 'w', encoding='utf-8-sig', newline='') as file:
-        csv.writer(file).writerows(data_to_write)
-    return diagnosis_dict
+@measure('get_diagnosis')
+def get_diagnosis(visit_index, save_root, diagnosis_path, mapping_file, read_from_cache=True, file_name='diagnosis.npz',
+                  cache_key=None, strict_prefix=False):
+    # by default a mapped code matches an ICD-9 code containing it anywhere, with strict_prefix=True it has to be a
+    # prefix of the ICD-9 code
+    if read_from_cache:
+        diagnosis_table = load_table_cache(os.path.join(save_root, file_name), cache_key, visit_index)
+        if diagnosis_table is not None:
+            return diagnosis_table
+    diagnosis_consumer, diagnosis_table = get_diagnosis_consumer(visit_index, mapping_file, strict_prefix)
+    scan_table(diagnosis_path, [diagnosis_consumer])
+
+    save_table_cache(os.path.join(save_root, file_name), cache_key, diagnosis_table)
+    return diagnosis_table
+
+
+def get_diagnosis_consumer(visit_index, mapping_file, strict_prefix=False, diagnosis_table=None):
+    # rows are merged into diagnosis_table if it is given
+    diagnosis_map_list = read_diagnosis_mapping(mapping_file)
+    if diagnosis_table is None:
+        diagnosis_table = VisitTable(visit_index, dict.fromkeys(name for name, _ in diagnosis_map_list), binary=True)
+    code_column_dict = dict()
+    for name, code in diagnosis_map_list:
+        if not code_column_dict.__contains__(code):
+            code_column_dict[code] = list()
+        code_column_dict[code].append(diagnosis_table.column_dict[name])
+    if strict_prefix:
+        code_trie = build_prefix_trie(list(code_column_dict))
+    else:
+        code_automaton = build_automaton(list(code_column_dict))
+    # ICD-9 codes repeat heavily, every distinct code is resolved to its disease columns only once
+    icd_column_dict = dict()
+
+    def _consume(line):
+        _, patient_id, visit_id, _, icd_code = line
+        row = diagnosis_table.get_row(patient_id, visit_id)
+        if row < 0:
+            return
+        if not icd_column_dict.__contains__(icd_code):
+            if strict_prefix:
+                code_set = find_prefix(code_trie, icd_code)
+            else:
+                code_set = find_pattern(code_automaton, icd_code)
+            icd_column_dict[icd_code] = sorted({column for code in code_set for column in code_column_dict[code]})
+        diagnosis_table.value[row, icd_column_dict[icd_code]] = 1
+        return len(icd_column_dict[icd_code]) > 0
+    return _consume, diagnosis_table
 
 
 if __name__ == '__main__':
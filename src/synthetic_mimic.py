@@ -0,0 +1,254 @@
+import csv
+import datetime
+import os
+import random
+from itertools import islice
+
+# header of every generated table, same as the MIMIC-III (v1.4) files
+TABLE_HEADER_DICT = {
+    'ADMISSIONS': ['ROW_ID', 'SUBJECT_ID', 'HADM_ID', 'ADMITTIME', 'DISCHTIME', 'DEATHTIME', 'ADMISSION_TYPE',
+                   'ADMISSION_LOCATION', 'DISCHARGE_LOCATION', 'INSURANCE', 'LANGUAGE', 'RELIGION', 'MARITAL_STATUS',
+                   'ETHNICITY', 'EDREGTIME', 'EDOUTTIME', 'DIAGNOSIS', 'HOSPITAL_EXPIRE_FLAG', 'HAS_CHARTEVENTS_DATA'],
+    'PATIENTS': ['ROW_ID', 'SUBJECT_ID', 'GENDER', 'DOB', 'DOD', 'DOD_HOSP', 'DOD_SSN', 'EXPIRE_FLAG'],
+    'LABEVENTS': ['ROW_ID', 'SUBJECT_ID', 'HADM_ID', 'ITEMID', 'CHARTTIME', 'VALUE', 'VALUENUM', 'VALUEUOM', 'FLAG'],
+    'CHARTEVENTS': ['ROW_ID', 'SUBJECT_ID', 'HADM_ID', 'ICUSTAY_ID', 'ITEMID', 'CHARTTIME', 'STORETIME', 'CGID',
+                    'VALUE', 'VALUENUM', 'VALUEUOM', 'WARNING', 'ERROR', 'RESULTSTATUS', 'STOPPED'],
+    'PRESCRIPTIONS': ['ROW_ID', 'SUBJECT_ID', 'HADM_ID', 'ICUSTAY_ID', 'STARTDATE', 'ENDDATE', 'DRUG_TYPE', 'DRUG',
+                      'DRUG_NAME_POE', 'DRUG_NAME_GENERIC', 'FORMULARY_DRUG_CD', 'GSN', 'NDC', 'PROD_STRENGTH',
+                      'DOSE_VAL_RX', 'DOSE_UNIT_RX', 'FORM_VAL_DISP', 'FORM_UNIT_DISP', 'ROUTE'],
+    'DIAGNOSES_ICD': ['ROW_ID', 'SUBJECT_ID', 'HADM_ID', 'SEQ_NUM', 'ICD9_CODE'],
+    'PROCEDURES_ICD': ['ROW_ID', 'SUBJECT_ID', 'HADM_ID', 'SEQ_NUM', 'ICD9_CODE']
+}
+# mean number of rows of a table per admission. MIMIC-III has far more chartevents and labevents rows per admission
+# (about 5,600 and 470), they are scaled down so that the 1x data set is generated in seconds
+ROW_PER_VISIT_DICT = {'LABEVENTS': 40, 'CHARTEVENTS': 80, 'PRESCRIPTIONS': 12, 'DIAGNOSES_ICD': 9,
+                      'PROCEDURES_ICD': 2}
+# ITEMID, unit, minimum and maximum of the vital signs read by read_raw_mimic_data.py, including units it discards
+VITAL_SIGN_ITEM_LIST = [
+    ['51', 'mmHg', 70, 190], ['455', 'mmHg', 70, 190], ['220179', 'mmHg', 70, 190], ['220050', 'mmHg', 70, 190],
+    ['8368', 'mmHg', 30, 110], ['8441', 'mmHg', 30, 110], ['220180', 'mmHg', 30, 110], ['220051', 'mmHg', 30, 110],
+    ['226707', 'inch', 55, 78], ['1394', 'Inch', 55, 78], ['920', 'cm', 145, 200], ['226730', 'cm', 145, 200],
+    ['216', 'feet', 4.5, 6.5], ['226512', 'kg', 40, 140], ['763', 'kg', 40, 140], ['3580', 'kg', 40, 140],
+    ['224639', 'kg', 40, 140], ['3581', 'lbs', 90, 300], ['226531', '', 90, 300], ['3582', 'oz', 1400, 4900],
+    ['762', 'kg', 40, 140], ['51', 'cmH2O', 5, 20]
+]
+# other frequent chartevents items (heart rate, respiratory rate, SpO2, temperature, GCS, ...)
+OTHER_CHART_ITEM_LIST = [
+    ['211', 'bpm', 40, 150], ['220045', 'bpm', 40, 150], ['618', 'BPM', 8, 35], ['220210', 'insp/min', 8, 35],
+    ['646', '%', 85, 100], ['220277', '%', 85, 100], ['678', 'Deg. F', 95, 104], ['223761', '?F', 95, 104],
+    ['198', 'points', 3, 15], ['220739', '', 1, 4]
+]
+# other frequent labevents items (glucose, hematocrit, WBC, chloride, bicarbonate, ...)
+OTHER_LAB_ITEM_LIST = [
+    ['50931', 'mg/dL', 60, 300], ['51221', '%', 20, 50], ['51301', 'K/uL', 2, 25], ['50902', 'mEq/L', 90, 115],
+    ['50882', 'mEq/L', 15, 35], ['51265', 'K/uL', 50, 450], ['50868', 'mEq/L', 5, 25], ['51237', '', 0.9, 3.5]
+]
+TEXT_RESULT_LIST = ['NEG', 'TR', '<0.5', 'GREATER THAN 100', 'HEMOLYZED', 'UNABLE TO REPORT', '1,200']
+OTHER_DRUG_LIST = ['Sodium Chloride 0.9%  Flush', 'Potassium Chloride', 'Insulin', 'Acetaminophen', 'Docusate Sodium',
+                   'Senna', 'Pantoprazole', 'Magnesium Sulfate', 'D5W', 'Morphine Sulfate', 'Ondansetron']
+ETHNICITY_LIST = ['WHITE', 'WHITE', 'WHITE', 'BLACK/AFRICAN AMERICAN', 'HISPANIC OR LATINO', 'ASIAN',
+                  'UNKNOWN/NOT SPECIFIED']
+
+
+def main():
+    target_root = os.path.abspath('../resource/synthetic_data/raw_data')
+    mapping_root = os.path.abspath('../resource/reproduce_mapping')
+    # MIMIC-III contains 46,520 patients
+    patient_num = 1000
+    seed = 0
+    generate_synthetic_mimic(target_root, mapping_root, patient_num, seed)
+
+
+def generate_synthetic_mimic(target_root, mapping_root, patient_num, seed=0, row_per_visit_dict=None):
+    # write the seven tables read by read_raw_mimic_data.py into target_root. the codes are drawn from the mapping
+    # files (a part of them matches, the rest does not), the same seed and parameters give identical files. rows
+    # are written patient by patient, so the memory does not grow with the scale
+    if row_per_visit_dict is None:
+        row_per_visit_dict = ROW_PER_VISIT_DICT
+    random_state = random.Random(seed)
+    code_dict = read_mapping_code(mapping_root)
+    if not os.path.exists(target_root):
+        os.makedirs(target_root)
+
+    # visits per patient follow the skewed distribution of MIMIC-III (most patients have one admission), SUBJECT_ID
+    # and HADM_ID are sparse like the original ones
+    visit_num_list = [min(1 + int(random_state.expovariate(1.5)), 20) for _ in range(patient_num)]
+    subject_id_list = sorted(random_state.sample(range(2, 2 + 2 * patient_num), patient_num))
+    hadm_id_list = random_state.sample(range(100001, 100001 + 2 * max(sum(visit_num_list), 50000)),
+                                       sum(visit_num_list))
+
+    file_dict, writer_dict = dict(), dict()
+    row_id_dict = {table_name: 0 for table_name in TABLE_HEADER_DICT}
+    try:
+        for table_name in TABLE_HEADER_DICT:
+            file_dict[table_name] = open(os.path.join(target_root, table_name + '.csv'), 'w', encoding='utf-8',
+                                         newline='')
+            writer_dict[table_name] = csv.writer(file_dict[table_name], lineterminator='\n')
+            writer_dict[table_name].writerow(TABLE_HEADER_DICT[table_name])
+
+        def _write(table_name, line):
+            row_id_dict[table_name] += 1
+            writer_dict[table_name].writerow([row_id_dict[table_name]] + line)
+
+        hadm_id_iterator = iter(hadm_id_list)
+        for subject_id, visit_num in zip(subject_id_list, visit_num_list):
+            generate_patient(random_state, subject_id, list(islice(hadm_id_iterator, visit_num)), code_dict,
+                             row_per_visit_dict, _write)
+    finally:
+        for file in file_dict.values():
+            file.close()
+    return sum(visit_num_list)
+
+
+def read_mapping_code(mapping_root):
+    code_dict = dict()
+    with open(os.path.join(mapping_root, 'disease_list.csv'), 'r', encoding='utf-8-sig', newline='') as file:
+        code_dict['diagnosis'] = sorted({line[4] for line in islice(csv.reader(file), 1, None)})
+    with open(os.path.join(mapping_root, 'operation_list.csv'), 'r', encoding='utf-8-sig', newline='') as file:
+        code_dict['procedure'] = sorted({line[1] for line in islice(csv.reader(file), 1, None)})
+    with open(os.path.join(mapping_root, 'lab_test_list.csv'), 'r', encoding='utf-8-sig', newline='') as file:
+        # creatinine is generated separately
+        code_dict['lab_test'] = sorted({line[2] for line in islice(csv.reader(file), 1, None)} - {'50912'})
+    with open(os.path.join(mapping_root, 'drug_list.csv'), 'r', encoding='utf-8-sig', newline='') as file:
+        code_dict['medicine'] = sorted({line[2] for line in csv.reader(file)})
+    return code_dict
+
+
+def generate_patient(random_state, subject_id, hadm_id_list, code_dict, row_per_visit_dict, write):
+    # dates are shifted into 2100 - 2200 like MIMIC-III, patients older than 89 get a date of birth 300 years earlier
+    first_admit_time = datetime.datetime(2100, 1, 1) + datetime.timedelta(seconds=random_state.randint(0, 100 * 365 *
+                                                                                                       86400))
+    choice = random_state.random()
+    age = 0 if choice < 0.1 else 300 if choice > 0.95 else random_state.randint(18, 89)
+    birthday = (first_admit_time - datetime.timedelta(days=age * 365 + random_state.randint(0, 364))).replace(
+        hour=0, minute=0, second=0)
+    gender = random_state.choice(['M', 'F'])
+
+    admit_time = first_admit_time
+    death_time = None
+    for index, hadm_id in enumerate(hadm_id_list):
+        length_of_stay = datetime.timedelta(seconds=random_state.randint(86400, 21 * 86400))
+        discharge_time = admit_time + length_of_stay
+        if index == len(hadm_id_list) - 1 and random_state.random() < 0.1:
+            death_time = discharge_time
+        write('ADMISSIONS', [subject_id, hadm_id, format_datetime(admit_time), format_datetime(discharge_time),
+                             format_datetime(death_time), random_state.choice(['EMERGENCY', 'ELECTIVE', 'URGENT']),
+                             'EMERGENCY ROOM ADMIT', 'DEAD/EXPIRED' if death_time is not None else 'HOME',
+                             random_state.choice(['Medicare', 'Private', 'Medicaid']), 'ENGL', 'CATHOLIC', 'MARRIED',
+                             random_state.choice(ETHNICITY_LIST), '', '', 'CONGESTIVE HEART FAILURE',
+                             1 if death_time is not None else 0, 1])
+        generate_diagnosis(random_state, subject_id, hadm_id, code_dict, row_per_visit_dict['DIAGNOSES_ICD'], write)
+        generate_procedure(random_state, subject_id, hadm_id, code_dict, row_per_visit_dict['PROCEDURES_ICD'], write)
+        generate_lab_test(random_state, subject_id, hadm_id, admit_time, length_of_stay, code_dict,
+                          row_per_visit_dict['LABEVENTS'], write)
+        generate_chart_event(random_state, subject_id, hadm_id, admit_time, length_of_stay,
+                             row_per_visit_dict['CHARTEVENTS'], write)
+        generate_medicine(random_state, subject_id, hadm_id, admit_time, length_of_stay, code_dict,
+                          row_per_visit_dict['PRESCRIPTIONS'], write)
+        admit_time = discharge_time + datetime.timedelta(seconds=random_state.randint(86400, 3 * 365 * 86400))
+    write('PATIENTS', [subject_id, gender, format_datetime(birthday), format_datetime(death_time),
+                       format_datetime(death_time), '', 1 if death_time is not None else 0])
+
+
+def generate_diagnosis(random_state, subject_id, hadm_id, code_dict, mean_num, write):
+    # a mapped code is a prefix of (or equal to) an ICD-9 code, so it is completed with random digits
+    for sequence in range(1, random_state.randint(1, 2 * mean_num) + 1):
+        if random_state.random() < 0.4:
+            code = random_state.choice(code_dict['diagnosis'])
+            code = code + ''.join(random_state.choice('0123456789') for _ in range(random_state.randint(0, 5 -
+                                                                                                         len(code))))
+        else:
+            code = str(random_state.randint(1, 99999)).zfill(random_state.choice([4, 5]))
+        write('DIAGNOSES_ICD', [subject_id, hadm_id, sequence, code])
+
+
+def generate_procedure(random_state, subject_id, hadm_id, code_dict, mean_num, write):
+    for sequence in range(1, random_state.randint(0, 2 * mean_num) + 1):
+        if random_state.random() < 0.3:
+            code = random_state.choice(code_dict['procedure'])
+        else:
+            code = str(random_state.randint(1, 9999)).zfill(4)
+        write('PROCEDURES_ICD', [subject_id, hadm_id, sequence, code])
+
+
+def generate_lab_test(random_state, subject_id, hadm_id, admit_time, length_of_stay, code_dict, mean_num, write):
+    # creatinine scatters around a baseline, about a fifth of the visits get an AKI (the creatinine rises to twice of
+    # the baseline) at a random time. rows before the admission and outpatient rows (without HADM_ID) occur as in
+    # MIMIC-III
+    baseline = random_state.uniform(0.5, 1.6)
+    aki_time = None
+    if random_state.random() < 0.2:
+        aki_time = admit_time + datetime.timedelta(seconds=random_state.randint(0, int(
+            length_of_stay.total_seconds())))
+    for _ in range(random_state.randint(0, 2 * mean_num)):
+        chart_time = admit_time + datetime.timedelta(seconds=random_state.randint(-2 * 86400, int(
+            length_of_stay.total_seconds())))
+        visit_id = hadm_id if random_state.random() > 0.1 else ''
+        choice = random_state.random()
+        if choice < 0.3:
+            item_id, unit = '50912', 'mg/dL'
+            creatinine = baseline * random_state.uniform(0.9, 1.1)
+            if aki_time is not None and chart_time >= aki_time:
+                creatinine = creatinine * 2
+            value = '{:.1f}'.format(creatinine)
+        elif choice < 0.7:
+            item_id, unit = random_state.choice(code_dict['lab_test']), 'mg/dL'
+            value = '{:.1f}'.format(random_state.uniform(0.1, 300))
+        else:
+            item_id, unit, minimum, maximum = random_state.choice(OTHER_LAB_ITEM_LIST)
+            value = '{:.1f}'.format(random_state.uniform(minimum, maximum))
+        if random_state.random() < 0.04:
+            value = random_state.choice(TEXT_RESULT_LIST)
+        value_num = value if is_number(value) else ''
+        flag = 'abnormal' if random_state.random() < 0.2 else ''
+        write('LABEVENTS', [subject_id, visit_id, item_id, format_datetime(chart_time), value, value_num, unit, flag])
+
+
+def generate_chart_event(random_state, subject_id, hadm_id, admit_time, length_of_stay, mean_num, write):
+    icu_stay_id = random_state.randint(200001, 299999)
+    for _ in range(random_state.randint(0, 2 * mean_num)):
+        chart_time = admit_time + datetime.timedelta(seconds=random_state.randint(-3600, int(
+            length_of_stay.total_seconds())))
+        if random_state.random() < 0.4:
+            item_id, unit, minimum, maximum = random_state.choice(VITAL_SIGN_ITEM_LIST)
+        else:
+            item_id, unit, minimum, maximum = random_state.choice(OTHER_CHART_ITEM_LIST)
+        value = '{:.1f}'.format(random_state.uniform(minimum, maximum))
+        value_num = value if random_state.random() > 0.02 else ''
+        store_time = chart_time + datetime.timedelta(seconds=random_state.randint(0, 3600))
+        write('CHARTEVENTS', [subject_id, hadm_id, icu_stay_id, item_id, format_datetime(chart_time),
+                              format_datetime(store_time), random_state.randint(14000, 21000), value, value_num, unit,
+                              0, 0, '', ''])
+
+
+def generate_medicine(random_state, subject_id, hadm_id, admit_time, length_of_stay, code_dict, mean_num, write):
+    # STARTDATE is a date (time 00:00:00), drug names are upper, lower or mixed case like in MIMIC-III
+    for _ in range(random_state.randint(0, 2 * mean_num)):
+        start_time = admit_time + datetime.timedelta(seconds=random_state.randint(0, int(
+            length_of_stay.total_seconds())))
+        start_date = start_time.replace(hour=0, minute=0, second=0)
+        end_date = start_date + datetime.timedelta(days=random_state.randint(1, 7))
+        if random_state.random() < 0.4:
+            drug = random_state.choice(code_dict['medicine'])
+            drug = random_state.choice([drug, drug.upper(), drug.capitalize()])
+        else:
+            drug = random_state.choice(OTHER_DRUG_LIST)
+        write('PRESCRIPTIONS', [subject_id, hadm_id, '', format_datetime(start_date), format_datetime(end_date),
+                                'MAIN', drug, drug, drug if random_state.random() < 0.8 else '', '', '', '',
+                                '', '1', 'TAB', '1', 'TAB', 'PO'])
+
+
+def format_datetime(time):
+    return time.strftime('%Y-%m-%d %H:%M:%S') if time is not None else ''
+
+
+def is_number(text):
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+import csv
+import gzip
+import io
+import os
+import queue
+import threading
+from itertools import islice
+from telemetry import is_telemetry_enabled, add_scan_count
+
+# table path -> watermark of the rows read by the scans of a run, see limit_scan
+_scan_limit_dict = dict()
+
+
+def limit_scan(path_list):
+    # from now on, the scans of an uncompressed table of path_list read the rows which are complete now only, and
+    # the scans of a compressed one (which can only be read as a whole) record the largest ROW_ID they read, so that
+    # get_scan_watermark gives the watermark of exactly the rows a run has read. the tables of an earlier call are
+    # not limited any more, an empty path_list removes all limits
+    _scan_limit_dict.clear()
+    for file_path in path_list:
+        if is_compressed(file_path):
+            _scan_limit_dict[os.path.abspath(file_path)] = {'row_id': None}
+        else:
+            _scan_limit_dict[os.path.abspath(file_path)] = {'byte_offset': get_row_end(file_path)}
+
+
+def get_scan_watermark(file_path):
+    # watermark of the rows of a table limited by limit_scan which were read, None if a compressed table was not
+    # scanned. the watermark of a compressed table scanned several times is the smallest one
+    limit = _scan_limit_dict.get(os.path.abspath(file_path))
+    if limit is None or limit.get('row_id', 0) is None:
+        return None
+    return dict(limit)
+
+
+def clip_range_list(file_path, range_list):
+    # byte ranges of a table limited by limit_scan cut at its limit (the whole body if range_list is None), other
+    # tables keep range_list
+    limit = _scan_limit_dict.get(os.path.abspath(file_path))
+    if limit is None or not limit.__contains__('byte_offset'):
+        return range_list
+    end = limit['byte_offset']
+    if range_list is None:
+        range_list = [(get_body_start(file_path), end)]
+    return [(start, min(stop, end)) for start, stop in range_list if start < end]
+
+
+def scan_table(file_path, consumer_list, range_list=None, encoding=None):
+    # read a raw table once and feed every row to all registered consumers, so that several extractors which
+    # depend on the same (large) table do not need to parse it repeatedly. if range_list is given (e.g. selected
+    # from an ITEMID index), only rows inside these newline-aligned byte ranges are read. the rows of a table
+    # limited by limit_scan are cut at its limit
+    range_list = clip_range_list(file_path, range_list)
+    limit = _scan_limit_dict.get(os.path.abspath(file_path))
+    if limit is not None and limit.__contains__('row_id'):
+        max_row_id = [0]
+
+        def _track_row_id(line):
+            if len(line) > 0 and int(line[0]) > max_row_id[0]:
+                max_row_id[0] = int(line[0])
+        _scan_table(file_path, list(consumer_list) + [_track_row_id], range_list, encoding)
+        limit['row_id'] = max_row_id[0] if limit['row_id'] is None else min(limit['row_id'], max_row_id[0])
+        return
+    _scan_table(file_path, consumer_list, range_list, encoding)
+
+
+def _scan_table(file_path, consumer_list, range_list=None, encoding=None):
+    if is_telemetry_enabled():
+        _scan_table_counted(file_path, consumer_list, range_list, encoding)
+        return
+    if range_list is not None:
+        for start, end in range_list:
+            for line in scan_byte_range(file_path, start, end):
+                for consumer in consumer_list:
+                    consumer(line)
+        return
+    with open_table(file_path, encoding=encoding) as file:
+        csv_reader = csv.reader(file)
+        for line in islice(csv_reader, 1, None):
+            for consumer in consumer_list:
+                consumer(line)
+
+
+def _scan_table_counted(file_path, consumer_list, range_list=None, encoding=None):
+    # scan_table which reports the rows read, the rows used by any consumer (a consumer returns True if it used the
+    # row) and the bytes read (of the compressed file for a .gz table) to the running telemetry stages
+    row_num, kept_num = 0, 0
+    if range_list is not None:
+        line_iterator = (line for start, end in range_list for line in scan_byte_range(file_path, start, end))
+        byte_num = sum(end - start for start, end in range_list)
+        file = None
+    else:
+        file = open_table(file_path, encoding=encoding)
+        line_iterator = islice(csv.reader(file), 1, None)
+        byte_num = os.path.getsize(file_path)
+    try:
+        for line in line_iterator:
+            row_num += 1
+            kept = False
+            for consumer in consumer_list:
+                if consumer(line):
+                    kept = True
+            if kept:
+                kept_num += 1
+    finally:
+        if file is not None:
+            file.close()
+        add_scan_count(row_num, kept_num, byte_num)
+
+
+def resolve_table_path(data_root, table_name):
+    # path of a MIMIC-III table (e.g. 'labevents') in data_root. file names are matched case-insensitively, and both
+    # the uncompressed (.csv) and the original compressed (.csv.gz) files are accepted, the former is preferred
+    name_dict = {file_name.lower(): file_name for file_name in os.listdir(data_root)}
+    for suffix in ['.csv', '.csv.gz']:
+        if name_dict.__contains__(table_name.lower() + suffix):
+            return os.path.join(data_root, name_dict[table_name.lower() + suffix])
+    raise FileNotFoundError('table {} is not found in {}'.format(table_name, data_root))
+
+
+def is_compressed(file_path):
+    # a compressed table can only be read sequentially, i.e. no byte ranges and no ITEMID index
+    return file_path.lower().endswith('.gz')
+
+
+def open_table(file_path, encoding=None):
+    # open a raw table as text (newline=''). a .gz file is decompressed on a background thread, so that the csv
+    # parser does not wait for the decompression
+    if not is_compressed(file_path):
+        return open(file_path, 'r', encoding=encoding, newline='')
+    return io.TextIOWrapper(io.BufferedReader(BackgroundGzipStream(file_path)), encoding=encoding, newline='')
+
+
+class BackgroundGzipStream(io.RawIOBase):
+    # decompressed bytes of a gzip file. a daemon thread decompresses chunks ahead into a bounded queue (zlib
+    # releases the GIL while inflating), the reader only copies them out
+    def __init__(self, file_path, chunk_size=4*1024*1024, queue_size=8):
+        super().__init__()
+        self._queue = queue.Queue(queue_size)
+        self._stop_event = threading.Event()
+        self._chunk = memoryview(b'')
+        self._offset = 0
+        self._finished = False
+        self._thread = threading.Thread(target=self._decompress, args=(file_path, chunk_size), daemon=True)
+        self._thread.start()
+
+    def _decompress(self, file_path, chunk_size):
+        try:
+            with gzip.open(file_path, 'rb') as file:
+                while not self._stop_event.is_set():
+                    data = file.read(chunk_size)
+                    self._put(data)
+                    if len(data) == 0:
+                        return
+        except Exception as error:
+            self._put(error)
+
+    def _put(self, item):
+        while not self._stop_event.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self._offset >= len(self._chunk):
+            if self._finished:
+                return 0
+            item = self._queue.get()
+            if isinstance(item, Exception):
+                self._finished = True
+                raise item
+            if len(item) == 0:
+                self._finished = True
+                return 0
+            self._chunk, self._offset = memoryview(item), 0
+        size = min(len(buffer), len(self._chunk) - self._offset)
+        buffer[:size] = self._chunk[self._offset: self._offset + size]
+        self._offset += size
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._stop_event.set()
+            self._thread.join()
+        super().close()
+
+
+def split_byte_range(file_path, range_num):
+    # split the body of a csv file (header excluded) into range_num newline-aligned [start, end) byte ranges.
+    # MIMIC-III tables do not contain line breaks inside quoted fields, so every range holds whole rows only
+    file_size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as file:
+        file.readline()
+        body_start = file.tell()
+        boundary_list = [body_start]
+        for index in range(1, range_num):
+            position = body_start + (file_size - body_start) * index // range_num
+            if position <= boundary_list[-1]:
+                continue
+            file.seek(position - 1)
+            file.readline()
+            position = file.tell()
+            if position >= file_size:
+                break
+            if position > boundary_list[-1]:
+                boundary_list.append(position)
+        boundary_list.append(file_size)
+    return [(boundary_list[index], boundary_list[index+1]) for index in range(len(boundary_list)-1)
+            if boundary_list[index] < boundary_list[index+1]]
+
+
+def scan_byte_range(file_path, start, end, chunk_size=16*1024*1024):
+    # yield the csv rows located in [start, end), the range must be newline-aligned
+    with open(file_path, 'rb') as file:
+        file.seek(start)
+        remain = end - start
+        tail = b''
+        while remain > 0:
+            data = file.read(min(chunk_size, remain))
+            if len(data) == 0:
+                break
+            remain -= len(data)
+            data = tail + data
+            if remain > 0:
+                cut = data.rfind(b'\n') + 1
+                data, tail = data[:cut], data[cut:]
+            else:
+                tail = b''
+            for line in csv.reader(io.StringIO(data.decode('utf-8'), newline='')):
+                yield line
+        if len(tail) > 0:
+            for line in csv.reader(io.StringIO(tail.decode('utf-8'), newline='')):
+                yield line
+
+
+def read_table_head(file_path, encoding=None):
+    with open_table(file_path, encoding=encoding) as file:
+        return next(csv.reader(file), [])
+
+
+def read_projected_table(file_path, column_list, skip_row_num=0, encoding=None):
+    # yield the values of column_list of every row of a csv file, in the order of column_list. the columns are
+    # resolved by name from the header (the last one of a repeated name, as csv.DictReader does) and the other values
+    # of a row are dropped at once. skip_row_num rows after the header are skipped
+    with open_table(file_path, encoding=encoding) as file:
+        csv_reader = csv.reader(file)
+        head = next(csv_reader, [])
+        index_dict = {name: index for index, name in enumerate(head)}
+        for column in column_list:
+            if not index_dict.__contains__(column):
+                raise ValueError('column {} is not found in {}'.format(column, file_path))
+        index_list = [index_dict[column] for column in column_list]
+        for line in islice(csv_reader, skip_row_num, None):
+            yield [line[index] for index in index_list]
+
+
+def get_body_start(file_path):
+    # offset of the first row after the header
+    with open(file_path, 'rb') as file:
+        file.readline()
+        return file.tell()
+
+
+def get_row_end(file_path, chunk_size=64*1024):
+    # offset after the last line break, a partially appended last row is left for the next run
+    position = os.path.getsize(file_path)
+    with open(file_path, 'rb') as file:
+        while position > 0:
+            start = max(0, position - chunk_size)
+            file.seek(start)
+            data = file.read(position - start)
+            index = data.rfind(b'\n')
+            if index >= 0:
+                return start + index + 1
+            position = start
+    return 0
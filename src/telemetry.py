@@ -0,0 +1,171 @@
+import cProfile
+import json
+import os
+import sys
+import time
+import tracemalloc
+from functools import wraps
+try:
+    import resource
+except ImportError:
+    # not available on Windows, where the CPU time of child processes and the peak memory are not recorded
+    resource = None
+
+# telemetry of the current process. a finished stage appends one JSON line to 'path' (None disables telemetry),
+# stages named in 'profile_set' are profiled with cProfile, and 'trace_memory' records the peak of the memory
+# allocated by Python within every stage with tracemalloc. the settings are inherited from the environment, so that
+# the stages started by pipeline.py report to the same file
+TELEMETRY_PATH_VARIABLE = 'AKI_TELEMETRY_PATH'
+TELEMETRY_PROFILE_VARIABLE = 'AKI_TELEMETRY_PROFILE'
+TELEMETRY_TRACE_MEMORY_VARIABLE = 'AKI_TELEMETRY_TRACE_MEMORY'
+_telemetry_state = {
+    'path': os.environ.get(TELEMETRY_PATH_VARIABLE) or None,
+    'profile_set': set(name for name in os.environ.get(TELEMETRY_PROFILE_VARIABLE, '').split(',') if len(name) > 0),
+    'trace_memory': os.environ.get(TELEMETRY_TRACE_MEMORY_VARIABLE) == '1'
+}
+# counters of the stages which are running, the innermost stage last
+_record_list = list()
+# functions returning cumulative counters of the process (name -> count, e.g. the hits of a memo cache), a stage
+# records how much every counter increased during it
+_counter_function_list = list()
+
+
+def configure_telemetry(path, profile_set=(), trace_memory=False):
+    _telemetry_state['path'] = path
+    _telemetry_state['profile_set'] = set(profile_set)
+    _telemetry_state['trace_memory'] = trace_memory
+
+
+def get_telemetry_environment():
+    # environment variables which pass the current settings to a child process
+    return {TELEMETRY_PATH_VARIABLE: _telemetry_state['path'] or '',
+            TELEMETRY_PROFILE_VARIABLE: ','.join(sorted(_telemetry_state['profile_set'])),
+            TELEMETRY_TRACE_MEMORY_VARIABLE: '1' if _telemetry_state['trace_memory'] else '0'}
+
+
+def is_telemetry_enabled():
+    return _telemetry_state['path'] is not None
+
+
+def register_counter(function):
+    _counter_function_list.append(function)
+
+
+def add_scan_count(row_num, kept_num=0, byte_num=0):
+    # rows parsed, rows used by an extractor and bytes read from disk, counted for every running stage
+    for record in _record_list:
+        record['rows_scanned'] += row_num
+        record['rows_kept'] += kept_num
+        record['bytes_read'] += byte_num
+
+
+def measure(stage):
+    # decorator which records the function as a stage
+    def _decorate(function):
+        @wraps(function)
+        def _measure(*args, **kwargs):
+            if not is_telemetry_enabled():
+                return function(*args, **kwargs)
+            record = start_stage(stage)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                finish_stage(record)
+        return _measure
+    return _decorate
+
+
+def start_stage(stage, **field_dict):
+    record = {'stage': stage, 'rows_scanned': 0, 'rows_kept': 0, 'bytes_read': 0}
+    record.update(field_dict)
+    if _telemetry_state['trace_memory']:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        # reset_peak (Python 3.9+) discards the peak of the enclosing stages, so it is taken over by them first.
+        # without it the peak since the first stage is recorded
+        _update_traced_peak()
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        record['_traced_peak'] = 0
+    if _telemetry_state['profile_set'].__contains__(stage) and sys.getprofile() is None:
+        record['_profiler'] = cProfile.Profile()
+        record['_profiler'].enable()
+    record['_counter_dict'] = _get_counter_dict()
+    record['_child_cpu_time'] = _get_child_cpu_time()
+    record['_cpu_time'] = time.process_time()
+    record['_wall_time'] = time.perf_counter()
+    _record_list.append(record)
+    return record
+
+
+def finish_stage(record, child_usage=None):
+    # child_usage is the resource usage of a child process which ran the stage (see os.wait4), otherwise the CPU
+    # time of the child processes reaped during the stage (e.g. a multiprocessing pool) is added
+    wall_time = time.perf_counter() - record.pop('_wall_time')
+    cpu_time = time.process_time() - record.pop('_cpu_time')
+    child_cpu_time = _get_child_cpu_time() - record.pop('_child_cpu_time')
+    start_counter_dict = record.pop('_counter_dict')
+    for name, count in _get_counter_dict().items():
+        if count - start_counter_dict.get(name, 0) > 0:
+            record[name] = count - start_counter_dict.get(name, 0)
+    # a hit rate for every pair of counters named <name>_hits and <name>_misses
+    for name in [name[:-len('_hits')] for name in record if name.endswith('_hits')]:
+        lookup_num = record[name + '_hits'] + record.get(name + '_misses', 0)
+        record[name + '_hit_rate'] = round(record[name + '_hits'] / lookup_num, 4)
+    profiler = record.pop('_profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        record['profile_path'] = os.path.join(os.path.dirname(os.path.abspath(_telemetry_state['path'])),
+                                              '{}.{}.prof'.format(record['stage'], os.getpid()))
+        profiler.dump_stats(record['profile_path'])
+    if record.__contains__('_traced_peak'):
+        _update_traced_peak()
+        record['traced_peak_mb'] = round(record.pop('_traced_peak') / 1024 / 1024, 3)
+    _record_list.remove(record)
+
+    record['wall_time'] = round(wall_time, 6)
+    if child_usage is not None and resource is not None:
+        record['cpu_time'] = round(child_usage.ru_utime + child_usage.ru_stime, 6)
+        record['peak_rss_mb'] = round(_get_rss_mb(child_usage.ru_maxrss), 3)
+    else:
+        record['cpu_time'] = round(cpu_time + child_cpu_time, 6)
+        if resource is not None:
+            # peak resident memory of this process (and of the largest reaped child) since it was started
+            record['peak_rss_mb'] = round(max(_get_rss_mb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss),
+                                              _get_rss_mb(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)),
+                                          3)
+    record['rows_per_second'] = round(record['rows_scanned'] / wall_time, 1) if wall_time > 0 else 0
+    record['pid'] = os.getpid()
+    record['time'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    # one short line per write, so that concurrent processes can append to the same file
+    with open(_telemetry_state['path'], 'a', encoding='utf-8') as file:
+        file.write(json.dumps(record) + '\n')
+    return record
+
+
+def _update_traced_peak():
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    for record in _record_list:
+        if record.__contains__('_traced_peak') and record['_traced_peak'] < traced_peak:
+            record['_traced_peak'] = traced_peak
+
+
+def _get_counter_dict():
+    counter_dict = dict()
+    for function in _counter_function_list:
+        counter_dict.update(function())
+    return counter_dict
+
+
+def _get_child_cpu_time():
+    if resource is None:
+        return 0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _get_rss_mb(max_rss):
+    # ru_maxrss is in kilobytes on linux and in bytes on macOS
+    if sys.platform == 'darwin':
+        return max_rss / 1024 / 1024
+    return max_rss / 1024
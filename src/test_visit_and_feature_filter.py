@@ -0,0 +1,23 @@
+import numpy as np
+from visit_and_feature_filter import build_typed_frame
+
+CONVERSION_DICT = {'SCr': ('SCr', '*', 88.41), 'UreaNitrogen': ('Urea', '/', 2.801)}
+
+
+def test_renamed_conversion_independent_of_column_order():
+    # the converted UreaNitrogen overrides Urea whichever column comes first, a visit without a UreaNitrogen number
+    # keeps its Urea
+    urea_nitrogen = ['28.01', '-1', None, 'abc']
+    urea = ['1', '2', '3', '4']
+    for column_list in ([('UreaNitrogen', urea_nitrogen), ('Urea', urea)],
+                        [('Urea', urea), ('UreaNitrogen', urea_nitrogen)]):
+        frame = build_typed_frame(column_list, CONVERSION_DICT)
+        assert np.allclose(frame['Urea'].value, [10, 2, 3, 4])
+        assert frame['UreaNitrogen'].text.tolist() == [None, '-1', None, '-1']
+
+
+def test_renamed_conversion_without_target_column():
+    frame = build_typed_frame([('UreaNitrogen', ['28.01', '-1']), ('SCr', ['1', None])], CONVERSION_DICT)
+    assert frame['Urea'].text.tolist() == ['10.0', None]
+    assert np.isnan(frame['UreaNitrogen'].value).all()
+    assert frame['SCr'].text.tolist() == ['88.41', None]
@@ -0,0 +1,29 @@
+import datetime
+import numpy as np
+
+# MIMIC-III timestamps are fixed width strings like '2101-10-20 19:10:11'. they are converted to int epoch seconds
+# (seconds since 1970-01-01 00:00:00), so that time differences are plain integer subtractions
+SECONDS_PER_HOUR = 3600
+SECONDS_PER_DAY = 24 * 3600
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+_day_second_dict = dict()
+
+
+def parse_time(text):
+    # the date part repeats heavily within a table, so its conversion is memoized
+    date = text[:10]
+    day_second = _day_second_dict.get(date)
+    if day_second is None:
+        day_second = (datetime.date(int(date[0:4]), int(date[5:7]), int(date[8:10])).toordinal() - _EPOCH_ORDINAL) \
+            * SECONDS_PER_DAY
+        _day_second_dict[date] = day_second
+    return day_second + int(text[11:13]) * SECONDS_PER_HOUR + int(text[14:16]) * 60 + int(text[17:19])
+
+
+def parse_time_column(text_list):
+    # vectorized version of parse_time, returns an int64 array
+    return np.array(text_list, dtype='datetime64[s]').astype(np.int64)
+
+
+# placeholder of a not yet observed record, every real record is earlier
+MAX_TIME = parse_time('2500-01-01 00:00:00')
@@ -1,9 +1,9 @@
 import csv
 import os
 from joblib import load
-from itertools import islice
 from sklearn.metrics import roc_auc_score, recall_score
 import numpy as np
+from table_scan import read_projected_table
 
 
 def main():
@@ -50,7 +50,7 @@ def main():
     label_path = os.path.abspath('../resource/mimic_unpreprocessed.csv')
     data_path = os.path.abspath('../resource/recovered_data_with_group.csv')
     model_folder = os.path.abspath('../resource/reproduce_model')
-    aki_dict, death_dict = read_label(label_path, aki_index=9, death_index=13)
+    aki_dict, death_dict = read_label(label_path)
     data_dict = read_origin_data(data_path)
 
     for experiment_name in setting_dict:
@@ -108,15 +108,14 @@ def read_origin_data(path):
     return data_dict
 
 
-def read_label(path, aki_index, death_index):
+def read_label(path):
     aki_dict = dict()
     death_dict = dict()
-    with open(path, 'r', encoding='utf-8-sig', newline='') as file:
-        csv_reader = csv.reader(file)
-        for line in islice(csv_reader, 1, None):
-            identifier = line[0]+"_"+line[1]
-            aki_dict[identifier] = int(line[aki_index])
-            death_dict[identifier] = int(line[death_index])
+    for patient_id, visit_id, aki, death in read_projected_table(path, ['patient_id', 'visit_id', 'aki', 'death'],
+                                                                 encoding='utf-8-sig'):
+        identifier = patient_id+"_"+visit_id
+        aki_dict[identifier] = int(aki)
+        death_dict[identifier] = int(death)
     return aki_dict, death_dict
 
 
@@ -12,25 +12,20 @@ def main():
 
     rule_dict = read_rule_set(rule_path)
     impute_set = read_imputing_set(impute_path)
-    feature_dict = read_data(data_path)
-    feature_dict = value_transform(feature_dict, impute_set, rule_dict)
-    data_to_write = []
-    head = ['patient_id', 'visit_id']
-    for patient_id in feature_dict:
-        for visit_id in feature_dict[patient_id]:
-            for item in feature_dict[patient_id][visit_id]:
-                head.append(item)
-            break
-        break
-    data_to_write.append(head)
-    for patient_id in feature_dict:
-        for visit_id in feature_dict[patient_id]:
-            line = [patient_id, visit_id]
-            for item in head[2:]:
-                line.append(feature_dict[patient_id][visit_id][item])
-            data_to_write.append(line)
+    # every visit is converted while filtered.csv is read, so that the memory does not grow with the number of
+    # visits (e.g. the all admission output of visit_and_feature_filter.py)
+    head = None
     with open(save_path, 'w', encoding='utf-8-sig', newline='') as file:
-        csv.writer(file).writerows(data_to_write)
+        csv_writer = csv.writer(file)
+        for patient_id, visit_id, visit_feature_dict in iterate_data(data_path):
+            visit_feature_dict = value_transform({patient_id: {visit_id: visit_feature_dict}}, impute_set,
+                                                 rule_dict)[patient_id][visit_id]
+            if head is None:
+                head = ['patient_id', 'visit_id'] + list(visit_feature_dict)
+                csv_writer.writerow(head)
+            csv_writer.writerow([patient_id, visit_id] + [visit_feature_dict[item] for item in head[2:]])
+        if head is None:
+            csv_writer.writerow(['patient_id', 'visit_id'])
 
 
 def value_transform(feature_dict, impute_set, rule_dict):
@@ -77,6 +72,15 @@ def value_transform(feature_dict, impute_set, rule_dict):
 
 def read_data(source_file_path):
     patient_feature_dict = dict()
+    for patient_id, visit_id, visit_feature_dict in iterate_data(source_file_path):
+        if not patient_feature_dict.__contains__(patient_id):
+            patient_feature_dict[patient_id] = dict()
+        patient_feature_dict[patient_id][visit_id] = visit_feature_dict
+    return patient_feature_dict
+
+
+def iterate_data(source_file_path):
+    # yield (patient_id, visit_id, item -> value) of every line
     index_item_dict = dict()
     with open(source_file_path, 'r', encoding='utf-8-sig', newline="") as file:
         csv_reader = csv.reader(file)
@@ -87,14 +91,10 @@ def read_data(source_file_path):
                 for index in range(2, len(line)):
                     index_item_dict[index] = line[index]
                 continue
-            patient_id, visit_id = line[0], line[1]
-            if not patient_feature_dict.__contains__(patient_id):
-                patient_feature_dict[patient_id] = dict()
-            patient_feature_dict[patient_id][visit_id] = dict()
+            visit_feature_dict = dict()
             for index in range(2, len(line)):
-                item_name = index_item_dict[index]
-                patient_feature_dict[patient_id][visit_id][item_name] = float(line[index])
-    return patient_feature_dict
+                visit_feature_dict[index_item_dict[index]] = float(line[index])
+            yield line[0], line[1], visit_feature_dict
 
 
 def read_rule_set(rule_file_path):
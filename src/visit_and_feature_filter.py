@@ -1,297 +1,380 @@
 import os
 import csv
 import re
+from functools import lru_cache
 from itertools import islice
-
-
-def main():
-    patient_delete_missing_rate = 0.3
-    egfr_threshold = 60
+import numpy as np
+from table_scan import read_table_head, read_projected_table
+
+NUMBER_PATTERN = re.compile(r'[-+]?[\d]+(?:,\d\d\d)*[.]?\d*(?:[eE][-+]?\d+)?')
+BINARY_TEXT_SET = {'0', '1', '-1'}
+# age range of the juvenile criterion, and the diagnoses of the admission reason (kept) and kidney function
+# (discarded) criteria. read_raw_mimic_data.py selects its cohort_first candidates with them as well
+MIN_AGE, MAX_AGE = 18, 100
+ADMISSION_REASON_FEATURE = 'HF'
+KIDNEY_DISEASE_FEATURE = 'CKD'
+# features of the visit criteria, read in addition to those written to filtered.csv
+CRITERIA_FEATURE_LIST = ['egfr', KIDNEY_DISEASE_FEATURE, ADMISSION_REASON_FEATURE, 'age']
+# steps of the filter, in the order of the attrition table
+ATTRITION_STEP_LIST = ['un preprocessed data', 'delete illegal data value', 'delete by kidney function',
+                       'delete by admission reason', 'delete juveniles', 'delete visit missing too much']
+# exclusion step of a visit which is left after all steps, see evaluate_cohort
+KEPT_STEP = len(ATTRITION_STEP_LIST)
+
+
+def main(patient_delete_missing_rate=0.3, egfr_threshold=60, long_format=False):
+    # with long_format the admissions of the long format output of read_raw_mimic_data.py are filtered (see
+    # filter_long_format), otherwise those of mimic_unpreprocessed.csv. the visits left after every step are written
+    # to filter_attrition.csv. the units of the features in unit_conversion_list.csv are converted when they are read
     item_list = ["Acute HF", 'egfr', 'diabetes', 'age', 'sex', 'Angiography', 'PCI', 'antiplatelet', 'Anticoagulants',
                  'beta-blocker', 'PositiveInotropicDrugs', 'vasodilator', 'ACEI/ARB', 'CCB', 'diuretic', 'DBP', 'SBP',
                  'BMI', 'Triglycerides', 'TotalProtein', 'ALT', 'Sodium', 'GGT', 'Potassium', 'TotalBilirubin',
                  'HDL-C', 'TnT', 'Hemoglobin', 'Calcium', 'NT-pro-BNP', 'Urea', 'AST', 'LDL-C', 'LVEF', 'VHD',
                  'myocardiopathy', 'CHD', 'stroke', 'AF']
-    reserve_set = set(item_list)
 
     source_file_path = os.path.abspath('../resource/mimic_unpreprocessed.csv')
     target_file_path = os.path.join('../resource/', 'filtered.csv')
-    index_item_dict = get_item_index_dict(source_file_path)
-    feature_dict = read_un_preprocessed_data(source_file_path, index_item_dict)
-    print('un preprocessed data size:' + str(calculate_visit_count(feature_dict)))
-    feature_dict = unit_transform(feature_dict)
-    print('unit transformed')
-    feature_dict = discard_illegal_data_value(feature_dict)
-    print('after delete illegal data value:' + str(calculate_visit_count(feature_dict)))
-    feature_dict = delete_by_kidney_function(feature_dict, egfr_threshold)
-    print('after delete by kidney data size:' + str(calculate_visit_count(feature_dict)))
-    feature_dict = delete_by_admission_reason(feature_dict)
-    print('after delete by admission reason, size:' + str(calculate_visit_count(feature_dict)))
-    feature_dict = delete_juveniles(feature_dict)
-    print('after delete juvenile data size:' + str(calculate_visit_count(feature_dict)))
-    feature_dict = reserve_selected_feature(feature_dict, reserve_set)
-    feature_dict = delete_visit_missing_too_much(feature_dict, patient_delete_missing_rate)
-    print('after delete visit missing too much data, size:' + str(calculate_visit_count(feature_dict)))
-
-    print('final size:' + str(calculate_visit_count(feature_dict)))
-
-    head = ['patient_id', 'visit_id']
-    for item_name in item_list:
-        head.append(item_name)
-    data_to_write = [head]
-    for patient_id in feature_dict:
-        for visit_id in feature_dict[patient_id]:
-            line = list()
-            info_dict = feature_dict[patient_id][visit_id]
-            line.append(patient_id)
-            line.append(visit_id)
-            for item_name in item_list:
-                if not info_dict.__contains__(item_name):
-                    line.append(-1)
-                else:
-                    line.append(info_dict[item_name])
-            data_to_write.append(line)
+    attrition_file_path = os.path.join('../resource/', 'filter_attrition.csv')
+    unit_conversion_path = os.path.abspath('../resource/reproduce_mapping/unit_conversion_list.csv')
+    conversion_dict = read_unit_conversion(unit_conversion_path)
+    feature_set = get_required_feature_set(item_list, conversion_dict)
+    if long_format:
+        count_list = filter_long_format(os.path.abspath('../resource/mimic_unpreprocessed_long.csv'),
+                                        os.path.abspath('../resource/mimic_unpreprocessed_default.csv'),
+                                        target_file_path, item_list, egfr_threshold, patient_delete_missing_rate,
+                                        feature_set, conversion_dict)
+        write_attrition(attrition_file_path, count_list)
+        return
+
+    key_list, frame = read_un_preprocessed_data(source_file_path, feature_set, conversion_dict)
+    exclusion = evaluate_cohort(frame, egfr_threshold)
+    frame = reserve_selected_feature(frame, item_list)
+    feature_type_dict = update_feature_type_dict(frame, exclusion == KEPT_STEP, dict())
+    apply_missing_rate_criterion(frame, exclusion, feature_type_dict, patient_delete_missing_rate)
     with open(target_file_path, 'w', encoding='utf-8-sig', newline='') as file:
-        csv.writer(file).writerows(data_to_write)
-
-
-def reserve_selected_feature(feature_dict, reserve_set):
-    new_feature_dict = dict()
-    for patient_id in feature_dict:
-        new_feature_dict[patient_id] = dict()
-        for visit_id in feature_dict[patient_id]:
-            new_feature_dict[patient_id][visit_id] = dict()
-            for item in reserve_set:
-                if feature_dict[patient_id][visit_id].__contains__(item):
-                    new_feature_dict[patient_id][visit_id][item] = feature_dict[patient_id][visit_id][item]
-    return new_feature_dict
-
-
-def unit_transform(feature_dict):
-    # Scr     1 mg/dL = 88.41 umol/L
-    # Triglycerides  1 mmol/L = 88.6 mg/dl
-    # Glucose 1 mmol/L = 18 mg/dL
-    # TotalBilirubin 1 mg/dL = 17.1 umol/L
-    # TotalProtein 1 g/L = 10 g/dL
-    # Glucose 1 mmol/L = 18 mg/dL
-    # Hemoglobin 1 g/L = 10 g/dL
-    # HDL-C 1 mmol/L = 38.66976 mg/dL
-    # LDL-C 1 mmol/L = 38.66976 mg/dL
-    # Calcium 1 mg/dL = 0.25 mmol/L
-    # UreaNitrogen 2.801 mg/dL = 1 mmol/L Urea
-    for patient_id in feature_dict:
-        for visit_id in feature_dict[patient_id]:
-            try:
-                if float(feature_dict[patient_id][visit_id]['SCr']) >= 0:
-                    feature_dict[patient_id][visit_id]['SCr'] = float(feature_dict[patient_id][visit_id]['SCr']) * 88.41
-            except ValueError:
-                pass
-            try:
-                if float(feature_dict[patient_id][visit_id]['Triglycerides']) >= 0:
-                    feature_dict[patient_id][visit_id]['Triglycerides'] = \
-                        float(feature_dict[patient_id][visit_id]['Triglycerides']) / 88.6
-            except ValueError:
-                pass
-            try:
-                if float(feature_dict[patient_id][visit_id]['Glucose']) >= 0:
-                    feature_dict[patient_id][visit_id]['Glucose'] = \
-                        float(feature_dict[patient_id][visit_id]['Glucose']) / 18
-            except ValueError:
-                pass
-            try:
-                if float(feature_dict[patient_id][visit_id]['TotalBilirubin']) >= 0:
-                    feature_dict[patient_id][visit_id]['TotalBilirubin'] = \
-                        float(feature_dict[patient_id][visit_id]['TotalBilirubin']) * 17.1
-            except ValueError:
-                pass
-            try:
-                if float(feature_dict[patient_id][visit_id]['TotalProtein']) >= 0:
-                    feature_dict[patient_id][visit_id]['TotalProtein'] = \
-                        float(feature_dict[patient_id][visit_id]['TotalProtein']) * 10
-            except ValueError:
-                pass
-            try:
-                if float(feature_dict[patient_id][visit_id]['HDL-C']) >= 0:
-                    feature_dict[patient_id][visit_id]['HDL-C'] = \
-                        float(feature_dict[patient_id][visit_id]['HDL-C']) / 38.66976
-            except ValueError:
-                pass
-            try:
-                if float(feature_dict[patient_id][visit_id]['LDL-C']) >= 0:
-                    feature_dict[patient_id][visit_id]['LDL-C'] = \
-                        float(feature_dict[patient_id][visit_id]['LDL-C']) / 38.66976
-            except ValueError:
-                pass
-            try:
-                if float(feature_dict[patient_id][visit_id]['Calcium']) >= 0:
-                    feature_dict[patient_id][visit_id]['Calcium'] = \
-                        float(feature_dict[patient_id][visit_id]['Calcium']) / 4
-            except ValueError:
-                pass
-            try:
-                if float(feature_dict[patient_id][visit_id]['Hemoglobin']) >= 0:
-                    feature_dict[patient_id][visit_id]['Hemoglobin'] = \
-                        float(feature_dict[patient_id][visit_id]['Hemoglobin']) * 10
-            except ValueError:
-                pass
-            try:
-                if float(feature_dict[patient_id][visit_id]['UreaNitrogen']) >= 0:
-                    feature_dict[patient_id][visit_id]['Urea'] = \
-                        float(feature_dict[patient_id][visit_id]['UreaNitrogen']) / 2.801
-                    feature_dict[patient_id][visit_id].pop('UreaNitrogen')
-            except ValueError:
-                pass
-    return feature_dict
-
-
-def delete_missing_critical_feature(feature_dict, critical_feature_list):
-    delete_visit_set = set()
-    for patient_id in feature_dict:
-        for visit_id in feature_dict[patient_id]:
-            for feature in critical_feature_list:
-                try:
-                    value = float(feature_dict[patient_id][visit_id][feature])
-                    if value < 0:
-                        delete_visit_set.add(patient_id + "_" + visit_id)
-                except ValueError:
-                    delete_visit_set.add(patient_id + "_" + visit_id)
-    for item in delete_visit_set:
-        patient_id, visit_id = item.split("_")
-        feature_dict[patient_id].pop(visit_id)
-    return feature_dict
-
-
-def delete_juveniles(feature_dict, threshold=18):
-    delete_visit_set = set()
-    for patient_id in feature_dict:
-        for visit_id in feature_dict[patient_id]:
-            age = float(feature_dict[patient_id][visit_id]['age'])
-            if age < threshold or age > 100:
-                delete_visit_set.add(patient_id + "_" + visit_id)
-    for item in delete_visit_set:
-        patient_id, visit_id = item.split("_")
-        feature_dict[patient_id].pop(visit_id)
-    return feature_dict
-
-
-def calculate_visit_count(visit_dict):
-    count = 0
-    for patient_id in visit_dict:
-        for _ in visit_dict[patient_id]:
-            count += 1
-    return count
-
-
-def delete_by_kidney_function(feature_dict, egfr_threshold):
-    delete_visit_set = set()
-    for patient_id in feature_dict:
-        for visit_id in feature_dict[patient_id]:
-            try:
-                egfr = float(feature_dict[patient_id][visit_id]['egfr'])
-                kidney_dysfunction = feature_dict[patient_id][visit_id]['CKD']
-                if egfr <= egfr_threshold or kidney_dysfunction == '1' or kidney_dysfunction == 1:
-                    delete_visit_set.add(patient_id + "_" + visit_id)
-            except ValueError:
-                print('egfr value error')
-                continue
-    for item in delete_visit_set:
-        patient_id, visit_id = item.split("_")
-        feature_dict[patient_id].pop(visit_id)
-    return feature_dict
-
-
-def delete_by_admission_reason(feature_dict):
-    delete_visit_set = set()
-    for patient_id in feature_dict:
-        for visit_id in feature_dict[patient_id]:
-            if len(feature_dict[patient_id][visit_id]) == 0:
-                continue
-            value = feature_dict[patient_id][visit_id]['HF']
-            if value != '1':
-                delete_visit_set.add(patient_id + "_" + visit_id)
-    for item in delete_visit_set:
-        patient_id, visit_id = item.split('_')
-        feature_dict[patient_id].pop(visit_id)
-    return feature_dict
-
-
-def delete_visit_missing_too_much(feature_dict, patient_delete_missing_rate):
-    # discard data whose missing rate of numerical data exceeds 0.3
-
+        csv_writer = csv.writer(file)
+        csv_writer.writerow(['patient_id', 'visit_id'] + item_list)
+        write_frame(csv_writer, key_list, frame, exclusion == KEPT_STEP, item_list)
+    write_attrition(attrition_file_path, get_attrition_count_list([exclusion]))
+
+
+class TypedColumn(object):
+    # a feature of all visits of a frame (a dict mapping a feature to its TypedColumn), parsed once when it is read
+    # (see build_typed_frame). value holds the numbers (nan if missing or if a visit lacks the feature), text the str
+    # written to filtered.csv (None if a visit lacks the feature). a binary column has no value other than 0, 1 and
+    # missing
+    def __init__(self, value, text):
+        self.value = value
+        self.text = text
+        self.present = np.not_equal(self.text, None)
+        present_text_set = set(self.text[self.present].tolist())
+        self.binary = present_text_set.issubset(BINARY_TEXT_SET)
+
+
+def evaluate_cohort(frame, egfr_threshold):
+    # the criteria before the missing rate one, the units and the illegal values are handled while the frame is read.
+    # return the exclusion step of every visit, i.e. the index in ATTRITION_STEP_LIST of the first step which
+    # excludes it (KEPT_STEP if none does). every criterion is evaluated once on all visits and the steps are
+    # ascending, so the first one is the smallest step whose criterion fails. the number of visits left after every
+    # step follows from the exclusion steps (see get_attrition_count_list), a new criterion only needs its step and
+    # its mask here
+    criterion_list = [(2, get_kidney_function_mask(frame, egfr_threshold)), (3, get_admission_reason_mask(frame)),
+                      (4, get_juvenile_mask(frame))]
+    exclusion = np.full(get_visit_num(frame), KEPT_STEP, dtype=np.int8)
+    for step, mask in criterion_list:
+        np.minimum(exclusion, np.where(mask, KEPT_STEP, step).astype(np.int8), out=exclusion)
+    return exclusion
+
+
+def apply_missing_rate_criterion(frame, exclusion, feature_type_dict, patient_delete_missing_rate):
+    # exclude the visits left by evaluate_cohort which miss too much data (in place)
+    missing_mask = ~get_missing_rate_mask(frame, feature_type_dict, patient_delete_missing_rate)
+    exclusion[(exclusion == KEPT_STEP) & missing_mask] = KEPT_STEP - 1
+    return exclusion
+
+
+def get_attrition_count_list(exclusion_list):
+    # number of visits left after every step of ATTRITION_STEP_LIST, i.e. those whose exclusion step comes later
+    step_count = np.zeros(KEPT_STEP + 1, dtype=np.int64)
+    for exclusion in exclusion_list:
+        step_count += np.bincount(exclusion, minlength=KEPT_STEP + 1)
+    return [int(step_count[index + 1:].sum()) for index in range(len(ATTRITION_STEP_LIST))]
+
+
+def reserve_selected_feature(frame, item_list):
+    return {item: frame[item] for item in item_list if frame.__contains__(item)}
+
+
+def get_juvenile_mask(frame, min_age=MIN_AGE, max_age=MAX_AGE):
+    # a missing age counts as -1
+    age = frame['age'].value
+    return ~(np.isnan(age) | (age < min_age) | (age > max_age))
+
+
+def get_kidney_function_mask(frame, egfr_threshold):
+    # a missing egfr counts as -1
+    egfr = frame['egfr'].value
+    return ~(np.isnan(egfr) | (egfr <= egfr_threshold) | (frame[KIDNEY_DISEASE_FEATURE].value == 1))
+
+
+def get_admission_reason_mask(frame):
+    return frame[ADMISSION_REASON_FEATURE].value == 1
+
+
+def get_missing_rate_mask(frame, feature_type_dict, patient_delete_missing_rate):
+    # discard data whose missing rate of numerical data exceeds 0.3. a feature which a visit lacks is not missing
+    numerical_feature_list = [item for item in feature_type_dict if feature_type_dict[item]]
+    missing_count = np.zeros(get_visit_num(frame), dtype=np.int64)
+    for item in numerical_feature_list:
+        if frame.__contains__(item):
+            missing_count += np.isnan(frame[item].value) & frame[item].present
+    if len(numerical_feature_list) == 0:
+        return np.ones(len(missing_count), dtype=bool)
+    return ~(missing_count / len(numerical_feature_list) > patient_delete_missing_rate)
+
+
+def update_feature_type_dict(frame, mask, feature_type_dict):
+    # a feature is numerical (True) if any visit of mask has a value other than '0', '1' and '-1' (as written to
+    # filtered.csv). the types depend on the visits which pass the other criteria, so the missing rate criterion is
+    # applied after them. a binary column cannot hold such a value
+    for item in frame:
+        column = frame[item]
+        present = mask & column.present
+        if not present.any():
+            continue
+        numerical = False
+        if not column.binary:
+            text = column.text[present]
+            numerical = bool(np.any((text != '0') & (text != '1') & (text != '-1')))
+        feature_type_dict[item] = feature_type_dict.get(item, False) or numerical
+    return feature_type_dict
+
+
+def filter_long_format(source_file_path, default_file_path, target_file_path, item_list, egfr_threshold,
+                       patient_delete_missing_rate, feature_set, conversion_dict, chunk_size=10000):
+    # the criteria of main, applied to frames of chunk_size visits while the long format file is streamed, so that all
+    # admissions of all patients can be filtered without holding them. the feature types of the missing rate
+    # criterion depend on every visit which passes the other criteria, so the file is streamed twice. the exclusion
+    # steps of the first pass (one byte a visit) are kept for the second one. return the number of visits left after
+    # every step
     feature_type_dict = dict()
-    for patient_id in feature_dict:
-        for visit_id in feature_dict[patient_id]:
-            for item in feature_dict[patient_id][visit_id]:
-                feature_type_dict[item] = False
-    for patient_id in feature_dict:
-        for visit_id in feature_dict[patient_id]:
-            for item in feature_dict[patient_id][visit_id]:
-                value = feature_dict[patient_id][visit_id][item]
-                if value != '0' and value != '1' and value != '-1':
-                    feature_type_dict[item] = True
-    numerical_feature_num = 0
-    for item in feature_type_dict:
-        if feature_type_dict[item]:
-            numerical_feature_num += 1
-
-    discard_visit_set = set()
-    for patient_id in feature_dict:
-        for visit_id in feature_dict[patient_id]:
-            missing_count = 0
-            for item in feature_dict[patient_id][visit_id]:
-                if feature_type_dict[item]:
-                    value = feature_dict[patient_id][visit_id][item]
-                    if value == '-1':
-                        missing_count += 1
-            if missing_count / numerical_feature_num > patient_delete_missing_rate:
-                discard_visit_set.add(patient_id + '_' + visit_id)
-
-    for item in discard_visit_set:
-        patient_id, visit_id = item.split('_')
-        feature_dict[patient_id].pop(visit_id)
-    return feature_dict
-
-
-def read_un_preprocessed_data(source_file_path, index_item_dict):
-    patient_feature_dict = dict()
-    with open(source_file_path, 'r', encoding='utf-8-sig', newline="") as file:
-        csv_reader = csv.reader(file)
-        for line in islice(csv_reader, 2, None):
-            patient_id, visit_id = line[0], line[1]
-            if not patient_feature_dict.__contains__(patient_id):
-                patient_feature_dict[patient_id] = dict()
-            patient_feature_dict[patient_id][visit_id] = dict()
-            for index in range(2, len(line)):
-                item_name = index_item_dict[index]
-                patient_feature_dict[patient_id][visit_id][item_name] = line[index]
-
-    return patient_feature_dict
+    exclusion_list = list()
+    for key_list, frame in read_long_format(source_file_path, default_file_path, feature_set, conversion_dict,
+                                            chunk_size):
+        exclusion = evaluate_cohort(frame, egfr_threshold)
+        update_feature_type_dict(reserve_selected_feature(frame, item_list), exclusion == KEPT_STEP,
+                                 feature_type_dict)
+        exclusion_list.append(exclusion)
 
-
-def discard_illegal_data_value(feature_dict):
+    with open(target_file_path, 'w', encoding='utf-8-sig', newline='') as file:
+        csv_writer = csv.writer(file)
+        csv_writer.writerow(['patient_id', 'visit_id'] + item_list)
+        frame_iterator = read_long_format(source_file_path, default_file_path, feature_set, conversion_dict, chunk_size)
+        for (key_list, frame), exclusion in zip(frame_iterator, exclusion_list):
+            frame = reserve_selected_feature(frame, item_list)
+            apply_missing_rate_criterion(frame, exclusion, feature_type_dict, patient_delete_missing_rate)
+            write_frame(csv_writer, key_list, frame, exclusion == KEPT_STEP, item_list)
+    return get_attrition_count_list(exclusion_list)
+
+
+def read_long_format(source_file_path, default_file_path, feature_set, conversion_dict, chunk_size=10000):
+    # yield (key_list, frame) of every chunk_size visits of a long format file, key_list holds the
+    # (patient_id, visit_id) of the rows of the frame. only the features of feature_set are kept, a feature without a
+    # row takes its default. the rows of a visit are consecutive, so only one chunk is held at a time
+    with open(default_file_path, 'r', encoding='utf-8-sig', newline='') as file:
+        default_list = [(line[0], line[1]) for line in islice(csv.reader(file), 1, None)
+                        if feature_set.__contains__(line[0])]
+    with open(source_file_path, 'r', encoding='utf-8-sig', newline='') as file:
+        csv_reader = csv.reader(file)
+        key_list, visit_feature_dict_list = list(), list()
+        for patient_id, visit_id, item_name, value in islice(csv_reader, 1, None):
+            if len(key_list) == 0 or key_list[-1] != (patient_id, visit_id):
+                if len(key_list) == chunk_size:
+                    yield key_list, build_frame(visit_feature_dict_list, conversion_dict)
+                    key_list, visit_feature_dict_list = list(), list()
+                key_list.append((patient_id, visit_id))
+                visit_feature_dict_list.append(dict(default_list))
+            # a visit whose values are all defaults has a single row without feature
+            if feature_set.__contains__(item_name):
+                visit_feature_dict_list[-1][item_name] = value
+        if len(key_list) > 0:
+            yield key_list, build_frame(visit_feature_dict_list, conversion_dict)
+
+
+def read_un_preprocessed_data(source_file_path, feature_set, conversion_dict):
+    # return (key_list, frame) of the visits, only the columns of the features of feature_set are read. a later row
+    # of the same visit overrides an earlier one and the visits of a patient are kept together in the order of their
+    # first appearance
+    head = read_table_head(source_file_path, encoding='utf-8-sig')
+    feature_list = [item for item in dict.fromkeys(head[2:]) if feature_set.__contains__(item)]
+    patient_line_dict = dict()
+    for line in read_projected_table(source_file_path, head[:2] + feature_list, encoding='utf-8-sig'):
+        patient_id, visit_id = line[0], line[1]
+        if not patient_line_dict.__contains__(patient_id):
+            patient_line_dict[patient_id] = dict()
+        patient_line_dict[patient_id][visit_id] = line
+    key_list = [(patient_id, visit_id) for patient_id in patient_line_dict
+                for visit_id in patient_line_dict[patient_id]]
+    line_list = [patient_line_dict[patient_id][visit_id] for patient_id, visit_id in key_list]
+    frame = build_typed_frame(((feature, [line[index + 2] for line in line_list])
+                               for index, feature in enumerate(feature_list)), conversion_dict)
+    return key_list, frame
+
+
+def get_required_feature_set(item_list, conversion_dict):
+    # features read by the filter: those written to filtered.csv, those of the criteria and the features whose unit
+    # conversion gives one of them (e.g. UreaNitrogen of Urea)
+    feature_set = set(item_list) | set(CRITERIA_FEATURE_LIST)
+    return feature_set | {feature for feature, (target, _, _) in conversion_dict.items()
+                          if feature_set.__contains__(target)}
+
+
+def build_frame(visit_feature_dict_list, conversion_dict):
+    # frame of the visits given as feature -> value dicts
+    feature_list = list(dict.fromkeys(feature for visit_feature_dict in visit_feature_dict_list
+                                      for feature in visit_feature_dict))
+    return build_typed_frame(((feature, [visit_feature_dict.get(feature)
+                                         for visit_feature_dict in visit_feature_dict_list])
+                              for feature in feature_list), conversion_dict)
+
+
+def build_typed_frame(column_iter, conversion_dict):
+    # frame of the (feature, text_list) pairs of column_iter. every column is parsed before the units are converted
+    # (in the order of conversion_dict), so the converted values of a feature whose conversion renames it
+    # (UreaNitrogen) override those of the target feature (Urea) whichever of them comes first
+    frame, conversion_text_list_dict = dict(), dict()
+    for feature, text_list in column_iter:
+        frame[feature] = TypedColumn(*parse_text_list(text_list))
+        if conversion_dict.__contains__(feature):
+            conversion_text_list_dict[feature] = text_list
+    for feature in conversion_dict:
+        if conversion_text_list_dict.__contains__(feature):
+            convert_unit(frame, feature, conversion_text_list_dict[feature], conversion_dict[feature])
+    return frame
+
+
+def convert_unit(frame, feature, text_list, conversion):
+    # convert the unit of a column of frame at once, only its non negative numbers are converted and the missing
+    # values are left alone. the converted values of a feature whose conversion renames it (UreaNitrogen) are moved
+    # to the target feature, which the visits with other values lack
+    target, operation, factor = conversion
+    number = get_float_array(text_list)
+    mask = number >= 0
+    number = number[mask] * factor if operation == '*' else number[mask] / factor
+    converted_value, converted_text = parse_text_list([str(item) for item in number.tolist()])
+    if target != feature:
+        value, text = frame[feature].value, frame[feature].text
+        value[mask], text[mask] = np.nan, None
+        frame[feature] = TypedColumn(value, text)
+    if frame.__contains__(target):
+        target_value, target_text = frame[target].value, frame[target].text
+    else:
+        target_value, target_text = np.full(len(mask), np.nan), np.full(len(mask), None, dtype=object)
+    target_value[mask], target_text[mask] = converted_value, converted_text
+    frame[target] = TypedColumn(target_value, target_text)
+
+
+def parse_text_list(text_list):
+    # the numbers (nan if missing) and the texts (None if a visit lacks the value) of text_list
+    parsed_list = [parse_value(text) for text in text_list]
+    value = np.array([number for number, _ in parsed_list], dtype=np.float64)
+    text = np.empty(len(parsed_list), dtype=object)
+    text[:] = [item for _, item in parsed_list]
+    return value, text
+
+
+@lru_cache(maxsize=1 << 16)
+def parse_value(text):
+    # parse a value of mimic_unpreprocessed.csv once, return (number, text). the text is the first number in the
+    # value, or '-1' if there is none or it is -1 (missing, the number is nan). None is a value the visit lacks
+    if text is None:
+        return np.nan, None
+    text = get_legal_value(text)
+    if text == '-1':
+        return np.nan, text
+    # a thousands separator is allowed in the number
+    return float(text.replace(',', '')), text
+
+
+def get_float_array(text_list):
+    # float of every value, nan if it is not a number or the visit lacks it
+    try:
+        return np.array(text_list, dtype=object).astype(np.float64)
+    except (TypeError, ValueError):
+        return np.array([parse_float(text) for text in text_list], dtype=np.float64)
+
+
+@lru_cache(maxsize=1 << 16)
+def parse_float(text):
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def read_unit_conversion(unit_conversion_path):
+    # feature -> (target feature, operation, factor) of unit_conversion_list.csv. a value of the feature becomes
+    # value * factor or value / factor of the target feature
+    conversion_dict = dict()
+    with open(unit_conversion_path, 'r', encoding='utf-8-sig', newline='') as file:
+        for line in islice(csv.reader(file), 1, None):
+            feature, target, operation, factor = line[0], line[1], line[2], float(line[3])
+            if operation != '*' and operation != '/':
+                raise ValueError('unknown unit conversion operation of {}: {}'.format(feature, operation))
+            conversion_dict[feature] = target, operation, factor
+    return conversion_dict
+
+
+def get_visit_num(frame):
+    for item in frame:
+        return len(frame[item].value)
+    return 0
+
+
+def write_frame(csv_writer, key_list, frame, mask, item_list):
+    # the rows of the visits in mask, a feature a visit lacks is written as -1
+    column_list = [frame[item].text.tolist() if frame.__contains__(item) else None for item in item_list]
+    for row in np.flatnonzero(mask).tolist():
+        line = list(key_list[row])
+        for column in column_list:
+            value = None if column is None else column[row]
+            line.append(-1 if value is None else value)
+        csv_writer.writerow(line)
+
+
+def write_attrition(attrition_file_path, count_list):
+    print('un preprocessed data size:' + str(count_list[0]))
+    print('unit transformed')
+    print('after delete illegal data value:' + str(count_list[1]))
+    print('after delete by kidney data size:' + str(count_list[2]))
+    print('after delete by admission reason, size:' + str(count_list[3]))
+    print('after delete juvenile data size:' + str(count_list[4]))
+    print('after delete visit missing too much data, size:' + str(count_list[5]))
+    print('final size:' + str(count_list[5]))
+    with open(attrition_file_path, 'w', encoding='utf-8-sig', newline='') as file:
+        csv_writer = csv.writer(file)
+        csv_writer.writerow(['step', 'visit_left', 'visit_removed'])
+        for index, step in enumerate(ATTRITION_STEP_LIST):
+            csv_writer.writerow([step, count_list[index],
+                                 count_list[index - 1] - count_list[index] if index > 0 else 0])
+
+
+def get_legal_value(value):
     # 对非蛋白尿的所有数据，将数据不是数值结果的，全部置为-1
     # 对蛋白尿而言，凡出现阴性/neg，-的视为0，可数值化且数值大于5的视为1，弱阳性视为1，定性标记中存在+号的视为1，其余默认为0
-    for patient_id in feature_dict:
-        for visit_id in feature_dict[patient_id]:
-            for item in feature_dict[patient_id][visit_id]:
-                value = str(feature_dict[patient_id][visit_id][item])
-                result_list = re.findall('[-+]?[\d]+(?:,\d\d\d)*[.]?\d*(?:[eE][-+]?\d+)?', value)
-                if len(result_list) > 0 and result_list[0] != '-1' and result_list[0] != '-1.0':
-                    feature_dict[patient_id][visit_id][item] = result_list[0]
-                else:
-                    feature_dict[patient_id][visit_id][item] = '-1'
-    return feature_dict
-
-
-def get_item_index_dict(source_file_path):
-    index_item_dict = dict()
-    with open(source_file_path, 'r', encoding='utf-8-sig', newline="") as file:
-        csv_reader = csv.reader(file)
-        for line in csv_reader:
-            for index in range(2, len(line)):
-                index_item_dict[index] = line[index]
-            break
-    return index_item_dict
+    number = find_first_number(value)
+    if number is not None and number != '-1' and number != '-1.0':
+        return number
+    return '-1'
+
+
+@lru_cache(maxsize=1 << 16)
+def find_first_number(value):
+    # the values repeat heavily (flags, codes, rounded results), so the numbers found in them are memoized
+    result_list = NUMBER_PATTERN.findall(value)
+    if len(result_list) == 0:
+        return None
+    return result_list[0]
 
 
 if __name__ == "__main__":
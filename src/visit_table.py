@@ -0,0 +1,108 @@
+import numpy as np
+from time_codec import MAX_TIME
+
+
+def get_visit_key_list(visit_dict):
+    return [(patient_id, visit_id) for patient_id in visit_dict for visit_id in visit_dict[patient_id]]
+
+
+class VisitIndex(object):
+    # visit_key_list[row] is the (patient_id, visit_id) of a visit, which is also its row in every VisitTable.
+    # HADM_IDs are bounded (100001 - 199999 in MIMIC-III), so the row of a HADM_ID is found in a flat list over the
+    # range instead of nested string dicts
+    def __init__(self, visit_key_list):
+        self.visit_key_list = list(visit_key_list)
+        hadm_id_array = np.array([int(visit_id) for _, visit_id in self.visit_key_list], dtype=np.int64)
+        self.offset = int(hadm_id_array.min()) if len(hadm_id_array) > 0 else 0
+        row_array = np.full(int(hadm_id_array.max()) - self.offset + 1 if len(hadm_id_array) > 0 else 0, -1,
+                            dtype=np.int64)
+        row_array[hadm_id_array - self.offset] = np.arange(len(hadm_id_array))
+        self.row_list = row_array.tolist()
+
+    def __len__(self):
+        return len(self.visit_key_list)
+
+    def get_row(self, patient_id, visit_id):
+        # row of the visit, -1 if the visit is unknown or belongs to another patient
+        if len(visit_id) == 0:
+            return -1
+        index = int(visit_id) - self.offset
+        if index < 0 or index >= len(self.row_list):
+            return -1
+        row = self.row_list[index]
+        if row < 0 or self.visit_key_list[row][0] != patient_id:
+            return -1
+        return row
+
+
+class VisitTable(object):
+    # features of all visits in preallocated arrays. the row of a visit is given by visit_index and column_dict[feature]
+    # is the column of a feature in value (and time). a binary table holds 0/1 flags (int8, default 0), otherwise
+    # value is float64 and nan means missing, which is written as -1. a result which is not numeric (e.g. a lab test
+    # like 'NEG') is kept in text_dict[(row, column)] and overrides value
+    def __init__(self, visit_index, feature_list, binary=False, with_time=False):
+        self.visit_index = visit_index
+        self.feature_list = list(feature_list)
+        self.column_dict = {feature: index for index, feature in enumerate(self.feature_list)}
+        self.binary = binary
+        shape = len(visit_index), len(self.feature_list)
+        if binary:
+            self.value = np.zeros(shape, dtype=np.int8)
+        else:
+            self.value = np.full(shape, np.nan, dtype=np.float64)
+        self.time = np.full(shape, MAX_TIME, dtype=np.int64) if with_time else None
+        self.text_dict = dict()
+
+    def get_row(self, patient_id, visit_id):
+        # -1 if the visit is not in the table
+        return self.visit_index.get_row(patient_id, visit_id)
+
+    def set_value(self, row, column, value, time=None):
+        if isinstance(value, str):
+            self.text_dict[(row, column)] = value
+            self.value[row, column] = np.nan
+        else:
+            self.text_dict.pop((row, column), None)
+            self.value[row, column] = value
+        if time is not None:
+            self.time[row, column] = time
+
+    def get_value(self, row, column):
+        # the value as written to the output, i.e. the text, an int flag, a float or -1 if missing
+        if self.text_dict.__contains__((row, column)):
+            return self.text_dict[(row, column)]
+        value = self.value[row, column].item()
+        if not self.binary and value != value:
+            return -1
+        return value
+
+    def get_value_list(self, row, column_list):
+        value_list = self.value[row].tolist()
+        result_list = list()
+        for column in column_list:
+            if len(self.text_dict) > 0 and self.text_dict.__contains__((row, column)):
+                result_list.append(self.text_dict[(row, column)])
+            elif not self.binary and value_list[column] != value_list[column]:
+                result_list.append(-1)
+            else:
+                result_list.append(value_list[column])
+        return result_list
+
+    def reindex(self, visit_index):
+        # a copy of the table over the visits of another VisitIndex, e.g. after new admissions arrived. visits
+        # which are not in this table get empty rows
+        table = VisitTable(visit_index, self.feature_list, binary=self.binary, with_time=self.time is not None)
+        row_dict = dict()
+        for row, (patient_id, visit_id) in enumerate(self.visit_index.visit_key_list):
+            new_row = visit_index.get_row(patient_id, visit_id)
+            if new_row >= 0:
+                row_dict[row] = new_row
+        row_array = np.array(list(row_dict), dtype=np.int64)
+        new_row_array = np.array([row_dict[row] for row in row_dict], dtype=np.int64)
+        table.value[new_row_array] = self.value[row_array]
+        if table.time is not None:
+            table.time[new_row_array] = self.time[row_array]
+        for (row, column), text in self.text_dict.items():
+            if row_dict.__contains__(row):
+                table.text_dict[(row_dict[row], column)] = text
+        return table
@@ -0,0 +1,68 @@
+import json
+import os
+from table_scan import scan_table, is_compressed, get_row_end, get_scan_watermark
+
+
+def load_watermark_dict(watermark_path):
+    # table name -> watermark of the last run, None if no run recorded its watermarks
+    if not os.path.exists(watermark_path):
+        return None
+    with open(watermark_path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_watermark_dict(watermark_path, watermark_dict):
+    temp_path = watermark_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(watermark_dict, file)
+    os.replace(temp_path, watermark_path)
+
+
+def get_watermark(file_path):
+    # high-water mark of a raw table. an uncompressed table is marked by the end of its last complete row, a
+    # compressed one (which can not be read from an offset) by its largest ROW_ID. the watermark of a table limited
+    # by limit_scan (see table_scan.py) covers the rows its scans read, a compressed table which was not scanned is
+    # read once to find its largest ROW_ID
+    scan_watermark = get_scan_watermark(file_path)
+    if scan_watermark is not None:
+        return scan_watermark
+    if not is_compressed(file_path):
+        return {'byte_offset': get_row_end(file_path)}
+    max_row_id = [0]
+
+    def _consume(line):
+        if len(line) > 0 and int(line[0]) > max_row_id[0]:
+            max_row_id[0] = int(line[0])
+    scan_table(file_path, [_consume])
+    return {'row_id': max_row_id[0]}
+
+
+def scan_table_delta(file_path, consumer_list, watermark):
+    # feed the rows appended after watermark to the consumers and return the new watermark. rows of a table are
+    # expected to be appended only, a table shorter than its watermark requires a full run
+    if not is_compressed(file_path):
+        if not watermark.__contains__('byte_offset'):
+            raise ValueError('watermark of {} is not a byte offset, a full run is required'.format(file_path))
+        end = get_row_end(file_path)
+        if end < watermark['byte_offset']:
+            raise ValueError('{} is shorter than its watermark, a full run is required'.format(file_path))
+        scan_table(file_path, consumer_list, [(watermark['byte_offset'], end)])
+        return {'byte_offset': end}
+
+    if not watermark.__contains__('row_id'):
+        raise ValueError('watermark of {} is not a ROW_ID, a full run is required'.format(file_path))
+    max_row_id = [watermark['row_id']]
+
+    def _consume(line):
+        row_id = int(line[0])
+        if row_id <= watermark['row_id']:
+            return
+        if row_id > max_row_id[0]:
+            max_row_id[0] = row_id
+        kept = False
+        for consumer in consumer_list:
+            if consumer(line):
+                kept = True
+        return kept
+    scan_table(file_path, [_consume])
+    return {'row_id': max_row_id[0]}
@@ -0,0 +1,84 @@
+import math
+from visit_table import VisitTable
+from time_codec import SECONDS_PER_HOUR
+
+AGGREGATE_LIST = ['first', 'last', 'min', 'max', 'mean', 'count']
+
+
+class WindowAggregateTable(object):
+    # aggregates of the numeric records of every feature of a visit within time windows relative to the admission
+    # time, computed in one pass over a table. every (visit row, feature column, window) seen has an accumulator of
+    # constant size, [first value, first time, last value, last time, min, max, sum, count]. a window is
+    # (name, start hour, end hour) and holds the records with start <= hours since admission < end, a bound of None
+    # is unbounded. the first record of equal times (in table order) is the first one, the last is the last one
+    def __init__(self, visit_index, feature_list, window_list, admit_time_list, aggregate_list=AGGREGATE_LIST):
+        self.visit_index = visit_index
+        self.feature_list = list(feature_list)
+        self.column_dict = {feature: index for index, feature in enumerate(self.feature_list)}
+        self.window_list = [tuple(window) for window in window_list]
+        self.aggregate_list = list(aggregate_list)
+        for aggregate in self.aggregate_list:
+            if not AGGREGATE_LIST.__contains__(aggregate):
+                raise ValueError('unknown aggregate: {}'.format(aggregate))
+        # window bounds in seconds since admission
+        self.bound_list = [(-math.inf if start is None else start * SECONDS_PER_HOUR,
+                            math.inf if end is None else end * SECONDS_PER_HOUR) for _, start, end in self.window_list]
+        # admission time of every row of visit_index
+        self.admit_time_list = list(admit_time_list)
+        self.accumulator_dict = dict()
+
+    def update(self, row, column, value, time, accumulator_dict=None):
+        # add a record to the windows holding it, in accumulator_dict if it is given (e.g. a partial result of a
+        # worker, see merge)
+        if accumulator_dict is None:
+            accumulator_dict = self.accumulator_dict
+        offset = time - self.admit_time_list[row]
+        for window, (start, end) in enumerate(self.bound_list):
+            if start <= offset < end:
+                key = row, column, window
+                if accumulator_dict.__contains__(key):
+                    merge_accumulator(accumulator_dict[key], [value, time, value, time, value, value, value, 1])
+                else:
+                    accumulator_dict[key] = [value, time, value, time, value, value, value, 1]
+
+    def merge(self, accumulator_dict):
+        # merge the accumulators of records which come after all records added so far in table order
+        for key, accumulator in accumulator_dict.items():
+            if self.accumulator_dict.__contains__(key):
+                merge_accumulator(self.accumulator_dict[key], accumulator)
+            else:
+                self.accumulator_dict[key] = list(accumulator)
+
+    def get_feature_list(self):
+        return ['{}_{}_{}'.format(feature, name, aggregate) for feature in self.feature_list
+                for name, _, _ in self.window_list for aggregate in self.aggregate_list]
+
+    def to_visit_table(self):
+        # the aggregates as a VisitTable with a column '<feature>_<window>_<aggregate>' each. an aggregate of a
+        # window without records is missing, except the count which is 0
+        table = VisitTable(self.visit_index, self.get_feature_list())
+        for index, aggregate in enumerate(self.aggregate_list):
+            if aggregate == 'count':
+                table.value[:, index::len(self.aggregate_list)] = 0
+        for (row, column, window), accumulator in self.accumulator_dict.items():
+            first_value, _, last_value, _, min_value, max_value, sum_value, count = accumulator
+            value_dict = {'first': first_value, 'last': last_value, 'min': min_value, 'max': max_value,
+                          'mean': sum_value / count, 'count': count}
+            base = (column * len(self.window_list) + window) * len(self.aggregate_list)
+            for index, aggregate in enumerate(self.aggregate_list):
+                table.value[row, base + index] = value_dict[aggregate]
+        return table
+
+
+def merge_accumulator(accumulator, other):
+    # other holds records after those of accumulator in table order
+    if other[1] < accumulator[1]:
+        accumulator[0], accumulator[1] = other[0], other[1]
+    if other[3] >= accumulator[3]:
+        accumulator[2], accumulator[3] = other[2], other[3]
+    if other[4] < accumulator[4]:
+        accumulator[4] = other[4]
+    if other[5] > accumulator[5]:
+        accumulator[5] = other[5]
+    accumulator[6] += other[6]
+    accumulator[7] += other[7]